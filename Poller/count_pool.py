@@ -0,0 +1,207 @@
+# count_pool.py
+# CountPool class, a shared pool of worker processes that all polls count votes in
+# This stops lots of busy polls from starting more counts than there are cores
+import asyncio
+import os
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from functools import partial
+from typing import Any, Callable, Generic, TypeVar
+from metrics import Counter, Gauge, Histogram
+
+# Number of counts that can run at once in each Poller worker,
+# defaulting to the number of cores split between every worker uvicorn starts
+COUNT_WORKERS = int(
+    os.getenv(
+        "COUNT_WORKERS",
+        str(max(1, (os.cpu_count() or 1) // int(os.getenv("WEB_CONCURRENCY", "1")))),
+    )
+)
+# Number of counts that can be waiting for a worker before new ones get turned away
+COUNT_QUEUE_LIMIT = int(os.getenv("COUNT_QUEUE_LIMIT", str(COUNT_WORKERS * 16)))
+
+COUNT_SECONDS = Histogram(
+    "poller_count_seconds",
+    "How long counts take once a worker process starts on them.",
+)
+COUNTS_RUNNING = Gauge("poller_counts_running", "Counts running in worker processes.")
+COUNTS_QUEUED = Gauge("poller_counts_queued", "Counts waiting for a worker process.")
+POOL_RESTARTS = Counter(
+    "poller_count_pool_restarts_total",
+    "Times the worker processes had to be started again after one died.",
+)
+
+T = TypeVar("T")
+
+
+class CountPoolFull(Exception):
+    pass
+
+
+@dataclass(eq=False)
+class _Job(Generic[T]):
+    poll_id: int
+    func: Callable[..., T]
+    args: tuple[Any, ...]
+    result: "asyncio.Future[T]"
+    # When a worker started on it, from time.perf_counter()
+    started: float = 0.0
+    # The executor it was handed to, and whether it's already been requeued
+    # after an executor broke. A job that breaks a second executor could well be
+    # what's killing the workers, so it's failed rather than tried again
+    executor: ProcessPoolExecutor | None = None
+    retried: bool = False
+
+
+class CountPool:
+    workers: int
+    queue_limit: int
+    _executor: ProcessPoolExecutor
+    # Number of jobs currently handed to the executor
+    _running: int
+    # Jobs waiting for a free worker
+    # Each poll only ever has one count waiting or running thanks to its CountScheduler,
+    # so taking jobs in order is fair between polls
+    # Polls that someone is waiting on the results of skip ahead using _priority
+    _priority: "deque[_Job[Any]]"
+    _normal: "deque[_Job[Any]]"
+
+    def __init__(
+        self, workers: int = COUNT_WORKERS, queue_limit: int = COUNT_QUEUE_LIMIT
+    ) -> None:
+        self.workers = max(workers, 1)
+        self.queue_limit = queue_limit
+        # The executor is never given more jobs than it has workers,
+        # so all of the queueing happens here where it can be controlled
+        self._executor = ProcessPoolExecutor(self.workers)
+        self._running = 0
+        self._priority = deque()
+        self._normal = deque()
+
+    @property
+    def queued(self) -> int:
+        return len(self._priority) + len(self._normal)
+
+    @property
+    def running(self) -> int:
+        return self._running
+
+    async def run(
+        self, poll_id: int, func: Callable[..., T], *args: Any, priority: bool = False
+    ) -> T:
+        # Run func(*args) in a worker process once one is free
+        # Raises CountPoolFull rather than queueing forever when overloaded
+        if self.queued >= self.queue_limit:
+            raise CountPoolFull(
+                f"{self.queued} counts are already waiting, not counting poll {poll_id}"
+            )
+
+        job: _Job[T] = _Job(
+            poll_id, func, args, asyncio.get_running_loop().create_future()
+        )
+        if priority:
+            self._priority.append(job)
+        else:
+            self._normal.append(job)
+        self._dispatch()
+
+        try:
+            return await job.result
+        finally:
+            # If the caller gave up (i.e. timed out) before the job started,
+            # don't bother running it
+            if job in self._priority:
+                self._priority.remove(job)
+            elif job in self._normal:
+                self._normal.remove(job)
+
+    def prioritise(self, poll_id: int) -> None:
+        # Move a waiting count for this poll to the front of the line
+        for job in self._normal:
+            if job.poll_id == poll_id:
+                self._normal.remove(job)
+                self._priority.append(job)
+                break
+
+    def update_metrics(self) -> None:
+        COUNTS_RUNNING.set(self._running)
+        COUNTS_QUEUED.set(self.queued)
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _dispatch(self) -> None:
+        # Hand out waiting jobs until all workers are busy
+        loop = asyncio.get_running_loop()
+        while self._running < self.workers and self.queued > 0:
+            if len(self._priority) > 0:
+                job = self._priority.popleft()
+            else:
+                job = self._normal.popleft()
+            if job.result.done():
+                # Caller already gave up on this one
+                continue
+
+            job.started = time.perf_counter()
+            try:
+                worker_future: Future[Any] = self._executor.submit(job.func, *job.args)
+            except BrokenProcessPool as error:
+                # A worker died since the last job was handed out
+                self._restart(self._executor)
+                self._requeue(job, error)
+                continue
+            job.executor = self._executor
+            self._running += 1
+            worker_future.add_done_callback(partial(self._worker_done, loop, job))
+
+    def _restart(self, broken: ProcessPoolExecutor) -> None:
+        # Once one worker process dies, the executor won't take any more jobs,
+        # and every job that was running in it fails with BrokenProcessPool
+        # So swap in a new one, unless that's already happened
+        if broken is not self._executor:
+            return
+        POOL_RESTARTS.inc()
+        broken.shutdown(wait=False, cancel_futures=True)
+        self._executor = ProcessPoolExecutor(self.workers)
+
+    def _requeue(self, job: "_Job[Any]", error: BrokenProcessPool) -> None:
+        # Puts a job that a broken executor couldn't run back at the front of the line,
+        # or fails it if that's already happened once
+        if job.result.done():
+            return
+        if job.retried:
+            job.result.set_exception(error)
+        else:
+            job.retried = True
+            self._priority.appendleft(job)
+
+    def _worker_done(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        job: "_Job[Any]",
+        worker_future: "Future[Any]",
+    ) -> None:
+        # Called from the executor's own thread, so hop back onto the event loop
+        if not loop.is_closed():
+            loop.call_soon_threadsafe(self._finished, job, worker_future)
+
+    def _finished(self, job: "_Job[Any]", worker_future: "Future[Any]") -> None:
+        # Runs on the event loop once a worker is done with a job
+        self._running -= 1
+        COUNT_SECONDS.observe(time.perf_counter() - job.started)
+        error = None if worker_future.cancelled() else worker_future.exception()
+        if isinstance(error, BrokenProcessPool):
+            assert job.executor is not None
+            self._restart(job.executor)
+            self._requeue(job, error)
+        elif not job.result.done():
+            if worker_future.cancelled():
+                job.result.cancel()
+            elif error is not None:
+                job.result.set_exception(error)
+            else:
+                job.result.set_result(worker_future.result())
+        self._dispatch()
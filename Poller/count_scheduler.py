@@ -0,0 +1,119 @@
+# count_scheduler.py
+# CountScheduler class, which decides when a poll's votes get recounted
+# Rather than counting once per vote, votes that arrive close together
+# get bunched up into a single count, and only one count runs at a time
+import asyncio
+import os
+import time
+from typing import Awaitable, Callable
+
+# How long to wait for votes to stop arriving before counting, in seconds
+COUNT_MIN_INTERVAL = float(os.getenv("COUNT_MIN_INTERVAL", "0.1"))
+# The longest a vote can be left uncounted while votes keep arriving, in seconds
+COUNT_MAX_STALENESS = float(os.getenv("COUNT_MAX_STALENESS", "2.0"))
+
+
+class CountScheduler:
+    min_interval: float
+    max_staleness: float
+    # How long the last count took, in seconds
+    last_latency: float | None
+    _run_count: Callable[[], Awaitable[None]]
+    # The task currently running counts, if any
+    _task: "asyncio.Task[None] | None"
+    # Time of the first and most recent requests that haven't been counted yet
+    _first_request: float | None
+    _last_request: float
+    # Set to skip waiting for more votes and count as soon as possible
+    _urgent: asyncio.Event
+    # Each request gets a number, and each count records the newest number it covers
+    # This lets flush() wait for a count that started after it was called
+    _requested: int
+    _completed: int
+    _completed_condition: asyncio.Condition
+
+    def __init__(
+        self,
+        run_count: Callable[[], Awaitable[None]],
+        min_interval: float = COUNT_MIN_INTERVAL,
+        max_staleness: float = COUNT_MAX_STALENESS,
+    ) -> None:
+        self._run_count = run_count
+        self.min_interval = min_interval
+        self.max_staleness = max_staleness
+        self.last_latency = None
+        self._task = None
+        self._first_request = None
+        self._last_request = 0.0
+        self._urgent = asyncio.Event()
+        self._requested = 0
+        self._completed = 0
+        self._completed_condition = asyncio.Condition()
+
+    @property
+    def running(self) -> bool:
+        # If a count is currently waiting to run, or running
+        return self._task is not None
+
+    def request(self, urgent: bool = False) -> int:
+        # Ask for a count to happen soon
+        # Requests made while a count is running all get rolled into one follow up count
+        now = time.monotonic()
+        if self._first_request is None:
+            self._first_request = now
+        self._last_request = now
+        self._requested += 1
+        if urgent:
+            self._urgent.set()
+
+        if self._task is None:
+            self._task = asyncio.create_task(self._count_loop())
+        return self._requested
+
+    async def flush(self) -> None:
+        # Count straight away, and wait until a count covering everything
+        # requested up until now has finished
+        target = self.request(True)
+        async with self._completed_condition:
+            await self._completed_condition.wait_for(lambda: self._completed >= target)
+
+    async def _count_loop(self) -> None:
+        # Keep counting until there's nothing left that was requested
+        while self._first_request is not None:
+            await self._wait_for_quiet()
+
+            # Everything requested so far gets covered by this count
+            covered = self._requested
+            self._first_request = None
+            self._urgent.clear()
+
+            start = time.monotonic()
+            try:
+                await self._run_count()
+            except Exception as error:
+                # Don't let one bad count stop all future counts
+                print(f"Error! Count failed with {error!r}")
+            self.last_latency = time.monotonic() - start
+
+            async with self._completed_condition:
+                self._completed = covered
+                self._completed_condition.notify_all()
+        self._task = None
+
+    async def _wait_for_quiet(self) -> None:
+        # Wait until votes stop arriving for min_interval,
+        # or until the oldest uncounted request hits max_staleness
+        while not self._urgent.is_set():
+            assert self._first_request is not None
+            start_at = min(
+                self._last_request + self.min_interval,
+                self._first_request + self.max_staleness,
+            )
+            delay = start_at - time.monotonic()
+            if delay <= 0:
+                break
+            try:
+                await asyncio.wait_for(self._urgent.wait(), delay)
+            except TimeoutError:
+                # Go round again in case more votes came in while sleeping
+                pass
@@ -0,0 +1,72 @@
+# file_lock.py
+# FileLock class, a lock that works across processes using flock
+# Poller can run as several worker processes sharing one polls folder,
+# and asyncio locks only stop other tasks in the same process
+import asyncio
+import fcntl
+import os
+from pathlib import Path
+from types import TracebackType
+
+
+class FileLock:
+    path: Path
+    # Open file holding the lock, None when not held
+    _fd: int | None
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._fd = None
+
+    def acquire(self) -> None:
+        # Blocks until every other holder has let go
+        # flock locks belong to the open file, so tasks in the same process
+        # each opening the lock file also wait on each other
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        except BaseException:
+            os.close(fd)
+            raise
+        self._fd = fd
+
+    def release(self) -> None:
+        assert self._fd is not None, "FileLock released without being held"
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+        os.close(self._fd)
+        self._fd = None
+
+    def __enter__(self) -> "FileLock":
+        self.acquire()
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        self.release()
+
+    async def __aenter__(self) -> "FileLock":
+        # Waiting happens in a thread, to keep it off the event loop
+        acquiring = asyncio.ensure_future(asyncio.to_thread(self.acquire))
+        try:
+            await asyncio.shield(acquiring)
+        except asyncio.CancelledError:
+            # The thread can't be stopped, so let go as soon as it gets the lock
+            acquiring.add_done_callback(self._release_if_held)
+            raise
+        return self
+
+    def _release_if_held(self, _: "asyncio.Future[None]") -> None:
+        if self._fd is not None:
+            self.release()
+
+    async def __aexit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        self.release()
@@ -1,17 +1,33 @@
-from quart import Quart, abort, Response, send_file
-from quart_schema import QuartSchema, validate_request, validate_response
+from quart import Quart, abort, Response, request
+from quart_schema import (
+    QuartSchema,
+    validate_request,
+    validate_response,
+    validate_querystring,
+    document_response,
+)
 from quart_cors import cors
 import os
+import asyncio
+import time
+from functools import wraps
+from typing import AsyncIterator, Awaitable, Callable, NoReturn, ParamSpec, TypeVar
 from poll_data import (
     NewPoll,
     PollData,
     PollResults,
+    PollTrace,
     PollSummary,
+    PollListQuery,
     Vote,
+    VoteBatch,
+    VoteBatchResults,
     SpecificPoll,
     ValidationError,
 )
 from poll_manager import PollManager
+from single_poll import ResultsNotReady
+from metrics import Histogram, render_metrics, CONTENT_TYPE
 
 app = Quart(__name__)
 
@@ -26,50 +42,190 @@ if allowed_origin is not None:
         allow_methods=["GET", "POST"],
         max_age=600,
         allow_credentials=False,
-        allow_headers=["Content-Type"],
-        expose_headers=[],
+        allow_headers=["Content-Type", "If-None-Match"],
+        expose_headers=["Next-Cursor", "ETag"],
         send_origin_wildcard=False,
     )
 
 poll_manager = PollManager()
+# How often to send something down idle result streams, in seconds
+# Keeps proxies from closing them, and notices when clients have gone away
+STREAM_KEEPALIVE = 15.0
+# How long to tell clients to wait before asking again for results
+# that haven't been counted yet, in seconds
+RESULTS_RETRY_AFTER = 2
+
+# Filled in by timed, with each route it's used on
+REQUEST_SECONDS = Histogram(
+    "poller_request_seconds",
+    "How long each route takes to respond, not counting streaming the body.",
+    label="route",
+    label_values=(),
+)
+
+P = ParamSpec("P")
+R = TypeVar("R")
+
+
+def timed(
+    route: str,
+) -> Callable[[Callable[P, Awaitable[R]]], Callable[P, Awaitable[R]]]:
+    # Records how long a route takes in REQUEST_SECONDS, including requests that
+    # fail validation or abort. Goes straight under the app.get or app.post line
+    # The label is made here, so handling requests never has to add one
+    REQUEST_SECONDS.add_label_value(route)
+
+    def decorator(func: Callable[P, Awaitable[R]]) -> Callable[P, Awaitable[R]]:
+        @wraps(func)
+        async def wrapper(*args: P.args, **kwargs: P.kwargs) -> R:
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                REQUEST_SECONDS.observe(time.perf_counter() - start, route)
+
+        return wrapper
+
+    return decorator
+
+
+def cached_response(body: bytes, etag: str) -> Response:
+    # Send already encoded json, or just a 304 if the client already has it
+    response: Response
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(body, 200, mimetype="application/json")
+    response.set_etag(etag)
+    # Clients can keep a copy, but should check it's still current each time
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+def not_ready() -> NoReturn:
+    # For when a poll hasn't managed to be counted yet,
+    # i.e. Poller's too busy or the count hit an error
+    response = Response("Results aren't ready yet, try again soon", 503)
+    response.headers["Retry-After"] = str(RESULTS_RETRY_AFTER)
+    abort(response)
+
+
+@app.after_serving
+async def shutdown() -> None:
+    await poll_manager.close()
+
+
+@app.get("/metrics")
+async def metrics() -> Response:
+    # For Prometheus to scrape, see metrics.py
+    poll_manager.update_metrics()
+    return Response(render_metrics(), 200, content_type=CONTENT_TYPE)
 
 
 @app.get("/get_polls")
-@validate_response(list[PollSummary])
-async def get_polls() -> list[PollSummary]:
-    return poll_manager.poll_list()
+@timed("/get_polls")
+@validate_querystring(PollListQuery)
+@document_response(list[PollSummary])
+async def get_polls(query_args: PollListQuery) -> Response:
+    # Newest polls first, optionally a page at a time
+    # The ID to pass as the cursor for the next page is sent in the Next-Cursor header
+    if query_args.limit is not None and query_args.limit < 1:
+        abort(Response("Limit must be at least 1", 400))
+    # The poll list is already encoded, so skip validate_response
+    body, next_cursor = poll_manager.poll_list_json(query_args.cursor, query_args.limit)
+    response = Response(body, 200, mimetype="application/json")
+    if next_cursor is not None:
+        response.headers["Next-Cursor"] = str(next_cursor)
+    return response
 
 
 # This would be a get
 # But I literally can't see any documentation for making a GET query in quart
 @app.post("/get_poll_details")  # pyright:ignore
+@timed("/get_poll_details")
 @validate_request(SpecificPoll)
-@validate_response(PollData)
-async def get_poll_details(data: SpecificPoll) -> PollData:
+@document_response(PollData)
+async def get_poll_details(data: SpecificPoll) -> Response:
     poll_id = data.election_id
     try:
-        poll = poll_manager.polls[poll_id]
+        poll = await poll_manager.get_poll(poll_id)
     except KeyError:
         abort(Response("Invalid Poll ID", 400))
-    return poll.config
+    return cached_response(*poll.details_json())
 
 
 @app.post("/get_poll_results")  # pyright:ignore
+@timed("/get_poll_results")
 @validate_request(SpecificPoll)
-@validate_response(PollResults)
-async def get_poll_results(data: SpecificPoll) -> PollResults:
+@document_response(PollResults)
+async def get_poll_results(data: SpecificPoll) -> Response:
     poll_id = data.election_id
     try:
-        poll = poll_manager.polls[poll_id]
+        poll = await poll_manager.get_poll(poll_id)
     except KeyError:
         abort(Response("Invalid Poll ID", 400))
-    return await poll.get_results(True)
+    try:
+        return cached_response(*await poll.results_json(True))
+    except ResultsNotReady:
+        not_ready()
 
 
 # Absolutely no clue why my code editor doesn't like this line
 # But the code works and mypy --strict doesn't complain
 # And a #type: ignore comment makes mypy complain about an unused ignore
+@app.post("/get_poll_trace")  # pyright:ignore
+@timed("/get_poll_trace")
+@validate_request(SpecificPoll)
+@document_response(PollTrace)
+async def get_poll_trace(data: SpecificPoll) -> Response:
+    # What happened each round of the count behind the current results
+    poll_id = data.election_id
+    try:
+        poll = await poll_manager.get_poll(poll_id)
+    except KeyError:
+        abort(Response("Invalid Poll ID", 400))
+    try:
+        return cached_response(*await poll.trace_json())
+    except ResultsNotReady:
+        not_ready()
+
+
+@app.get("/poll_results_stream")
+@timed("/poll_results_stream")
+@validate_querystring(SpecificPoll)
+async def poll_results_stream(query_args: SpecificPoll) -> Response:
+    # Server-sent events, sending the poll results every time they change
+    # Clients that fall too far behind get disconnected, and can reconnect
+    try:
+        poll = await poll_manager.get_poll(query_args.election_id)
+    except KeyError:
+        abort(Response("Invalid Poll ID", 400))
+    events = poll.subscribe()
+
+    async def stream() -> AsyncIterator[bytes]:
+        try:
+            while True:
+                try:
+                    event = await asyncio.wait_for(events.get(), STREAM_KEEPALIVE)
+                except TimeoutError:
+                    yield b": keepalive\n\n"
+                    continue
+                if event is None:
+                    # Dropped for being too slow, or Poller is shutting down
+                    break
+                yield event
+        finally:
+            poll.unsubscribe(events)
+
+    response = Response(stream(), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    # Streams stay open for as long as the client wants
+    response.timeout = None
+    return response
+
+
 @app.post("/submit_poll")  # pyright: ignore
+@timed("/submit_poll")
 @validate_request(NewPoll)
 @validate_response(SpecificPoll)
 async def submit_poll(data: NewPoll) -> SpecificPoll:
@@ -83,10 +239,11 @@ async def submit_poll(data: NewPoll) -> SpecificPoll:
 
 
 @app.post("/submit_vote")
+@timed("/submit_vote")
 @validate_request(Vote)
 async def submit_vote(data: Vote) -> Response:
     try:
-        poll_manager.validate_vote(data)
+        await poll_manager.validate_vote(data)
     except ValidationError as error:
         abort(Response(str(error), 400))
     poll_manager.add_vote(data)
@@ -94,15 +251,33 @@ async def submit_vote(data: Vote) -> Response:
     return Response("OK", 200)
 
 
+@app.post("/submit_votes")
+@timed("/submit_votes")
+@validate_request(VoteBatch)
+@validate_response(VoteBatchResults)
+async def submit_votes(data: VoteBatch) -> VoteBatchResults:
+    # Many ballots for the same poll at once, for bulk imports
+    # Invalid ballots are skipped rather than failing the whole request
+    try:
+        return await poll_manager.add_votes(data)
+    except ValidationError as error:
+        abort(Response(str(error), 400))
+
+
 @app.post("/download_all_votes")
+@timed("/download_all_votes")
 @validate_request(SpecificPoll)
 async def download_all_votes(data: SpecificPoll) -> Response:
     # Download entire contents of relevant poll file
     response: Response
-    if data.election_id in poll_manager.polls:
+    try:
+        poll = await poll_manager.get_poll(data.election_id)
+    except KeyError:
+        poll = None
+    if poll is not None:
         # Poll is present
-        # Read votes path from poll and use with quart's built-in send_file
-        response = await send_file(poll_manager.polls[data.election_id].votes_path)
+        # Votes are stored in a binary vote log, so convert them to csv on the way out
+        response = Response(poll.iter_votes_csv(), mimetype="text/csv")
     else:
         # Poll not found
         response = Response("Poll not found", 404)
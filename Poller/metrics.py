@@ -0,0 +1,185 @@
+# metrics.py
+# Counters and histograms for the /metrics endpoint, in Prometheus' text format
+# Every label value a metric can have is set up front, so recording something
+# is just a dict lookup and adding to a number that's already there,
+# with no locks (everything runs on the event loop) and nothing new to make
+# Each Poller worker keeps its own, so with several workers each scrape
+# only sees whichever worker answered it
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from typing import Iterable
+
+# Buckets for anything measured in seconds
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+
+# Every metric, in the order they were made
+REGISTRY: "list[Metric]" = []
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(label: str | None, value: str, extra: str = "") -> str:
+    # Formats the {label="value"} part of a sample line
+    parts = []
+    if label is not None:
+        parts.append(f'{label}="{_escape(value)}"')
+    if extra != "":
+        parts.append(extra)
+    if len(parts) == 0:
+        return ""
+    return "{" + ",".join(parts) + "}"
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, int) or value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class Metric(ABC):
+    name: str
+    help: str
+    type: str
+    # The label this metric is split up by, if any
+    label: str | None
+
+    def __init__(self, name: str, help: str, label: str | None) -> None:
+        self.name = name
+        self.help = help
+        self.label = label
+        REGISTRY.append(self)
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.type}"
+        yield from self.samples()
+
+    @abstractmethod
+    def samples(self) -> Iterable[str]: ...
+
+
+class Counter(Metric):
+    type = "counter"
+    # Indexed by label value, or just "" when there's no label
+    values: dict[str, float]
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        label: str | None = None,
+        label_values: Iterable[str] = ("",),
+    ) -> None:
+        super().__init__(name, help, label)
+        self.values = {value: 0 for value in label_values}
+
+    def inc(self, amount: float = 1, label_value: str = "") -> None:
+        # Raises KeyError for a label value that wasn't given up front
+        self.values[label_value] += amount
+
+    def samples(self) -> Iterable[str]:
+        for label_value, value in self.values.items():
+            yield f"{self.name}{_labels(self.label, label_value)} {_number(value)}"
+
+
+class Gauge(Metric):
+    type = "gauge"
+    # Filled in just before each scrape, so label values can come and go
+    values: dict[str, float]
+
+    def __init__(self, name: str, help: str, label: str | None = None) -> None:
+        super().__init__(name, help, label)
+        self.values = {"": 0} if label is None else {}
+
+    def set(self, value: float, label_value: str = "") -> None:
+        self.values[label_value] = value
+
+    def samples(self) -> Iterable[str]:
+        for label_value, value in self.values.items():
+            yield f"{self.name}{_labels(self.label, label_value)} {_number(value)}"
+
+
+class _Buckets:
+    # How many observations landed in each bucket, plus one more for anything
+    # bigger than the biggest bucket
+    counts: list[int]
+    total: float
+
+    def __init__(self, bucket_count: int) -> None:
+        self.counts = [0] * (bucket_count + 1)
+        self.total = 0.0
+
+
+class Histogram(Metric):
+    type = "histogram"
+    buckets: tuple[float, ...]
+    # Indexed by label value, or just "" when there's no label
+    children: dict[str, _Buckets]
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+        label: str | None = None,
+        label_values: Iterable[str] = ("",),
+    ) -> None:
+        super().__init__(name, help, label)
+        self.buckets = buckets
+        self.children = {value: _Buckets(len(buckets)) for value in label_values}
+
+    def add_label_value(self, label_value: str) -> None:
+        # For label values that aren't known until Poller starts, like routes
+        if label_value not in self.children:
+            self.children[label_value] = _Buckets(len(self.buckets))
+
+    def observe(self, value: float, label_value: str = "") -> None:
+        # Raises KeyError for a label value that wasn't given up front
+        # bisect_left puts values equal to a bucket's bound in that bucket,
+        # as Prometheus buckets are less than or equal
+        child = self.children[label_value]
+        child.counts[bisect_left(self.buckets, value)] += 1
+        child.total += value
+
+    def samples(self) -> Iterable[str]:
+        for label_value, child in self.children.items():
+            # Buckets in the text format count everything up to their bound
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+                cumulative += count
+                labels = _labels(self.label, label_value, f'le="{_number(bound)}"')
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _labels(self.label, label_value)
+            yield f"{self.name}_sum{labels} {_number(child.total)}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+def render_metrics() -> str:
+    lines: list[str] = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    lines.append("")
+    return "\n".join(lines)
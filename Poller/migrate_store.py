@@ -0,0 +1,109 @@
+# migrate_store.py
+# Copies every poll in a polls folder into a SQLite database,
+# for moving over to POLL_STORE=sqlite. Run from the Poller folder, with Poller stopped:
+#   python migrate_store.py polls polls.db
+# Polls already in the database are skipped, so it's safe to run again
+# Saved results aren't copied, so each poll gets recounted the first time it's loaded
+import argparse
+import sqlite3
+import tempfile
+from itertools import islice
+from pathlib import Path
+
+import msgspec
+
+from poll_data import PollData
+from poll_store import (
+    FolderStore,
+    CONFIG_NAME,
+    VOTES_NAME,
+    LEGACY_VOTES_NAME,
+)
+
+import teller_path  # noqa: F401
+from vote_log import csv_to_log, iter_log_records  # noqa: E402
+from vote_db import connect  # noqa: E402
+
+# Ballots inserted per executemany
+INSERT_BATCH_SIZE = 10000
+
+
+def migrate_poll(connection: sqlite3.Connection, folder: Path) -> int:
+    # Copies a single poll folder in, returning how many ballots it had
+    with open(folder / CONFIG_NAME, "rb") as f:
+        config = msgspec.json.decode(f.read(), type=PollData)
+
+    with tempfile.TemporaryDirectory() as temp:
+        votes_path = folder / VOTES_NAME
+        if not votes_path.is_file():
+            # Polls from before vote logs only have a votes csv
+            votes_path = Path(temp) / VOTES_NAME
+            csv_to_log(
+                folder / LEGACY_VOTES_NAME, votes_path, len(config.candidate_names)
+            )
+
+        # All in one transaction, so a poll is either all there or not at all
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.execute(
+                "INSERT INTO polls (id, name, config) VALUES (?, ?, ?)",
+                (config.election_id, config.election_name, msgspec.json.encode(config)),
+            )
+            ballots = 0
+            log_bytes = 0
+            records = iter_log_records(votes_path)
+            while True:
+                batch = list(islice(records, INSERT_BATCH_SIZE))
+                if len(batch) == 0:
+                    break
+                connection.executemany(
+                    "INSERT INTO ballots (poll_id, ballot) VALUES (?, ?)",
+                    [(config.election_id, record) for record in batch],
+                )
+                ballots += len(batch)
+                log_bytes += sum([len(record) for record in batch])
+            connection.execute(
+                "UPDATE polls SET log_bytes = ? WHERE id = ?",
+                (log_bytes, config.election_id),
+            )
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+    return ballots
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        "migrate_store",
+        description="Copy every poll in a polls folder into a SQLite database.",
+    )
+    parser.add_argument("folder", type=Path, help="The polls folder to copy from.")
+    parser.add_argument(
+        "database", type=Path, help="The database to copy into, made if needed."
+    )
+    args = parser.parse_args()
+
+    folder: Path = args.folder
+    assert folder.is_dir(), f"No folder found at {folder}"
+
+    # Builds the index if it's missing
+    summaries = FolderStore(folder).read_index() or []
+    connection = connect(args.database)
+    try:
+        for summary in summaries:
+            poll_id = summary.election_id
+            exists = connection.execute(
+                "SELECT 1 FROM polls WHERE id = ?", (poll_id,)
+            ).fetchone()
+            if exists is not None:
+                print(f"Skipping poll {poll_id}, it's already in {args.database}")
+                continue
+            ballots = migrate_poll(connection, folder / str(poll_id))
+            print(f"Copied poll {poll_id} with {ballots} ballots")
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    main()
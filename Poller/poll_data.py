@@ -1,4 +1,4 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
 
 class ValidationError(Exception):
@@ -14,6 +14,12 @@ class NewPoll:
     candidate_names: list[str]
     candidate_descriptions: list[str]
     randomise_order: bool
+    # "float" or "fixed", see Teller/tally.py
+    # Keyword only so that PollData can still add fields without defaults
+    count_mode: str = field(default="float", kw_only=True)
+    # Shortcuts that cut down on rounds when counting, see Teller/ALGORITHM.md
+    bulk_exclusion: bool = field(default=False, kw_only=True)
+    early_termination: bool = field(default=False, kw_only=True)
 
 
 # PollData is the actually stored data class,
@@ -30,18 +36,63 @@ class PollResults:
     first_preferences: list[int]
 
 
+# How a count went, see Teller/count_trace.py
+# Each list has an entry for each round of the count
+@dataclass
+class PollTrace:
+    quota: int
+    total_votes: int
+    tallies: list[list[float]]
+    exhausted: list[float]
+    actions: list[str]
+    candidates: list[list[int]]
+    transfer_values: list[float | None]
+
+
+# The last results a poll counted, saved so they don't need recounting on restart
+@dataclass
+class ResultsSnapshot:
+    results: PollResults
+    trace: PollTrace
+    # Position in the vote log when it was counted, see poll_store.py
+    # For poll folders this is the vote log's size in bytes
+    # If the vote log is still at this position then the results are up to date
+    log_size: int
+
+
 @dataclass
 class PollSummary:
     election_name: str
     election_id: int
 
 
+@dataclass
+class PollListQuery:
+    # Only list polls older than this ID, for getting the next page
+    cursor: int | None = None
+    # Most polls to list, or every poll if not given
+    limit: int | None = None
+
+
 @dataclass
 class Vote:
     election_id: int
     preferences: list[int]
 
 
+@dataclass
+class VoteBatch:
+    election_id: int
+    ballots: list[list[int]]
+
+
+@dataclass
+class VoteBatchResults:
+    accepted: int
+    # For each ballot, None if it was accepted, otherwise why it was rejected
+    errors: list[str | None]
+
+
 @dataclass
 class SpecificPoll:
     election_id: int
@@ -1,125 +1,286 @@
 # poll_manager.py
 # Poll Manager Class which manages various polls
-from pathlib import Path
+import msgspec
+import os
+import asyncio
+from bisect import bisect_left
+from collections import OrderedDict
 from single_poll import SinglePoll
-from poll_data import PollSummary, NewPoll, PollData, Vote, ValidationError
-from dataclasses import asdict
+from count_pool import CountPool
+from poll_store import PollStore, make_store, POLL_STORE, POLL_STORE_LOCATION
+from metrics import Counter, Gauge
+from poll_data import (
+    PollSummary,
+    NewPoll,
+    PollData,
+    Vote,
+    VoteBatch,
+    VoteBatchResults,
+    ValidationError,
+)
 from asyncio import Lock
 
-DEFAULT_FOLDER = "polls"
+import teller_path  # noqa: F401
+from tally import COUNT_MODES  # noqa: E402
+
 MAX_POLLS: int | None = 100
+# Most polls to keep loaded in memory at once
+# Polls that haven't been used in a while get unloaded past this,
+# unless they have votes waiting to be written or counted
+MAX_LOADED_POLLS = int(os.getenv("MAX_LOADED_POLLS", "256"))
+# Most ballots that can be sent to /submit_votes at once
+MAX_VOTE_BATCH = 10000
+# Most pages of the poll list to keep encoded at once
+MAX_CACHED_PAGES = 256
+
+# Every reason a vote can be turned away for
+UNKNOWN_POLL = "Unknown poll"
+BAD_LENGTH = "Invalid number of preferences"
+TOO_SHORT = "Not enough preferences"
+OUT_OF_BOUNDS = "Preference out of bounds"
+DUPLICATE_PREFERENCE = "Preferenced the same candidate multiple times"
+REJECT_REASONS = [
+    UNKNOWN_POLL,
+    BAD_LENGTH,
+    TOO_SHORT,
+    OUT_OF_BOUNDS,
+    DUPLICATE_PREFERENCE,
+]
+
+VOTES_ACCEPTED = Counter("poller_votes_accepted_total", "Votes that passed validation.")
+VOTES_REJECTED = Counter(
+    "poller_votes_rejected_total",
+    "Votes turned away for being invalid.",
+    "reason",
+    REJECT_REASONS,
+)
+LOADED_POLLS = Gauge("poller_loaded_polls", "Polls currently loaded in memory.")
+PENDING_VOTES = Gauge(
+    "poller_pending_votes",
+    "Votes waiting to be written to each loaded poll's vote log.",
+    "poll",
+)
 
 
 class PollManager:
-    polls: dict[int, SinglePoll]
-    folder: Path
+    # Every poll there is, loaded or not
+    summaries: dict[int, PollSummary]
+    # Polls currently loaded, least recently used first
+    _loaded: OrderedDict[int, SinglePoll]
+    # Polls being loaded right now, so two requests don't load the same poll twice
+    _loading: dict[int, "asyncio.Task[SinglePoll]"]
+    # Unloaded polls that are still closing their vote logs
+    _closing: set["asyncio.Task[None]"]
+    # Where every poll is kept, see poll_store.py
+    store: PollStore
+    # Every poll counts votes using this, to limit how many counts run at once
+    count_pool: CountPool
+    # Every poll ID from oldest to newest, kept sorted as polls get added
+    _poll_order: list[int]
+    # Encoded pages of the poll list and the cursor for the page after,
+    # by cursor and limit. Cleared whenever a poll gets added
+    _list_cache: dict[tuple[int | None, int | None], tuple[bytes, int | None]]
     _manager_lock: Lock
 
-    def __init__(self, folder: str = DEFAULT_FOLDER) -> None:
+    def __init__(self, store: PollStore | None = None) -> None:
         self._manager_lock = Lock()
-        # Create folder if doesn't exist
-        folder_path = Path(folder)
-        # This will raise error if path is taken by non folder object
-        folder_path.mkdir(exist_ok=True)
-        self.folder = folder_path
-
-        self.polls = dict()
-
-        # Check for existing polls
-        for child in folder_path.iterdir():
-            # Only check children
-            if child.is_dir():
-                # If folder contains valid files then create sub-poll
-                config_path, votes_path = self._get_config_votes_paths(child)
-                if config_path.is_file() and votes_path.is_file():
-                    new_poll = SinglePoll.from_file(config_path, votes_path)
-                    if new_poll.config.election_id in self.polls:
-                        print(
-                            f"Warning: Multiple polls using ID {new_poll.config.election_id}"
-                        )
-                    self.polls[new_poll.config.election_id] = new_poll
-                else:
-                    print(
-                        f"Warning: folder {child} is in poll folder but doesn't contain poll files"
-                    )
-            else:
-                print(f"Warning: non poll file {child} is in poll folder")
+        self.count_pool = CountPool()
+        self.store = (
+            store if store is not None else make_store(POLL_STORE, POLL_STORE_LOCATION)
+        )
+
+        self._loaded = OrderedDict()
+        self._loading = dict()
+        self._closing = set()
+        self._list_cache = dict()
+
+        # Polls are only read in when they're first used,
+        # so at startup all that's needed is the index
+        self.summaries = dict()
+        self._poll_order = []
+        self._refresh_index()
+
+    def _refresh_index(self) -> None:
+        # Read the index back in if it's changed, like when another worker adds a poll
+        summaries = self.store.read_index()
+        if summaries is not None:
+            self.summaries = {summary.election_id: summary for summary in summaries}
+            # The index is kept in order, so there's no need to sort
+            self._poll_order = [summary.election_id for summary in summaries]
+            self._list_cache.clear()
 
     async def add_poll(self, new_poll: NewPoll) -> int:
-        # As this function gets the next id, and later actually reserves it
-        if MAX_POLLS is not None and len(self.polls) >= MAX_POLLS:
-            raise ValidationError(f"Hit maximum limit of {MAX_POLLS} polls")
         # Lock this function to only run one at a time
-        # To prevent race conditions where multiple add_poll instances get the same id
+        # The store makes sure other workers can't give out the same id either
         async with self._manager_lock:
-            new_id = self._get_next_id()
-            # Create full_data from new_poll by turning new_poll into a dict
-            # And then unpacking that dictionary as parameters to make PollData
-            # Adding on the election id at the end
-            full_data = PollData(**asdict(new_poll), election_id=new_id)
-            # Get paths, make a poll object, and make it write those files
-            folder_path = self.folder / str(new_id)
-            config_path, votes_path = self._get_config_votes_paths(folder_path)
-            poll = SinglePoll(full_data, config_path, votes_path)
-            await poll.write_files(True)
-
-            # Finally, add the poll to the list and return this id
-            self.polls[new_id] = poll
+            config = await asyncio.to_thread(
+                self.store.create_poll, new_poll, MAX_POLLS
+            )
+            new_id = config.election_id
+            poll = SinglePoll(config, self.store, self.count_pool)
+            self._add_loaded(new_id, poll)
+            # Picks up the new poll, along with any other workers have added
+            self._refresh_index()
         return new_id
 
-    def poll_list(self) -> list[PollSummary]:
-        # Return a list of keys in newest->oldest order
-        result: list[PollSummary] = []
-        # There has got to be a better way to ensure that this list is ordered
-        # But I can't think of an easy way right now
-        # Maybe just a cache would help down the line
-        for poll_id in sorted(self.polls.keys(), reverse=True):
-            result.append(self.polls[poll_id].list_json())
+    async def get_poll(self, poll_id: int) -> SinglePoll:
+        # Get a poll, loading it in if needed
+        # Raises KeyError if there's no poll with that ID
+        poll = self._loaded.get(poll_id)
+        if poll is not None:
+            # Mark it as the most recently used
+            self._loaded.move_to_end(poll_id)
+            return poll
+
+        if poll_id not in self.summaries:
+            # It could have just been added by another worker
+            self._refresh_index()
+            if poll_id not in self.summaries:
+                raise KeyError(poll_id)
+
+        loading = self._loading.get(poll_id)
+        if loading is None:
+            loading = asyncio.create_task(self._load_poll(poll_id))
+            self._loading[poll_id] = loading
+        # Shielded so that one request giving up doesn't cancel loading the poll
+        # for every other request waiting on it
+        return await asyncio.shield(loading)
 
-        return result
+    async def _load_poll(self, poll_id: int) -> SinglePoll:
+        try:
+            poll = await SinglePoll.load(self.store, poll_id, self.count_pool)
+            self._add_loaded(poll_id, poll)
+        finally:
+            del self._loading[poll_id]
+        return poll
 
-    def validate_vote(self, vote: Vote) -> None:
+    def poll_list_json(
+        self, cursor: int | None = None, limit: int | None = None
+    ) -> tuple[bytes, int | None]:
+        # Return a page of the poll list in newest->oldest order, encoded as json,
+        # along with the cursor to get the next page with (or None if it's the last)
+        self._refresh_index()
+        key = (cursor, limit)
+        cached = self._list_cache.get(key)
+        if cached is None:
+            # Polls older than the cursor are everything before it in _poll_order
+            end = len(self._poll_order)
+            if cursor is not None:
+                end = bisect_left(self._poll_order, cursor)
+            start = 0
+            if limit is not None:
+                start = max(0, end - limit)
+            page = [
+                self.summaries[poll_id]
+                for poll_id in reversed(self._poll_order[start:end])
+            ]
+            next_cursor = self._poll_order[start] if start > 0 else None
+
+            # Lots of different cursors could be asked for,
+            # so don't let the cache grow forever
+            if len(self._list_cache) >= MAX_CACHED_PAGES:
+                self._list_cache.clear()
+            cached = (msgspec.json.encode(page), next_cursor)
+            self._list_cache[key] = cached
+        return cached
+
+    async def validate_vote(self, vote: Vote) -> None:
         # Raise an exception if the vote is invalid
-        if vote.election_id not in self.polls:
-            raise ValidationError("Unknown poll")
+        # This also makes sure the poll is loaded, ready for add_vote
+        try:
+            poll = await self.get_poll(vote.election_id)
+        except KeyError:
+            VOTES_REJECTED.inc(1, UNKNOWN_POLL)
+            raise ValidationError(UNKNOWN_POLL)
 
-        election = self.polls[vote.election_id].config
+        error = self._ballot_error(poll.config, vote.preferences)
+        if error is not None:
+            VOTES_REJECTED.inc(1, error)
+            raise ValidationError(error)
 
-        if len(vote.preferences) == 0 or len(vote.preferences) > len(
-            election.candidate_names
-        ):
-            raise ValidationError("Invalid number of preferences")
+    async def add_votes(self, batch: VoteBatch) -> VoteBatchResults:
+        # Check every ballot, and add all the valid ones in one go
+        # Rejected ballots don't stop the others from being added
+        if len(batch.ballots) > MAX_VOTE_BATCH:
+            raise ValidationError(f"Can't submit more than {MAX_VOTE_BATCH} ballots")
+        try:
+            poll = await self.get_poll(batch.election_id)
+        except KeyError:
+            VOTES_REJECTED.inc(len(batch.ballots), UNKNOWN_POLL)
+            raise ValidationError(UNKNOWN_POLL)
+
+        config = poll.config
+        errors = [self._ballot_error(config, ballot) for ballot in batch.ballots]
+        accepted = [
+            ballot for ballot, error in zip(batch.ballots, errors) if error is None
+        ]
+        for error in errors:
+            if error is not None:
+                VOTES_REJECTED.inc(1, error)
+        if len(accepted) > 0:
+            poll.add_votes(accepted)
+            VOTES_ACCEPTED.inc(len(accepted))
+        return VoteBatchResults(len(accepted), errors)
 
-        if len(vote.preferences) < election.minimum_preferences or (
-            election.minimum_preferences <= 0
-            and len(vote.preferences) != len(election.candidate_names)
+    @staticmethod
+    def _ballot_error(election: PollData, preferences: list[int]) -> str | None:
+        # Return why a ballot is invalid, or None if it's fine
+        # Sticking to min, max and set, which loop in C rather than python,
+        # as this gets run on every ballot in a batch
+        candidate_count = len(election.candidate_names)
+        if len(preferences) == 0 or len(preferences) > candidate_count:
+            return BAD_LENGTH
+
+        if len(preferences) < election.minimum_preferences or (
+            election.minimum_preferences <= 0 and len(preferences) != candidate_count
         ):
-            raise ValidationError("Not enough preferences")
+            return TOO_SHORT
 
-        seen_preferences = set()
-        for pref in vote.preferences:
-            if pref < 0 or pref >= len(election.candidate_names):
-                raise ValidationError("Preference out of bounds")
-            if pref in seen_preferences:
-                raise ValidationError("Preferenced the same candidate multiple times")
-            seen_preferences.add(pref)
+        if min(preferences) < 0 or max(preferences) >= candidate_count:
+            return OUT_OF_BOUNDS
+        if len(set(preferences)) != len(preferences):
+            return DUPLICATE_PREFERENCE
+        return None
 
     def add_vote(self, vote: Vote) -> None:
         # Assumes that vote has already been validated,
         # invalid data or unexpected exceptions may result otherwise
-        election = self.polls[vote.election_id]
+        # validate_vote will have loaded the poll, and nothing can unload it
+        # without an await in between
+        election = self._loaded[vote.election_id]
         election.add_vote(vote.preferences)
+        VOTES_ACCEPTED.inc()
 
-    def _get_next_id(self) -> int:
-        next_id: int
-        if len(self.polls) > 0:
-            next_id = max(self.polls.keys()) + 1
-        else:
-            next_id = 0
-        return next_id
+    def update_metrics(self) -> None:
+        # Fills in the gauges, just before /metrics sends them
+        LOADED_POLLS.set(len(self._loaded))
+        PENDING_VOTES.values.clear()
+        for poll_id, poll in self._loaded.items():
+            PENDING_VOTES.set(poll.pending_votes, str(poll_id))
+        self.count_pool.update_metrics()
 
-    def _get_config_votes_paths(self, folder_path: Path) -> tuple[Path, Path]:
-        return folder_path / "config.json", folder_path / "votes.csv"
+    async def close(self) -> None:
+        # Write out any votes still waiting, then stop the worker processes
+        for poll in self._loaded.values():
+            await poll.close()
+        if len(self._closing) > 0:
+            await asyncio.wait(self._closing)
+        self.store.close()
+        self.count_pool.shutdown()
+
+    def _add_loaded(self, poll_id: int, poll: SinglePoll) -> None:
+        self._loaded[poll_id] = poll
+        # Unload the least recently used polls until under the limit again
+        # Skipping any with votes still waiting, they'll get unloaded later
+        if len(self._loaded) > MAX_LOADED_POLLS:
+            for old_id, old_poll in list(self._loaded.items()):
+                if len(self._loaded) <= MAX_LOADED_POLLS:
+                    break
+                if old_id != poll_id and not old_poll.pinned:
+                    del self._loaded[old_id]
+                    closing = asyncio.create_task(old_poll.close())
+                    self._closing.add(closing)
+                    closing.add_done_callback(self._closing.discard)
 
     @staticmethod
     def validate_poll_data(data: NewPoll) -> None:
@@ -141,6 +302,9 @@ class PollManager:
                 "At least 2 candidates must be present, otherwise it's not much of a poll"
             )
 
+        if data.count_mode not in COUNT_MODES:
+            raise ValidationError(f"Count mode must be one of {COUNT_MODES}")
+
         if data.minimum_preferences > len(data.candidate_names):
             raise ValidationError("More preferences are required than are available")
 
@@ -0,0 +1,385 @@
+# poll_store.py
+# Where polls are kept. PollManager and SinglePoll only read and write polls
+# through a PollStore, so they don't need to care how polls are stored
+# FolderStore keeps each poll in its own folder, and sqlite_store.py keeps
+# every poll in one SQLite database
+import fcntl
+import os
+from dataclasses import asdict
+from pathlib import Path
+from typing import Iterator, Protocol
+
+import msgspec
+
+from file_lock import FileLock
+from poll_data import NewPoll, PollData, PollSummary, ResultsSnapshot, ValidationError
+
+import teller_path  # noqa: F401
+from vote_reader import add_vote, vote_count  # noqa: E402
+from vote_log import (  # noqa: E402
+    HEADER,
+    encode_header,
+    encode_votes,
+    decode_votes,
+    width_for,
+    csv_to_log,
+    iter_log_csv,
+    read_vote_log,
+)
+
+STORE_BACKENDS = ["folder", "sqlite"]
+# Which store to keep polls in, and where
+POLL_STORE = os.getenv("POLL_STORE", "folder")
+DEFAULT_LOCATIONS = {"folder": "polls", "sqlite": "polls.db"}
+POLL_STORE_LOCATION = os.getenv(
+    "POLL_STORE_LOCATION", DEFAULT_LOCATIONS.get(POLL_STORE, "polls")
+)
+
+# 256 megabytes in bytes
+# The most vote log data a single poll can have, past this votes get dropped
+MAX_VOTE_SIZE = 268435456
+
+# Lists every poll, so that starting up doesn't need to read every poll folder
+INDEX_NAME = "index.json"
+# Held while adding polls or writing the index, so that several Poller workers
+# can share one polls folder
+LOCK_NAME = ".lock"
+CONFIG_NAME = "config.json"
+VOTES_NAME = "votes.bin"
+# Name of the votes file polls used before vote logs, which get converted on load
+LEGACY_VOTES_NAME = "votes.csv"
+# Holds the last results counted, next to the config
+RESULTS_NAME = "results.json"
+
+
+class VoteLog(Protocol):
+    # Adds votes to a single poll
+    # Each worker with the poll loaded has its own, and they can all be adding at once
+    # How far into the poll's votes this has read, which only means anything
+    # to the store it came from
+    position: int
+
+    def append(self, votes: list[list[int]]) -> tuple[list[list[int]], int]:
+        # Adds votes, after reading in any other workers have added since position
+        # Returns those other votes, and how many bytes the votes took up
+        # (0 if they didn't get added, which happens once the poll's past MAX_VOTE_SIZE)
+        # Can block, so gets run in a thread
+        ...
+
+    def behind(self) -> bool:
+        # If another worker has added votes since position
+        # Must be quick, as it's run on the event loop,
+        # so it mustn't wait on other workers that are adding votes
+        ...
+
+    def sync(self) -> None:
+        # Make sure everything added so far survives a crash
+        ...
+
+    def close(self) -> None: ...
+
+
+class PollStore(Protocol):
+    # Everything other than behind and read_index can block,
+    # so gets run in a thread
+
+    def read_index(self) -> list[PollSummary] | None:
+        # Every poll, oldest first
+        # Or None if nothing has changed since the last time this was called
+        ...
+
+    def create_poll(self, new_poll: NewPoll, max_polls: int | None) -> PollData:
+        # Saves a new poll, giving it the next ID
+        # Raises ValidationError if there are already max_polls polls
+        ...
+
+    def read_poll(
+        self, poll_id: int
+    ) -> tuple[PollData, vote_count, int, ResultsSnapshot | None]:
+        # The config, a tally of every vote, the position the tally goes up to,
+        # and the last saved results if there are any
+        # Raises KeyError if there's no poll with that ID
+        ...
+
+    def open_log(self, config: PollData, position: int | None) -> VoteLog:
+        # position is from read_poll, or None for a poll that was just created
+        ...
+
+    def write_results(self, poll_id: int, snapshot: ResultsSnapshot) -> None: ...
+
+    def iter_votes_csv(self, poll_id: int) -> Iterator[str]:
+        # Every vote as csv, a batch of lines at a time, in the order they were added
+        ...
+
+    def close(self) -> None: ...
+
+
+def make_store(backend: str, location: str) -> PollStore:
+    if backend == "folder":
+        return FolderStore(Path(location))
+    elif backend == "sqlite":
+        # Only importing this when asked for, as most setups won't use it
+        from sqlite_store import SqliteStore
+
+        return SqliteStore(Path(location))
+    else:
+        raise ValueError(f"Unknown poll store {backend}")
+
+
+class FileVoteLog:
+    path: Path
+    # Bytes per number in the vote log, see Teller/vote_log.py
+    width: int
+    # How much of the vote log has been read in, in bytes
+    # Anything past this was written by another worker
+    position: int
+    # Opened on the first append, None until then
+    _fd: int | None
+
+    def __init__(self, path: Path, width: int, position: int) -> None:
+        self.path = path
+        self.width = width
+        self.position = position
+        self._fd = None
+
+    def __repr__(self) -> str:
+        return str(self.path)
+
+    def append(self, votes: list[list[int]]) -> tuple[list[list[int]], int]:
+        if self._fd is None:
+            self._fd = os.open(self.path, os.O_RDWR | os.O_APPEND)
+        fd = self._fd
+        # Other workers only ever write whole batches while holding this,
+        # so everything before the end of the file is whole records
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            end = os.fstat(fd).st_size
+            others: list[list[int]] = []
+            if end > self.position:
+                others = decode_votes(
+                    os.pread(fd, end - self.position, self.position), self.width
+                )
+
+            # If the file is too big then just don't write the votes
+            if len(votes) == 0 or end >= MAX_VOTE_SIZE:
+                self.position = end
+                return others, 0
+            data = encode_votes(votes, self.width)
+            view = memoryview(data)
+            try:
+                while len(view) > 0:
+                    view = view[os.write(fd, view) :]
+            except OSError:
+                # Cut off anything half written, so the file is still whole records
+                # position hasn't moved, so trying again reads the others back in too
+                os.ftruncate(fd, end)
+                raise
+            self.position = end + len(data)
+            return others, len(data)
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def behind(self) -> bool:
+        try:
+            return os.stat(self.path).st_size > self.position
+        except FileNotFoundError:
+            return False
+
+    def sync(self) -> None:
+        if self._fd is not None:
+            os.fsync(self._fd)
+
+    def close(self) -> None:
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+class FolderStore:
+    # Each poll gets a folder named after its ID, holding config.json,
+    # the votes.bin vote log and results.json
+    folder: Path
+    # Same as PollManager's lock, but stops other worker processes too
+    _folder_lock: FileLock
+    # Inode, modified time and size of the index when it was last read,
+    # to tell when it's changed
+    _index_stamp: tuple[int, int, int] | None
+
+    def __init__(self, folder: Path) -> None:
+        # This will raise error if path is taken by non folder object
+        folder.mkdir(exist_ok=True)
+        self.folder = folder
+        self._folder_lock = FileLock(folder / LOCK_NAME)
+        self._index_stamp = None
+        with self._folder_lock:
+            if not (self.folder / INDEX_NAME).is_file():
+                # No index yet, so build one from the poll folders
+                # This only needs to happen once, or if the index gets deleted
+                # Other workers starting up wait on the lock, then read this one
+                self._write_index(self._scan_folder())
+
+    def read_index(self) -> list[PollSummary] | None:
+        # Cheap to call often, it only reads the index if it's been changed
+        index_path = self.folder / INDEX_NAME
+        stat = index_path.stat()
+        stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if stamp == self._index_stamp:
+            return None
+        self._index_stamp = stamp
+        return self._load_index()
+
+    def create_poll(self, new_poll: NewPoll, max_polls: int | None) -> PollData:
+        with self._folder_lock:
+            # Another worker might have added polls since the index was last read
+            summaries = self._load_index()
+            if max_polls is not None and len(summaries) >= max_polls:
+                raise ValidationError(f"Hit maximum limit of {max_polls} polls")
+
+            # Making the folder reserves the ID, as only one mkdir can succeed
+            # Skipping past any folders left behind by a poll that never got indexed
+            new_id = summaries[-1].election_id + 1 if len(summaries) > 0 else 0
+            while True:
+                folder_path = self.folder / str(new_id)
+                try:
+                    folder_path.mkdir()
+                    break
+                except FileExistsError:
+                    new_id += 1
+
+            # Create config from new_poll by turning new_poll into a dict
+            # And then unpacking that dictionary as parameters to make PollData
+            # Adding on the election id at the end
+            config = PollData(**asdict(new_poll), election_id=new_id)
+            # The vote log starts off as just the header
+            with open(folder_path / VOTES_NAME, "wb") as f:
+                f.write(encode_header(len(config.candidate_names)))
+            with open(folder_path / CONFIG_NAME, "wb") as f:
+                f.write(msgspec.json.encode(config))
+
+            summaries.append(PollSummary(config.election_name, new_id))
+            self._write_index(summaries)
+        return config
+
+    def read_poll(
+        self, poll_id: int
+    ) -> tuple[PollData, vote_count, int, ResultsSnapshot | None]:
+        folder_path = self.folder / str(poll_id)
+        config_path = folder_path / CONFIG_NAME
+        votes_path = folder_path / VOTES_NAME
+        try:
+            with open(config_path, "rt") as f:
+                config = msgspec.json.decode(f.read(), type=PollData)
+        except FileNotFoundError:
+            raise KeyError(poll_id)
+        if config.election_id != poll_id:
+            # A folder that's been renamed or copied, which the index leaves out
+            raise KeyError(poll_id)
+
+        # Polls from before vote logs only have a votes csv, so convert it
+        # The csv is left alone, just in case
+        legacy_path = folder_path / LEGACY_VOTES_NAME
+        if not votes_path.is_file() and legacy_path.is_file():
+            print(f"Converting {legacy_path} to a vote log")
+            # Another worker could be converting it too, so each converts
+            # into its own file and only the first one gets linked into place
+            temp_path = votes_path.with_name(f"{VOTES_NAME}.{os.getpid()}.tmp")
+            try:
+                csv_to_log(legacy_path, temp_path, len(config.candidate_names))
+                os.link(temp_path, votes_path)
+            except FileExistsError:
+                pass
+            finally:
+                temp_path.unlink(missing_ok=True)
+
+        # Read in the existing votes once, after this the tally gets kept up to date
+        # as new votes are written
+        # Other workers could be adding votes, so the size is taken while they can't,
+        # and only that much gets read. Anything after is picked up by the vote log
+        with open(votes_path, "rb") as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_SH)
+            position = os.fstat(f.fileno()).st_size
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        tally: vote_count = dict()
+        for vote, amount in read_vote_log(votes_path, position):
+            add_vote(tally, vote, amount)
+
+        snapshot: ResultsSnapshot | None = None
+        results_path = folder_path / RESULTS_NAME
+        if results_path.is_file():
+            try:
+                with open(results_path, "rb") as f:
+                    snapshot = msgspec.json.decode(f.read(), type=ResultsSnapshot)
+            except msgspec.DecodeError as error:
+                print(f"Warning! Ignoring broken {results_path}: {error}")
+
+        return config, tally, position, snapshot
+
+    def open_log(self, config: PollData, position: int | None) -> VoteLog:
+        return FileVoteLog(
+            (self.folder / str(config.election_id) / VOTES_NAME).absolute(),
+            width_for(len(config.candidate_names)),
+            # A brand new poll, with nothing in its vote log but the header
+            position if position is not None else HEADER.size,
+        )
+
+    def write_results(self, poll_id: int, snapshot: ResultsSnapshot) -> None:
+        # Written to a temporary file first so a crash can't leave half a file behind
+        results_path = self.folder / str(poll_id) / RESULTS_NAME
+        temp_path = results_path.with_name(f"{RESULTS_NAME}.{os.getpid()}.tmp")
+        with open(temp_path, "wb") as f:
+            f.write(msgspec.json.encode(snapshot))
+        os.replace(temp_path, results_path)
+
+    def iter_votes_csv(self, poll_id: int) -> Iterator[str]:
+        return iter_log_csv(self.folder / str(poll_id) / VOTES_NAME)
+
+    def close(self) -> None:
+        pass
+
+    def _load_index(self) -> list[PollSummary]:
+        with open(self.folder / INDEX_NAME, "rb") as f:
+            return msgspec.json.decode(f.read(), type=list[PollSummary])
+
+    def _scan_folder(self) -> list[PollSummary]:
+        # Find every poll in the poll folder, only reading their configs
+        # Each folder is named after its poll's ID, so IDs can't repeat
+        summaries: dict[int, PollSummary] = dict()
+        for child in self.folder.iterdir():
+            # Only check children
+            if child.is_dir():
+                # If folder contains valid files then add it
+                config_path = child / CONFIG_NAME
+                if config_path.is_file() and (
+                    (child / VOTES_NAME).is_file()
+                    or (child / LEGACY_VOTES_NAME).is_file()
+                ):
+                    with open(config_path, "rb") as f:
+                        config = msgspec.json.decode(f.read(), type=PollData)
+                    # Polls are found by their folder name everywhere else,
+                    # so one that doesn't match its ID could never be loaded
+                    if child.name != str(config.election_id):
+                        print(
+                            f"Warning: skipping folder {child}, its poll has ID {config.election_id}"
+                        )
+                        continue
+                    summaries[config.election_id] = PollSummary(
+                        config.election_name, config.election_id
+                    )
+                else:
+                    print(
+                        f"Warning: folder {child} is in poll folder but doesn't contain poll files"
+                    )
+            elif child.name not in (INDEX_NAME, LOCK_NAME):
+                print(f"Warning: non poll file {child} is in poll folder")
+        return [summaries[poll_id] for poll_id in sorted(summaries.keys())]
+
+    def _write_index(self, summaries: list[PollSummary]) -> None:
+        # Must be called while holding self._folder_lock
+        # Write to a temporary file and then move it into place,
+        # so a crash can't leave half an index behind,
+        # and other workers never read half of one
+        index_path = self.folder / INDEX_NAME
+        temp_path = index_path.with_name(INDEX_NAME + ".tmp")
+        with open(temp_path, "wb") as f:
+            f.write(msgspec.json.encode(summaries))
+        os.replace(temp_path, index_path)
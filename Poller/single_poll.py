@@ -2,46 +2,195 @@
 # SinglePoll class, which manages stuff for an individual poll
 # I figured just calling it Poll would be really confusing
 import msgspec
-import aiofiles
-from aiofiles import os as aos
 import os
-import sys
 import asyncio
-from pathlib import Path
-from poll_data import PollData, PollResults, PollSummary
+import time
+import hashlib
+from concurrent.futures.process import BrokenProcessPool
+from typing import AsyncIterator
+from poll_data import PollData, PollResults, PollSummary, PollTrace, ResultsSnapshot
+from poll_store import PollStore
+from count_scheduler import CountScheduler
+from count_pool import CountPool, CountPoolFull
+from metrics import Counter
 
-TELLER_LOCATION = os.getenv("TELLER_LOCATION", "../Teller/main.py")
+import teller_path  # noqa: F401
+from vote_writer import VoteWriter  # noqa: E402
+from poll_config import ConfigData  # noqa: E402
+from vote_reader import add_vote, vote_count, PackedVotes  # noqa: E402
+from ballot_trie import BallotTrie  # noqa: E402
+from counter import count_votes  # noqa: E402
+from errors import VoteError  # noqa: E402
+from count_trace import CountTrace, TraceData  # noqa: E402
+
+# Which Teller tally backend to count with, see Teller/tally.py
+TELLER_BACKEND = os.getenv("TELLER_BACKEND", "python")
 MAX_RUNTIME = 60.0
-# 1 megabyte in bytes
-MAX_VOTE_SIZE = 1048576
+# How long after results are requested that counts for a poll skip the queue, in seconds
+PRIORITY_WINDOW = 10.0
+# How many results a subscriber can fall behind by before they're dropped
+SUBSCRIBER_QUEUE_SIZE = int(os.getenv("SUBSCRIBER_QUEUE_SIZE", "8"))
+# How often to check for votes other workers have added while anyone's subscribed,
+# in seconds
+VOTE_LOG_CHECK_INTERVAL = float(os.getenv("VOTE_LOG_CHECK_INTERVAL", "1.0"))
+
+COUNT_RESULTS = ["ok", "timeout", "pool_full", "error"]
+COUNTS = Counter(
+    "poller_counts_total",
+    "Counts finished, by how they went.",
+    "result",
+    COUNT_RESULTS,
+)
+
+
+class ResultsNotReady(Exception):
+    # The poll has never been counted successfully, so there are no results to give
+    pass
+
+
+def _count_poll(
+    config: ConfigData, votes: PackedVotes | BallotTrie
+) -> tuple[dict[str, list[int]], TraceData]:
+    # Runs inside a worker process, so this needs to be a top level function
+    # Always keeping a trace, it's small next to the count itself
+    trace = CountTrace()
+    results = count_votes(votes, config, True, False, TELLER_BACKEND, trace)
+    return results, trace.as_dict()
+
+
+def _encode_with_etag(value: object) -> tuple[bytes, str]:
+    # The ETag comes from the contents rather than a version number,
+    # so it stays the same when a poll gets reloaded or Poller restarts
+    data = msgspec.json.encode(value)
+    return data, hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def _end_stream(events: "asyncio.Queue[bytes | None]") -> None:
+    # Throw away anything unsent, and tell the subscriber to stop
+    while not events.empty():
+        events.get_nowait()
+    events.put_nowait(None)
 
 
 class SinglePoll:
     config: PollData
     _current_results: PollResults | None
-    config_path: Path
-    votes_path: Path
-    # Used to prevent simultaneous access of vote files
-    _file_lock: asyncio.Lock
-    # Use to store pending votes
-    _pending_votes: list[list[int]]
-
-    def __init__(self, config: PollData, config_path: Path, votes_path: Path):
+    # How the count that gave the current results went, round by round
+    _current_trace: PollTrace | None
+    # Where the poll's kept, shared with every other poll
+    _store: PollStore
+    # Batches up new votes and appends them to the vote log
+    _writer: VoteWriter
+    # Running count of every vote written to the votes file,
+    # so that recounts don't need to re-read the whole file
+    _tally: vote_count
+    # The same votes as a BallotTrie, kept up to date as votes come in
+    # when counting with the trie backend so it doesn't need building for each count
+    _trie: BallotTrie | None
+    # Goes up every time votes are added to the tally,
+    # so counts can be skipped when nothing has changed
+    _tally_version: int
+    _counted_version: int | None
+    # Position in the vote log as of the last votes added to the tally,
+    # see poll_store.py
+    _tally_position: int
+    # Decides when to recount, so that bursts of votes only cause one count
+    _scheduler: CountScheduler
+    # Number of votes received since the last count started
+    _uncounted: int
+    # Shared between every poll, counting is CPU bound
+    # so it's run in a pool of worker processes to keep it off the event loop
+    _count_pool: CountPool
+    # When someone last asked for this poll's results, from time.monotonic()
+    _results_requested: float | None
+    # The config and results encoded as json along with their ETags,
+    # made the first time they're asked for after they change
+    _details_cache: tuple[bytes, str] | None
+    _results_cache: tuple[bytes, str] | None
+    _trace_cache: tuple[bytes, str] | None
+    # Everyone listening for new results, each with a queue of encoded events
+    # None is put in a queue to tell that subscriber they've been dropped
+    _subscribers: "set[asyncio.Queue[bytes | None]]"
+    # Keeps checking for other workers' votes while there are subscribers
+    _watch_task: "asyncio.Task[None] | None"
+
+    def __init__(
+        self,
+        config: PollData,
+        store: PollStore,
+        count_pool: CountPool,
+        tally: vote_count | None = None,
+        tally_position: int | None = None,
+    ):
+        # tally and tally_position come from the store when a poll is loaded,
+        # and are left as None for a brand new poll with no votes yet
         self.config = config
-        self.config_path = Path(config_path).absolute()
-        self.votes_path = Path(votes_path).absolute()
-        self.teller_path = Path(TELLER_LOCATION).absolute()
-        self._file_lock = asyncio.Lock()
-        self._pending_votes = []
+        self._store = store
+        self._writer = VoteWriter(
+            store.open_log(config, tally_position), self._votes_written
+        )
         self._current_results = None
+        self._tally = tally if tally is not None else dict()
+        self._trie = None
+        if TELLER_BACKEND == "trie":
+            self._trie = BallotTrie.from_vote_count(self._tally)
+        self._tally_version = 0
+        self._counted_version = None
+        self._tally_position = self._writer.position
+        self._scheduler = CountScheduler(self._update_results)
+        self._uncounted = 0
+        self._count_pool = count_pool
+        self._results_requested = None
+        self._details_cache = None
+        self._results_cache = None
+        self._trace_cache = None
+        self._current_trace = None
+        self._subscribers = set()
+        self._watch_task = None
+
+    @property
+    def queue_depth(self) -> int:
+        # How many votes are waiting on a count to be included in the results
+        return self._uncounted
+
+    @property
+    def pending_votes(self) -> int:
+        # Votes waiting to be written to the vote log
+        return self._writer.pending
+
+    @property
+    def pinned(self) -> bool:
+        # If the poll has votes waiting to be written or counted,
+        # and so needs to stay loaded
+        return (
+            not self._writer.idle
+            or self._scheduler.running
+            or len(self._subscribers) > 0
+        )
+
+    @property
+    def last_count_latency(self) -> float | None:
+        # How long the last count took in seconds, or None if never counted
+        return self._scheduler.last_latency
 
     async def get_results(self, prefer_immediate: bool) -> PollResults:
+        # Someone's watching this poll, so let its counts skip ahead of other polls
+        self._results_requested = time.monotonic()
+        self._count_pool.prioritise(self.config.election_id)
+
         if self._current_results is None:
-            # Results not yet calculated
-            await self._update_results()
+            # Results not yet calculated, count straight away
+            await self._scheduler.flush()
+        elif self._writer.behind():
+            # Another worker has had votes for this poll, so they need counting here
+            self._scheduler.request()
 
-        # self._current_results should always not be none by the time update results is run
-        assert self._current_results is not None
+        if self._current_results is None:
+            # The count didn't work out, the pool was full or it hit an error
+            # Another count will be tried, but there's nothing to give back yet
+            raise ResultsNotReady(
+                f"Poll {self.config.election_id} hasn't been counted yet"
+            )
 
         if prefer_immediate:
             # Get results immediately
@@ -49,143 +198,273 @@ class SinglePoll:
         else:
             # Now wait until results are available
             # (in case results are currently being calculated)
-            async with self._file_lock:
-                result = self._current_results
+            if self._scheduler.running:
+                await self._scheduler.flush()
+            result = self._current_results
         return result
 
     async def _update_results(self) -> None:
         # Check if there are pending votes,
         # and flush the pending votes to file if needed
         # Then run Teller if needed
+        # This is only ever called by self._scheduler, so only one runs at a time
+        self._uncounted = 0
+
+        # Make sure every vote received so far is in the file, and so in the tally
+        await self._writer.flush()
 
-        # Check if votes or no votes
-        votes_to_write: list[list[int]] = []
         run_teller = True
-        if len(self._pending_votes) != 0:
-            # Flush list before awaiting to avoid race conditions
-            # around later _pending_votes modification
-            votes_to_write = self._pending_votes
-            self._pending_votes = []
-            await self._write_votes(votes_to_write)
-        else:
-            # No pending votes, check if no other votes
+        if len(self._tally) == 0:
+            # If no votes have been written then set a default full tie
+            # and don't bother running Teller
             if self._current_results is None:
-                async with self._file_lock:
-                    if await aos.path.getsize(self.votes_path) == 0:
-                        # If there were no pending votes,
-                        # self._current_results is None,
-                        # and the votes file is empty,
-                        # then set a default full tie
-                        # and don't bother running run_teller
-                        candidate_count = len(self.config.candidate_names)
-                        self._current_results = PollResults(
-                            winners=[],
-                            tied_winners=list(range(candidate_count)),
-                            first_preferences=[0] * candidate_count,
-                        )
-                        run_teller = False
-            else:
-                # No new votes and we've already counted votes, do nothing
-                run_teller = False
+                candidate_count = len(self.config.candidate_names)
+                self._set_results(
+                    PollResults(
+                        winners=[],
+                        tied_winners=list(range(candidate_count)),
+                        first_preferences=[0] * candidate_count,
+                    ),
+                    PollTrace(0, 0, [], [], [], [], []),
+                )
+            run_teller = False
+        elif (
+            self._current_results is not None
+            and self._counted_version == self._tally_version
+        ):
+            # No new votes since the last count, do nothing
+            run_teller = False
 
         # Run Teller if needed
         if run_teller:
-            # Call Teller and calculate the results of the election
-            # given the current config and votes
-            async with self._file_lock:
-                # Run process
-                # sys.executable gives an absolute path to the current python executable
-                # And all other paths were converted to absolute for safety
-                proc = await asyncio.create_subprocess_exec(
-                    sys.executable,
-                    self.teller_path,
-                    self.config_path,
-                    self.votes_path,
-                    stdout=asyncio.subprocess.PIPE,
-                    stderr=asyncio.subprocess.PIPE,
+            # Call Teller in the worker pool and calculate the results
+            # of the election given the current config and votes
+            # Packing the tally here as the executor pickles it on another thread,
+            # and add_vote could change it while that's happening
+            # PackedVotes is also much quicker to send to the worker than a dict
+            # A copy of the trie is just a few arrays, so it's quick to send too
+            packed_tally: PackedVotes | BallotTrie
+            if self._trie is not None:
+                packed_tally = self._trie.copy()
+            else:
+                packed_tally = PackedVotes.from_vote_count(self._tally)
+            counted_version = self._tally_version
+            counted_position = self._tally_position
+            priority = len(self._subscribers) > 0 or (
+                self._results_requested is not None
+                and time.monotonic() - self._results_requested < PRIORITY_WINDOW
+            )
+            count = self._count_pool.run(
+                self.config.election_id,
+                _count_poll,
+                self._teller_config(),
+                packed_tally,
+                priority=priority,
+            )
+            try:
+                results, trace = await asyncio.wait_for(count, MAX_RUNTIME)
+                # Everything worked good!
+                self._set_results(
+                    msgspec.convert(results, type=PollResults),
+                    msgspec.convert(trace, type=PollTrace),
                 )
-                try:
-                    proc_output, proc_err = await asyncio.wait_for(
-                        proc.communicate(), MAX_RUNTIME
-                    )
-                    if proc.returncode != 0:
-                        # Error!
-                        print(
-                            f"Error! Subprocess returned {proc.returncode}\nStderr: {proc_err.decode()}\nStdout: {proc_output.decode()}"
-                        )
-                    else:
-                        # Everything worked good!
-                        self._current_results = msgspec.json.decode(
-                            proc_output, type=PollResults
-                        )
-                except TimeoutError:
-                    # The code has run for a solid minute, assume it got stuck and quit
-                    proc.kill()
-                    print(f"Error! Subprocess hung for {MAX_RUNTIME} seconds")
-        # There is no need to check if more votes were added while the program was running
-        # Because add_vote will schedule more runs of _update_results for each new vote
-        # If _update_results runs with no pending votes (and self._current_results is not None)
-        # Then it will quit without doing anything or awaiting anything
+                self._counted_version = counted_version
+                COUNTS.inc(1, "ok")
+                await self._write_snapshot(counted_position)
+            except TimeoutError:
+                # The count has run for a solid minute, assume it got stuck
+                # The worker can't be killed without taking the pool down with it
+                # But at least Poller can stop waiting on it
+                print(f"Error! Count hung for {MAX_RUNTIME} seconds")
+                COUNTS.inc(1, "timeout")
+            except CountPoolFull as error:
+                # Too busy right now, try again once things have hopefully calmed down
+                print(f"Warning! {error}")
+                COUNTS.inc(1, "pool_full")
+                self._scheduler.request()
+            except (VoteError, AssertionError, BrokenProcessPool) as error:
+                print(
+                    f"Error! Teller failed to count poll {self.config.election_id}: {error}"
+                )
+                COUNTS.inc(1, "error")
+        # There is no need to check if more votes were added while Teller was running
+        # Because add_vote will have asked the scheduler for another count,
+        # which covers every vote that came in while this one ran
+
+    def _set_results(self, results: PollResults, trace: PollTrace) -> None:
+        self._current_results = results
+        self._current_trace = trace
+        self._results_cache = None
+        self._trace_cache = None
+        if len(self._subscribers) > 0:
+            self._publish()
+
+    def subscribe(self) -> "asyncio.Queue[bytes | None]":
+        # Get a queue that gets sent every new set of results as a server-sent event
+        # Starting with the current results, if there are any
+        events: "asyncio.Queue[bytes | None]" = asyncio.Queue(SUBSCRIBER_QUEUE_SIZE)
+        self._subscribers.add(events)
+        self._count_pool.prioritise(self.config.election_id)
+        if self._current_results is not None:
+            events.put_nowait(self._results_event())
+        else:
+            # Nothing to send yet, so count straight away
+            self._scheduler.request(True)
+        if self._watch_task is None:
+            self._watch_task = asyncio.create_task(self._watch_log())
+        return events
+
+    def unsubscribe(self, events: "asyncio.Queue[bytes | None]") -> None:
+        self._subscribers.discard(events)
+
+    async def _watch_log(self) -> None:
+        # Votes sent to other workers only get noticed when this one reads the log,
+        # so subscribers would never hear about them without checking every so often
+        while len(self._subscribers) > 0:
+            await asyncio.sleep(VOTE_LOG_CHECK_INTERVAL)
+            if self._writer.behind():
+                self._scheduler.request()
+        self._watch_task = None
+
+    def _publish(self) -> None:
+        # Encoded once, no matter how many subscribers there are
+        event = self._results_event()
+        for events in list(self._subscribers):
+            try:
+                events.put_nowait(event)
+            except asyncio.QueueFull:
+                # This subscriber isn't keeping up, so drop them
+                # rather than holding on to more and more results for them
+                self._subscribers.discard(events)
+                _end_stream(events)
+
+    def _results_event(self) -> bytes:
+        if self._results_cache is None:
+            self._results_cache = _encode_with_etag(self._current_results)
+        data, etag = self._results_cache
+        return b"event: results\nid: " + etag.encode() + b"\ndata: " + data + b"\n\n"
+
+    async def results_json(self, prefer_immediate: bool) -> tuple[bytes, str]:
+        # The same as get_results, but already encoded, along with an ETag
+        await self.get_results(prefer_immediate)
+        if self._results_cache is None:
+            self._results_cache = _encode_with_etag(self._current_results)
+        return self._results_cache
+
+    async def trace_json(self) -> tuple[bytes, str]:
+        # How the count for the current results went, encoded as json with an ETag
+        await self.get_results(True)
+        if self._trace_cache is None:
+            self._trace_cache = _encode_with_etag(self._current_trace)
+        return self._trace_cache
+
+    def details_json(self) -> tuple[bytes, str]:
+        # The config encoded as json, along with an ETag
+        if self._details_cache is None:
+            self._details_cache = _encode_with_etag(self.config)
+        return self._details_cache
 
     def add_vote(self, vote: list[int]) -> None:
+        self.add_votes([vote])
+
+    def add_votes(self, votes: list[list[int]]) -> None:
         # Currently not asserting anything, assuming that's done elsewhere
-        # Append new vote to the list
-        self._pending_votes.append(vote)
-        # Schedule a run of self._update_results() when there's time
-        asyncio.create_task(self._update_results())
-
-    async def _write_votes(self, votes_to_write: list[list[int]]) -> None:
-        async with self._file_lock:
-            # If the file is too big then just don't write the vote
-            # This would be bad if the code is meant to be used in a big context
-            # But eh
-
-            if await aos.path.getsize(self.votes_path) < MAX_VOTE_SIZE:
-                # Append the new line to the votes file
-                async with aiofiles.open(self.votes_path, "at") as f:
-                    for vote in votes_to_write:
-                        await f.write(",".join([str(x) for x in vote]) + "\n")
-            else:
-                print(
-                    f"File {self.votes_path} is bigger than the max size of {MAX_VOTE_SIZE} bytes! Dropping votes to prevent abuse"
-                )
+        # The writer appends them to the file along with any others that arrive soon
+        self._writer.add(votes)
+        self._uncounted += len(votes)
+        # Ask for a run of self._update_results() when there's time
+        # Only once no matter how many votes there are
+        self._scheduler.request()
+
+    def _votes_written(self, votes: list[list[int]]) -> None:
+        # Called by the writer once a batch is in the file,
+        # or once it's read in votes written by other workers
+        for vote in votes:
+            add_vote(self._tally, tuple(vote))
+        if self._trie is not None:
+            for vote in votes:
+                self._trie.add(tuple(vote))
+        self._tally_version += 1
+        self._tally_position = self._writer.position
+
+    async def _write_snapshot(self, position: int) -> None:
+        # Save the current results, so they can be used straight away after a restart
+        assert self._current_results is not None and self._current_trace is not None
+        snapshot = ResultsSnapshot(self._current_results, self._current_trace, position)
+        try:
+            await asyncio.to_thread(
+                self._store.write_results, self.config.election_id, snapshot
+            )
+        except OSError as error:
+            # Not a big deal, it just means a recount after restarting
+            print(
+                f"Warning! Couldn't save results for poll {self.config.election_id}: {error}"
+            )
+
+    def _restore_snapshot(self, snapshot: ResultsSnapshot) -> None:
+        # Use saved results from before a restart, if they're still any use
+        if snapshot.log_size > self._tally_position:
+            # The vote log has been replaced with a smaller one, so they're wrong
+            return
+        self._set_results(snapshot.results, snapshot.trace)
+        if snapshot.log_size == self._tally_position:
+            # Nothing's been added since, so there's no need to count
+            self._counted_version = self._tally_version
+        else:
+            # More votes came in after they were counted
+            # Use the saved results until the new votes get counted
+            self._scheduler.request()
+
+    async def close(self) -> None:
+        # Write out any waiting votes and close the vote log,
+        # and let anyone subscribed know there won't be any more results
+        for events in self._subscribers:
+            _end_stream(events)
+        self._subscribers.clear()
+        if self._watch_task is not None:
+            self._watch_task.cancel()
+            self._watch_task = None
+        await self._writer.close()
+
+    def _teller_config(self) -> ConfigData:
+        # Teller only wants the config fields it knows about
+        return ConfigData(
+            election_name=self.config.election_name,
+            minimum_preferences=self.config.minimum_preferences,
+            winner_amount=self.config.winner_amount,
+            candidate_names=self.config.candidate_names,
+            candidate_descriptions=self.config.candidate_descriptions,
+            randomise_order=self.config.randomise_order,
+            count_mode=self.config.count_mode,
+            bulk_exclusion=self.config.bulk_exclusion,
+            early_termination=self.config.early_termination,
+        )
+
+    async def iter_votes_csv(self) -> AsyncIterator[str]:
+        # Stream out every vote as csv, for anything expecting the old format
+        # Reading the log happens in a thread to keep it off the event loop
+        lines = self._store.iter_votes_csv(self.config.election_id)
+        while True:
+            chunk = await asyncio.to_thread(next, lines, None)
+            if chunk is None:
+                break
+            yield chunk
 
     def list_json(self) -> PollSummary:
         # Return the relevant data from self to be represented in the poll list
         # Currently just the poll name is used
         return PollSummary(self.config.election_name, self.config.election_id)
 
-    async def write_files(self, force_write: bool = False) -> None:
-        # Avoid fighting with other tools trying to write files before this is done
-        async with self._file_lock:
-            # Create the necessary folders as needed
-            # Then create an empty votes file if needed
-            # And save the config file to output
-            folder_path = self.votes_path.parent
-            assert folder_path == self.config_path.parent
-
-            # Make necessary directories but only if needed
-            # This should raise an error if folder_path is taken by a file
-            await aos.makedirs(folder_path, exist_ok=True)
-
-            # Make empty votes file if needed
-            if not await aos.path.exists(self.votes_path):
-                # Open file in append mode then immediatly closing seems to the best touch equiv
-                async with aiofiles.open(self.votes_path, "a"):
-                    pass
-
-            # Save config if needed
-            if force_write or not await aos.path.exists(self.config_path):
-                async with aiofiles.open(self.config_path, "wb") as f:
-                    await f.write(msgspec.json.encode(self.config))
-
     @classmethod
-    def from_file(cls, config_path: Path, votes_path: Path) -> "SinglePoll":
-        # TODO: Read config file, figure out msgspec easy way to do it
-        # Unable to use file_lock as class not yet created
-        # Must assume that no other resources are attempting to use file
-        # As the class doesn't exist to write anything yet
-        with open(config_path, "rt") as f:
-            config = msgspec.json.decode(f.read(), type=PollData)
-
-        return cls(config, config_path, votes_path)
+    async def load(
+        cls, store: PollStore, poll_id: int, count_pool: CountPool
+    ) -> "SinglePoll":
+        # Reading a poll in can take a while for big polls,
+        # so it happens in a thread to keep it off the event loop
+        config, tally, position, snapshot = await asyncio.to_thread(
+            store.read_poll, poll_id
+        )
+        poll = cls(config, store, count_pool, tally, position)
+        if snapshot is not None:
+            poll._restore_snapshot(snapshot)
+        return poll
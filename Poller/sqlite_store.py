@@ -0,0 +1,255 @@
+# sqlite_store.py
+# SqliteStore class, which keeps every poll in a single SQLite database
+# rather than a folder for each, see Teller/vote_db.py for the layout
+# The database is in WAL mode, so counts and downloads reading a poll
+# don't hold up votes being added, and several Poller workers can share it
+import sqlite3
+import threading
+from contextlib import contextmanager
+from dataclasses import asdict
+from pathlib import Path
+from typing import Iterator
+
+import msgspec
+
+from poll_data import NewPoll, PollData, PollSummary, ResultsSnapshot, ValidationError
+from poll_store import MAX_VOTE_SIZE, VoteLog
+
+import teller_path  # noqa: F401
+from vote_reader import add_vote, vote_count  # noqa: E402
+from vote_log import encode_votes, decode_votes, width_for  # noqa: E402
+from vote_db import connect, query_votes  # noqa: E402
+
+# How many ballots to read at a time when downloading a poll's votes
+CSV_BATCH_SIZE = 10000
+# How long the event loop's quick checks will wait on the database, in seconds
+# Reads in WAL mode almost never have to wait, and if one does it's fine
+# to give up and check again next time
+READER_TIMEOUT = 0.1
+
+
+class SqliteVoteLog:
+    _store: "SqliteStore"
+    poll_id: int
+    # Bytes per number in each ballot, see Teller/vote_log.py
+    width: int
+    # The id of the newest ballot that's been read in
+    position: int
+
+    def __init__(
+        self, store: "SqliteStore", poll_id: int, width: int, position: int
+    ) -> None:
+        self._store = store
+        self.poll_id = poll_id
+        self.width = width
+        self.position = position
+
+    def __repr__(self) -> str:
+        return f"poll {self.poll_id} in {self._store.path}"
+
+    def append(self, votes: list[list[int]]) -> tuple[list[list[int]], int]:
+        written = 0
+        with self._store.transaction() as connection:
+            # Ballots other workers have added since last time
+            rows = connection.execute(
+                "SELECT id, ballot FROM ballots WHERE poll_id = ? AND id > ? ORDER BY id",
+                (self.poll_id, self.position),
+            ).fetchall()
+            others = decode_votes(b"".join([row[1] for row in rows]), self.width)
+            position = rows[-1][0] if len(rows) > 0 else self.position
+
+            (log_bytes,) = connection.execute(
+                "SELECT log_bytes FROM polls WHERE id = ?", (self.poll_id,)
+            ).fetchone()
+            # If the poll is too big then just don't add the votes
+            if len(votes) > 0 and log_bytes < MAX_VOTE_SIZE:
+                ballots = [encode_votes([vote], self.width) for vote in votes]
+                connection.executemany(
+                    "INSERT INTO ballots (poll_id, ballot) VALUES (?, ?)",
+                    [(self.poll_id, ballot) for ballot in ballots],
+                )
+                written = sum([len(ballot) for ballot in ballots])
+                connection.execute(
+                    "UPDATE polls SET log_bytes = log_bytes + ? WHERE id = ?",
+                    (written, self.poll_id),
+                )
+                # Nothing else can add ballots during the transaction,
+                # so these are the newest
+                (position,) = connection.execute(
+                    "SELECT MAX(id) FROM ballots WHERE poll_id = ?", (self.poll_id,)
+                ).fetchone()
+        # Only moved on once it's definitely committed
+        self.position = position
+        return others, written
+
+    def behind(self) -> bool:
+        newest = self._store.newest_ballot(self.poll_id)
+        return newest is not None and newest > self.position
+
+    def sync(self) -> None:
+        # Commits are only synced to disk at checkpoints in WAL mode
+        self._store.checkpoint()
+
+    def close(self) -> None:
+        pass
+
+
+class SqliteStore:
+    path: Path
+    # Shared between threads, so only used while holding _lock
+    # Reading in whole polls uses separate connections, so it doesn't hold up the rest
+    _connection: sqlite3.Connection
+    _lock: threading.Lock
+    # Only used for the quick checks run on the event loop, newest_ballot and
+    # read_index, so they never wait on _lock while a thread is writing
+    _reader: sqlite3.Connection
+    # Number of polls and the newest ID when the index was last read,
+    # polls are never removed so this changes whenever one's added
+    _index_stamp: tuple[int, int | None] | None
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._connection = connect(path)
+        self._lock = threading.Lock()
+        self._reader = sqlite3.connect(
+            path, timeout=READER_TIMEOUT, isolation_level=None
+        )
+        self._index_stamp = None
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        # BEGIN IMMEDIATE takes the write lock straight away,
+        # so nothing else can add ballots or polls until it's committed
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._connection
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+            self._connection.execute("COMMIT")
+
+    def newest_ballot(self, poll_id: int) -> int | None:
+        # Uses ballots_by_poll_order, so it's quick no matter how many ballots
+        # None if the database was too busy to check
+        try:
+            (newest,) = self._reader.execute(
+                "SELECT COALESCE(MAX(id), 0) FROM ballots WHERE poll_id = ?",
+                (poll_id,),
+            ).fetchone()
+        except sqlite3.OperationalError:
+            return None
+        result: int = newest
+        return result
+
+    def checkpoint(self) -> None:
+        with self._lock:
+            self._connection.execute("PRAGMA wal_checkpoint(PASSIVE)")
+
+    def read_index(self) -> list[PollSummary] | None:
+        try:
+            stamp = self._reader.execute(
+                "SELECT COUNT(*), MAX(id) FROM polls"
+            ).fetchone()
+            if stamp == self._index_stamp:
+                return None
+            rows = self._reader.execute(
+                "SELECT name, id FROM polls ORDER BY id"
+            ).fetchall()
+        except sqlite3.OperationalError:
+            # Treated as nothing having changed, so it gets checked again next time
+            return None
+        self._index_stamp = stamp
+        return [PollSummary(name, poll_id) for name, poll_id in rows]
+
+    def create_poll(self, new_poll: NewPoll, max_polls: int | None) -> PollData:
+        with self.transaction() as connection:
+            count, new_id = connection.execute(
+                "SELECT COUNT(*), COALESCE(MAX(id) + 1, 0) FROM polls"
+            ).fetchone()
+            if max_polls is not None and count >= max_polls:
+                raise ValidationError(f"Hit maximum limit of {max_polls} polls")
+            config = PollData(**asdict(new_poll), election_id=new_id)
+            connection.execute(
+                "INSERT INTO polls (id, name, config) VALUES (?, ?, ?)",
+                (new_id, config.election_name, msgspec.json.encode(config)),
+            )
+        return config
+
+    def read_poll(
+        self, poll_id: int
+    ) -> tuple[PollData, vote_count, int, ResultsSnapshot | None]:
+        # Uses its own connection, as big polls can take a while to read
+        connection = sqlite3.connect(self.path)
+        try:
+            row = connection.execute(
+                "SELECT config, results FROM polls WHERE id = ?", (poll_id,)
+            ).fetchone()
+            if row is None:
+                raise KeyError(poll_id)
+            config = msgspec.json.decode(row[0], type=PollData)
+
+            # Ballots are added in order, so every ballot up to the newest is there
+            (position,) = connection.execute(
+                "SELECT COALESCE(MAX(id), 0) FROM ballots WHERE poll_id = ?",
+                (poll_id,),
+            ).fetchone()
+            tally: vote_count = dict()
+            width = width_for(len(config.candidate_names))
+            for vote, amount in query_votes(connection, poll_id, width, position):
+                add_vote(tally, vote, amount)
+        finally:
+            connection.close()
+
+        snapshot: ResultsSnapshot | None = None
+        if row[1] is not None:
+            try:
+                snapshot = msgspec.json.decode(row[1], type=ResultsSnapshot)
+            except msgspec.DecodeError as error:
+                print(f"Warning! Ignoring broken results for poll {poll_id}: {error}")
+        return config, tally, position, snapshot
+
+    def open_log(self, config: PollData, position: int | None) -> VoteLog:
+        return SqliteVoteLog(
+            self,
+            config.election_id,
+            width_for(len(config.candidate_names)),
+            position if position is not None else 0,
+        )
+
+    def write_results(self, poll_id: int, snapshot: ResultsSnapshot) -> None:
+        with self._lock:
+            self._connection.execute(
+                "UPDATE polls SET results = ? WHERE id = ?",
+                (msgspec.json.encode(snapshot), poll_id),
+            )
+
+    def iter_votes_csv(self, poll_id: int) -> Iterator[str]:
+        # Uses its own connection, so a slow download doesn't hold up the rest
+        # Each batch can be read from a different thread
+        connection = sqlite3.connect(self.path, check_same_thread=False)
+        try:
+            (config,) = connection.execute(
+                "SELECT config FROM polls WHERE id = ?", (poll_id,)
+            ).fetchone()
+            width = width_for(
+                len(msgspec.json.decode(config, type=PollData).candidate_names)
+            )
+            cursor = connection.execute(
+                "SELECT ballot FROM ballots WHERE poll_id = ? ORDER BY id", (poll_id,)
+            )
+            while True:
+                rows = cursor.fetchmany(CSV_BATCH_SIZE)
+                if len(rows) == 0:
+                    break
+                votes = decode_votes(b"".join([row[0] for row in rows]), width)
+                yield "".join(
+                    [",".join([str(x) for x in vote]) + "\n" for vote in votes]
+                )
+        finally:
+            connection.close()
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+        self._reader.close()
@@ -0,0 +1,10 @@
+# teller_path.py
+# Teller gets imported as a library instead of being run as a subprocess,
+# so the folder containing it needs to be importable
+# Import this before importing anything from Teller
+import os
+import sys
+from pathlib import Path
+
+TELLER_LOCATION = os.getenv("TELLER_LOCATION", "../Teller/main.py")
+sys.path.append(str(Path(TELLER_LOCATION).absolute().parent))
@@ -0,0 +1,43 @@
+# conftest.py
+# Poller's modules import each other by name, so the Poller folder needs to be
+# importable when running pytest from anywhere, and so does Teller
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+POLLER_FOLDER = Path(__file__).absolute().parent.parent
+os.environ.setdefault(
+    "TELLER_LOCATION", str(POLLER_FOLDER.parent / "Teller" / "main.py")
+)
+# main.py makes a PollManager as soon as it's imported, so it gets pointed
+# somewhere out of the way here. Each test swaps in a PollManager of its own
+os.environ.setdefault("POLL_STORE_LOCATION", tempfile.mkdtemp())
+# At the front, as Teller has a main.py too
+sys.path.insert(0, str(POLLER_FOLDER))
+
+import asyncio  # noqa: E402
+from typing import Awaitable, Callable  # noqa: E402
+
+import pytest  # noqa: E402
+
+import main  # noqa: E402
+from poll_manager import PollManager  # noqa: E402
+from poll_store import FolderStore  # noqa: E402
+from polls import Client, RunApp  # noqa: E402
+
+
+@pytest.fixture
+def run_app(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> RunApp:
+    # Runs a test against the app, with a PollManager of its own
+    # that's closed when the app shuts down
+    monkeypatch.setattr(main, "poll_manager", PollManager(FolderStore(tmp_path)))
+
+    def run(test: Callable[[Client], Awaitable[None]]) -> None:
+        async def serve() -> None:
+            async with main.app.test_app() as app:
+                await test(app.test_client())
+
+        asyncio.run(serve())
+
+    return run
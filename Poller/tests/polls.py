@@ -0,0 +1,49 @@
+# polls.py
+# Helpers for tests that go through the app's endpoints
+import asyncio
+import time
+from typing import Any, Awaitable, Callable
+
+from quart.typing import TestClientProtocol
+
+NEW_POLL: dict[str, Any] = {
+    "election_name": "Test Poll",
+    "minimum_preferences": 0,
+    "winner_amount": 1,
+    "candidate_names": ["a", "b", "c"],
+    "candidate_descriptions": ["", "", ""],
+    "randomise_order": False,
+}
+# Under another name so pytest doesn't try to collect it as a test class
+# from the test modules that import it
+Client = TestClientProtocol
+# Longest to wait for a count to finish, in seconds
+COUNT_TIMEOUT = 10.0
+
+# The run_app fixture from conftest.py
+RunApp = Callable[[Callable[[Client], Awaitable[None]]], None]
+
+
+async def new_poll(client: Client, **changes: Any) -> int:
+    response = await client.post("/submit_poll", json={**NEW_POLL, **changes})
+    assert response.status_code == 200
+    body: Any = await response.get_json()
+    poll_id: int = body["election_id"]
+    return poll_id
+
+
+async def results_after(client: Client, poll_id: int, etag: str) -> tuple[Any, str]:
+    # Waits for a count to replace the results with the given ETag
+    deadline = time.monotonic() + COUNT_TIMEOUT
+    while time.monotonic() < deadline:
+        response = await client.post(
+            "/get_poll_results",
+            json={"election_id": poll_id},
+            headers={"If-None-Match": etag},
+        )
+        if response.status_code == 200:
+            new_etag = response.headers["ETag"].strip('"')
+            return await response.get_json(), new_etag
+        assert response.status_code == 304
+        await asyncio.sleep(0.05)
+    raise AssertionError("Results never changed")
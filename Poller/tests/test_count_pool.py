@@ -0,0 +1,61 @@
+# test_count_pool.py
+# Counting should carry on after a worker process dies
+import asyncio
+import os
+import signal
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+import pytest
+
+import main
+from count_pool import CountPool
+from polls import Client, RunApp, new_poll
+
+
+def die_once(marker: Path, value: int) -> int:
+    # Kills the worker process running it the first time, like it ran out of memory
+    if not marker.exists():
+        marker.touch()
+        os.kill(os.getpid(), signal.SIGKILL)
+    return value
+
+
+def always_die() -> None:
+    os.kill(os.getpid(), signal.SIGKILL)
+
+
+def test_worker_dies(tmp_path: Path) -> None:
+    async def test() -> None:
+        pool = CountPool(2)
+        try:
+            # The job that was running gets tried again in new worker processes
+            assert await pool.run(1, die_once, tmp_path / "died", 5) == 5
+            assert pool.running == 0
+            # A job that keeps killing workers is only tried twice
+            with pytest.raises(BrokenProcessPool):
+                await pool.run(2, always_die)
+            # And everything's fine for the next one
+            assert await pool.run(3, pow, 2, 10) == 1024
+            assert pool.running == 0
+        finally:
+            pool.shutdown()
+
+    asyncio.run(test())
+
+
+def test_results_not_ready(run_app: RunApp) -> None:
+    async def test(client: Client) -> None:
+        poll_id = await new_poll(client)
+        response = await client.post(
+            "/submit_vote", json={"election_id": poll_id, "preferences": [1, 0, 2]}
+        )
+        assert response.status_code == 200
+        # Nothing can be counted while the pool's full, so the poll's never counted
+        main.poll_manager.count_pool.queue_limit = 0
+        for route in ["/get_poll_results", "/get_poll_trace"]:
+            response = await client.post(route, json={"election_id": poll_id})
+            assert response.status_code == 503
+            assert response.headers["Retry-After"] == str(main.RESULTS_RETRY_AFTER)
+
+    run_app(test)
@@ -0,0 +1,42 @@
+# test_etags.py
+# Results and details carry ETags, so clients checking often can get a 304
+from polls import Client, RunApp, new_poll, results_after
+
+
+def test_results_not_modified(run_app: RunApp) -> None:
+    async def test(client: Client) -> None:
+        poll_id = await new_poll(client)
+        response = await client.post("/get_poll_results", json={"election_id": poll_id})
+        assert response.status_code == 200
+        etag = response.headers["ETag"]
+
+        # Asking again with the ETag gets an empty 304
+        response = await client.post(
+            "/get_poll_results",
+            json={"election_id": poll_id},
+            headers={"If-None-Match": etag},
+        )
+        assert response.status_code == 304
+        assert await response.get_data() == b""
+        assert response.headers["ETag"] == etag
+
+        # Until a vote gets counted
+        response = await client.post(
+            "/submit_vote", json={"election_id": poll_id, "preferences": [1, 0, 2]}
+        )
+        assert response.status_code == 200
+        results, new_etag = await results_after(client, poll_id, etag.strip('"'))
+        assert results["winners"] == [1]
+        assert new_etag != etag.strip('"')
+
+        # Details never change, so they're always a 304 with their ETag
+        response = await client.post("/get_poll_details", json={"election_id": poll_id})
+        assert response.status_code == 200
+        response = await client.post(
+            "/get_poll_details",
+            json={"election_id": poll_id},
+            headers={"If-None-Match": response.headers["ETag"]},
+        )
+        assert response.status_code == 304
+
+    run_app(test)
@@ -0,0 +1,44 @@
+# test_poll_list.py
+# Listing polls a page at a time, newest first
+from typing import Any
+
+from polls import Client, RunApp, new_poll
+
+
+def test_pages(run_app: RunApp) -> None:
+    async def test(client: Client) -> None:
+        poll_ids = [await new_poll(client, election_name=f"Poll {n}") for n in range(5)]
+        newest_first = list(reversed(poll_ids))
+
+        response = await client.get("/get_polls")
+        assert response.status_code == 200
+        assert "Next-Cursor" not in response.headers
+        body: Any = await response.get_json()
+        assert [poll["election_id"] for poll in body] == newest_first
+        assert body[0]["election_name"] == "Poll 4"
+
+        # Following Next-Cursor goes through every poll exactly once
+        pages: list[list[int]] = []
+        query: dict[str, int] = {"limit": 2}
+        while True:
+            response = await client.get("/get_polls", query_string=query)
+            assert response.status_code == 200
+            body = await response.get_json()
+            pages.append([poll["election_id"] for poll in body])
+            if "Next-Cursor" not in response.headers:
+                break
+            query["cursor"] = int(response.headers["Next-Cursor"])
+        assert pages == [newest_first[0:2], newest_first[2:4], newest_first[4:]]
+
+        # A new poll doesn't change pages further along
+        await new_poll(client)
+        response = await client.get(
+            "/get_polls", query_string={"cursor": newest_first[1], "limit": 2}
+        )
+        body = await response.get_json()
+        assert [poll["election_id"] for poll in body] == newest_first[2:4]
+
+        response = await client.get("/get_polls", query_string={"limit": 0})
+        assert response.status_code == 400
+
+    run_app(test)
@@ -0,0 +1,90 @@
+# test_poll_manager.py
+# Polls are only loaded when they're used, and the least recently used get unloaded
+import asyncio
+from pathlib import Path
+
+import pytest
+
+import poll_manager
+from poll_data import NewPoll, Vote
+from poll_manager import PollManager
+from poll_store import FolderStore
+from polls import NEW_POLL
+
+
+async def make_polls(folder: Path, amount: int) -> list[int]:
+    manager = PollManager(FolderStore(folder))
+    poll_ids = [await manager.add_poll(NewPoll(**NEW_POLL)) for _ in range(amount)]
+    vote = Vote(poll_ids[0], [2, 0, 1])
+    await manager.validate_vote(vote)
+    manager.add_vote(vote)
+    await manager.close()
+    return poll_ids
+
+
+def test_loaded_when_used(tmp_path: Path) -> None:
+    async def test() -> None:
+        poll_ids = await make_polls(tmp_path, 3)
+        manager = PollManager(FolderStore(tmp_path))
+        try:
+            # Every poll's listed straight away, but none are read in yet
+            assert sorted(manager.summaries) == poll_ids
+            assert len(manager._loaded) == 0
+
+            # Requests that arrive together share one load
+            first, again = await asyncio.gather(
+                manager.get_poll(poll_ids[0]), manager.get_poll(poll_ids[0])
+            )
+            assert first is again
+            assert list(manager._loaded) == [poll_ids[0]]
+            results = await first.get_results(False)
+            assert results.first_preferences == [0, 0, 1]
+
+            with pytest.raises(KeyError):
+                await manager.get_poll(poll_ids[-1] + 1)
+        finally:
+            await manager.close()
+
+    asyncio.run(test())
+
+
+def test_least_recently_used_unloaded(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(poll_manager, "MAX_LOADED_POLLS", 2)
+
+    async def test() -> None:
+        poll_ids = await make_polls(tmp_path, 4)
+        manager = PollManager(FolderStore(tmp_path))
+        try:
+            first = await manager.get_poll(poll_ids[0])
+            await manager.get_poll(poll_ids[1])
+            # Using the first poll again makes the second the least recently used
+            await manager.get_poll(poll_ids[0])
+            await manager.get_poll(poll_ids[2])
+            assert list(manager._loaded) == [poll_ids[0], poll_ids[2]]
+
+            # Polls with someone watching them stay loaded no matter what
+            events = first.subscribe()
+            await manager.get_poll(poll_ids[1])
+            await manager.get_poll(poll_ids[3])
+            assert poll_ids[0] in manager._loaded
+            assert list(manager._loaded)[-1] == poll_ids[3]
+            first.unsubscribe(events)
+            # Subscribing started a count, which has to finish before it can go
+            await first.get_results(False)
+            assert not first.pinned
+
+            # Once it's not pinned it can go, and comes back with its votes
+            await manager.get_poll(poll_ids[2])
+            assert poll_ids[0] not in manager._loaded
+            if len(manager._closing) > 0:
+                await asyncio.wait(manager._closing)
+            reloaded = await manager.get_poll(poll_ids[0])
+            assert reloaded is not first
+            results = await reloaded.get_results(False)
+            assert results.first_preferences == [0, 0, 1]
+        finally:
+            await manager.close()
+
+    asyncio.run(test())
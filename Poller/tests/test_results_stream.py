@@ -0,0 +1,86 @@
+# test_results_stream.py
+# Server-sent events with a poll's results every time they change
+import asyncio
+import json
+from typing import Any
+
+import pytest
+
+import main
+import single_poll
+from polls import COUNT_TIMEOUT, Client, RunApp, new_poll, results_after
+
+
+def parse_event(event: bytes) -> tuple[str, Any]:
+    # Just enough to read the events Poller sends, one at a time
+    fields = dict(line.split(": ", 1) for line in event.decode().strip().split("\n"))
+    return fields["id"], json.loads(fields["data"])
+
+
+async def submit_vote(client: Client, poll_id: int, preferences: list[int]) -> None:
+    response = await client.post(
+        "/submit_vote", json={"election_id": poll_id, "preferences": preferences}
+    )
+    assert response.status_code == 200
+
+
+def test_stream(run_app: RunApp) -> None:
+    async def test(client: Client) -> None:
+        poll_id = await new_poll(client)
+        async with client.request(
+            "/poll_results_stream", query_string={"election_id": poll_id}
+        ) as connection:
+            await connection.send_complete()
+            # Starts off with the results as they are, a tie with no votes yet
+            etag, results = parse_event(
+                await asyncio.wait_for(connection.receive(), COUNT_TIMEOUT)
+            )
+            assert results["tied_winners"] == [0, 1, 2]
+
+            # Then sends them again once a vote's been counted
+            await submit_vote(client, poll_id, [1, 2, 0])
+            new_etag, results = parse_event(
+                await asyncio.wait_for(connection.receive(), COUNT_TIMEOUT)
+            )
+            assert results["winners"] == [1]
+            # With the same ETag /get_poll_results gives
+            assert new_etag != etag
+            response = await client.post(
+                "/get_poll_results",
+                json={"election_id": poll_id},
+                headers={"If-None-Match": f'"{new_etag}"'},
+            )
+            assert response.status_code == 304
+            await connection.disconnect()
+
+        response = await client.get(
+            "/poll_results_stream", query_string={"election_id": poll_id + 1}
+        )
+        assert response.status_code == 400
+
+    run_app(test)
+
+
+def test_slow_subscriber_dropped(
+    run_app: RunApp, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(single_poll, "SUBSCRIBER_QUEUE_SIZE", 2)
+
+    async def test(client: Client) -> None:
+        poll_id = await new_poll(client)
+        response = await client.post("/get_poll_results", json={"election_id": poll_id})
+        etag = response.headers["ETag"].strip('"')
+        poll = await main.poll_manager.get_poll(poll_id)
+        # Never reading anything from it
+        events = poll.subscribe()
+
+        for _ in range(3):
+            await submit_vote(client, poll_id, [0, 1, 2])
+            _, etag = await results_after(client, poll_id, etag)
+
+        # Whatever was queued up is thrown away, and the stream is told to end
+        assert events.get_nowait() is None
+        assert events.empty()
+        assert events not in poll._subscribers
+
+    run_app(test)
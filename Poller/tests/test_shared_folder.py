@@ -0,0 +1,74 @@
+# test_shared_folder.py
+# Several Poller workers can share one polls folder, each with its own FolderStore
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from poll_data import NewPoll
+from poll_store import FolderStore
+from polls import NEW_POLL
+
+
+def test_polls_shared(tmp_path: Path) -> None:
+    first = FolderStore(tmp_path)
+    second = FolderStore(tmp_path)
+    first.read_index()
+    second.read_index()
+    poll_ids = [
+        first.create_poll(NewPoll(**NEW_POLL), None).election_id,
+        second.create_poll(NewPoll(**NEW_POLL), None).election_id,
+        first.create_poll(NewPoll(**NEW_POLL), None).election_id,
+    ]
+    # IDs are never given out twice, and each sees the others' polls
+    assert len(set(poll_ids)) == 3
+    for store in [first, second]:
+        index = store.read_index()
+        assert index is not None
+        assert [summary.election_id for summary in index] == sorted(poll_ids)
+        # Until something changes
+        assert store.read_index() is None
+    first.close()
+    second.close()
+
+
+def test_votes_shared(tmp_path: Path) -> None:
+    first = FolderStore(tmp_path)
+    second = FolderStore(tmp_path)
+    config = first.create_poll(NewPoll(**NEW_POLL), None)
+    first_log = first.open_log(config, None)
+    _, _, position, _ = second.read_poll(config.election_id)
+    second_log = second.open_log(config, position)
+
+    # Each append picks up whatever the other has added since
+    assert first_log.append([[0, 1, 2]])[0] == []
+    assert second_log.behind()
+    assert second_log.append([[1, 0]])[0] == [[0, 1, 2]]
+    assert first_log.behind()
+    assert first_log.append([])[0] == [[1, 0]]
+    assert not first_log.behind()
+
+    # Lots of appends at once from both still come out as whole votes
+    def add_votes(log_index: int) -> list[list[int]]:
+        log = [first_log, second_log][log_index]
+        seen: list[list[int]] = []
+        for _ in range(200):
+            others, written = log.append([[log_index, 2], [2]])
+            assert written > 0
+            seen.extend(others)
+        return seen
+
+    with ThreadPoolExecutor(2) as pool:
+        seen = list(pool.map(add_votes, [0, 1]))
+    # Each worker saw every vote the other added
+    assert seen[0].count([1, 2]) + first_log.append([])[0].count([1, 2]) == 200
+    assert seen[1].count([0, 2]) + second_log.append([])[0].count([0, 2]) == 200
+    first_log.close()
+    second_log.close()
+
+    _, tally, _, _ = FolderStore(tmp_path).read_poll(config.election_id)
+    assert tally[(0, 1, 2)][0] == 1
+    assert tally[(1, 0)][0] == 1
+    assert tally[(0, 2)][0] == 200
+    assert tally[(1, 2)][0] == 200
+    assert tally[(2,)][0] == 400
+    first.close()
+    second.close()
@@ -0,0 +1,103 @@
+# test_snapshots.py
+# The last results counted get saved, so they're ready straight away after a restart
+import asyncio
+from pathlib import Path
+
+import pytest
+
+from poll_data import NewPoll, ResultsSnapshot, Vote
+from poll_manager import PollManager
+from poll_store import FolderStore, RESULTS_NAME
+from polls import NEW_POLL
+from single_poll import ResultsNotReady
+
+
+async def add_vote(manager: PollManager, poll_id: int, preferences: list[int]) -> None:
+    vote = Vote(poll_id, preferences)
+    await manager.validate_vote(vote)
+    manager.add_vote(vote)
+
+
+def restarted(folder: Path) -> PollManager:
+    # A new manager that can't count anything, so any results have to be saved ones
+    manager = PollManager(FolderStore(folder))
+    manager.count_pool.queue_limit = 0
+    return manager
+
+
+def test_restored(tmp_path: Path) -> None:
+    async def test() -> None:
+        manager = PollManager(FolderStore(tmp_path))
+        poll_id = await manager.add_poll(NewPoll(**NEW_POLL))
+        await add_vote(manager, poll_id, [1, 0, 2])
+        poll = await manager.get_poll(poll_id)
+        counted = await poll.get_results(False)
+        assert counted.winners == [1]
+        await manager.close()
+        assert (tmp_path / str(poll_id) / RESULTS_NAME).is_file()
+
+        manager = restarted(tmp_path)
+        try:
+            poll = await manager.get_poll(poll_id)
+            assert await poll.get_results(True) == counted
+            # Nothing's changed, so there's nothing to count
+            assert not poll.pinned
+        finally:
+            await manager.close()
+
+    asyncio.run(test())
+
+
+def test_votes_after_snapshot(tmp_path: Path) -> None:
+    async def test() -> None:
+        manager = PollManager(FolderStore(tmp_path))
+        poll_id = await manager.add_poll(NewPoll(**NEW_POLL))
+        await add_vote(manager, poll_id, [1, 0, 2])
+        poll = await manager.get_poll(poll_id)
+        counted = await poll.get_results(False)
+        # Written, but closed before it gets counted
+        await add_vote(manager, poll_id, [2, 0, 1])
+        await add_vote(manager, poll_id, [2, 1, 0])
+        await manager.close()
+
+        # The old results are used until the new votes get counted
+        manager = restarted(tmp_path)
+        try:
+            poll = await manager.get_poll(poll_id)
+            assert await poll.get_results(True) == counted
+            manager.count_pool.queue_limit = 10
+            recounted = await poll.get_results(False)
+            assert recounted.winners == [2]
+            assert recounted.first_preferences == [0, 1, 2]
+        finally:
+            await manager.close()
+
+    asyncio.run(test())
+
+
+def test_out_of_date_snapshot_ignored(tmp_path: Path) -> None:
+    async def test() -> None:
+        manager = PollManager(FolderStore(tmp_path))
+        poll_id = await manager.add_poll(NewPoll(**NEW_POLL))
+        await add_vote(manager, poll_id, [1, 0, 2])
+        poll = await manager.get_poll(poll_id)
+        counted = await poll.get_results(False)
+        await manager.close()
+        # Claims to cover more votes than there are, like the vote log got replaced
+        store = FolderStore(tmp_path)
+        snapshot = store.read_poll(poll_id)[3]
+        assert snapshot is not None and snapshot.results == counted
+        store.write_results(
+            poll_id, ResultsSnapshot(snapshot.results, snapshot.trace, 1 << 20)
+        )
+        store.close()
+
+        manager = restarted(tmp_path)
+        try:
+            poll = await manager.get_poll(poll_id)
+            with pytest.raises(ResultsNotReady):
+                await poll.get_results(True)
+        finally:
+            await manager.close()
+
+    asyncio.run(test())
@@ -0,0 +1,94 @@
+# test_sqlite_store.py
+# Keeping every poll in one SQLite database, shared between workers
+import asyncio
+from pathlib import Path
+
+import pytest
+
+from poll_data import NewPoll, ValidationError, Vote
+from poll_manager import PollManager
+from polls import NEW_POLL
+from sqlite_store import SqliteStore
+
+
+def test_polls(tmp_path: Path) -> None:
+    store = SqliteStore(tmp_path / "polls.db")
+    other = SqliteStore(tmp_path / "polls.db")
+    assert store.read_index() == []
+    poll_ids = [store.create_poll(NewPoll(**NEW_POLL), 2).election_id for _ in range(2)]
+    with pytest.raises(ValidationError):
+        other.create_poll(NewPoll(**NEW_POLL), 2)
+
+    index = other.read_index()
+    assert index is not None
+    assert [summary.election_id for summary in index] == poll_ids
+    # Until another poll gets added
+    assert other.read_index() is None
+    store.create_poll(NewPoll(**NEW_POLL), None)
+    index = other.read_index()
+    assert index is not None and len(index) == 3
+
+    config, tally, position, snapshot = other.read_poll(poll_ids[0])
+    assert config.election_id == poll_ids[0]
+    assert config.candidate_names == NEW_POLL["candidate_names"]
+    assert tally == {} and position == 0 and snapshot is None
+    with pytest.raises(KeyError):
+        store.read_poll(100)
+    store.close()
+    other.close()
+
+
+def test_votes(tmp_path: Path) -> None:
+    store = SqliteStore(tmp_path / "polls.db")
+    other = SqliteStore(tmp_path / "polls.db")
+    config = store.create_poll(NewPoll(**NEW_POLL), None)
+    poll_id = config.election_id
+    log = store.open_log(config, None)
+    other_log = other.open_log(config, other.read_poll(poll_id)[2])
+    assert store.newest_ballot(poll_id) == 0
+
+    # Each append picks up whatever the other has added since
+    others, written = log.append([[0, 1, 2], [1]])
+    assert others == [] and written > 0
+    assert other_log.behind()
+    assert other_log.append([[2, 0]])[0] == [[0, 1, 2], [1]]
+    assert log.behind()
+    assert log.append([])[0] == [[2, 0]]
+    assert not log.behind()
+    newest = store.newest_ballot(poll_id)
+    assert newest is not None and newest > 0
+
+    _, tally, position, _ = store.read_poll(poll_id)
+    assert tally == {(0, 1, 2): [1, 1.0], (1,): [1, 1.0], (2, 0): [1, 1.0]}
+    assert position == newest
+    assert "".join(store.iter_votes_csv(poll_id)) == "0,1,2\n1\n2,0\n"
+    log.close()
+    other_log.close()
+    store.close()
+    other.close()
+
+
+def test_poll_manager(tmp_path: Path) -> None:
+    async def test() -> None:
+        manager = PollManager(SqliteStore(tmp_path / "polls.db"))
+        poll_id = await manager.add_poll(NewPoll(**NEW_POLL))
+        for preferences in [[2, 0, 1], [2, 1, 0], [1, 0, 2]]:
+            vote = Vote(poll_id, preferences)
+            await manager.validate_vote(vote)
+            manager.add_vote(vote)
+        poll = await manager.get_poll(poll_id)
+        results = await poll.get_results(False)
+        assert results.first_preferences == [0, 1, 2]
+        assert results.winners == [2]
+        await manager.close()
+
+        # Everything's still there after a restart, including the results
+        store = SqliteStore(tmp_path / "polls.db")
+        _, tally, position, snapshot = store.read_poll(poll_id)
+        assert sum([amount for amount, _ in tally.values()]) == 3
+        assert snapshot is not None
+        assert snapshot.log_size == position
+        assert snapshot.results == results
+        store.close()
+
+    asyncio.run(test())
@@ -0,0 +1,38 @@
+# test_vote_batches.py
+# Submitting lots of ballots for a poll at once
+from polls import Client, RunApp, new_poll, results_after
+
+
+def test_submit_votes(run_app: RunApp) -> None:
+    async def test(client: Client) -> None:
+        poll_id = await new_poll(client)
+        response = await client.post("/get_poll_results", json={"election_id": poll_id})
+        etag = response.headers["ETag"].strip('"')
+
+        ballots = [[2, 0, 1], [2, 1, 0], [0, 0, 1], [0, 1], [0, 1, 3], [1, 2, 0]]
+        response = await client.post(
+            "/submit_votes", json={"election_id": poll_id, "ballots": ballots}
+        )
+        assert response.status_code == 200
+        body = await response.get_json()
+        assert body["accepted"] == 3
+        # Each ballot gets an error, or null if it was accepted, in the order sent
+        assert [error is None for error in body["errors"]] == [
+            True,
+            True,
+            False,
+            False,
+            False,
+            True,
+        ]
+
+        results, _ = await results_after(client, poll_id, etag)
+        assert results["first_preferences"] == [0, 1, 2]
+        assert results["winners"] == [2]
+
+        response = await client.post(
+            "/submit_votes", json={"election_id": poll_id + 1, "ballots": ballots}
+        )
+        assert response.status_code == 400
+
+    run_app(test)
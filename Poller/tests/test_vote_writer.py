@@ -0,0 +1,107 @@
+# test_vote_writer.py
+# Votes that fail to write get tried again, and are only dropped as a last resort
+import asyncio
+
+import pytest
+
+import vote_writer
+from vote_writer import VoteWriter, VOTES_DROPPED, WRITE_ERRORS
+
+
+class FlakyLog:
+    # A VoteLog that fails the first few appends, like a disk that's full for a bit
+    position: int
+    failures: int
+    # Set to make appends report the votes didn't fit, like past MAX_VOTE_SIZE
+    full: bool
+    votes: list[list[int]]
+    closed: bool
+
+    def __init__(self, failures: int) -> None:
+        self.position = 0
+        self.failures = failures
+        self.full = False
+        self.votes = []
+        self.closed = False
+
+    def append(self, votes: list[list[int]]) -> tuple[list[list[int]], int]:
+        if self.failures > 0:
+            self.failures -= 1
+            raise OSError("No space left on device")
+        if self.full:
+            return [], 0
+        self.votes.extend(votes)
+        self.position += len(votes)
+        return [], len(votes)
+
+    def behind(self) -> bool:
+        return False
+
+    def sync(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+
+@pytest.fixture(autouse=True)
+def quick_retries(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(vote_writer, "VOTE_RETRY_DELAY", 0.01)
+    monkeypatch.setattr(vote_writer, "VOTE_FSYNC_INTERVAL_MS", 10.0)
+
+
+def test_failed_write_retried() -> None:
+    async def test() -> None:
+        log = FlakyLog(2)
+        written: list[list[int]] = []
+        writer = VoteWriter(log, written.extend)
+        errors = WRITE_ERRORS.values[""]
+        writer.add([[0, 1], [1, 0]])
+        writer.add([[2]])
+        while not writer.idle:
+            await asyncio.sleep(0.01)
+        # Nothing lost, and still in the order they came in
+        assert log.votes == [[0, 1], [1, 0], [2]]
+        assert written == log.votes
+        assert WRITE_ERRORS.values[""] == errors + 2
+        await writer.close()
+        assert log.closed
+
+    asyncio.run(test())
+
+
+def test_dropped_when_closed() -> None:
+    async def test() -> None:
+        log = FlakyLog(1000)
+        written: list[list[int]] = []
+        writer = VoteWriter(log, written.extend)
+        dropped = VOTES_DROPPED.values[""]
+        writer.add([[0], [1], [2]])
+        await writer.flush()
+        assert writer.pending == 3
+        # Closing is the last chance to write them
+        await writer.close()
+        assert writer.pending == 0
+        assert written == []
+        assert VOTES_DROPPED.values[""] == dropped + 3
+        assert log.closed
+
+    asyncio.run(test())
+
+
+def test_dropped_when_full() -> None:
+    async def test() -> None:
+        log = FlakyLog(0)
+        log.full = True
+        written: list[list[int]] = []
+        writer = VoteWriter(log, written.extend)
+        dropped = VOTES_DROPPED.values[""]
+        writer.add([[0], [1]])
+        await writer.flush()
+        # These aren't tried again, the poll's just too big
+        assert writer.pending == 0
+        assert written == []
+        assert VOTES_DROPPED.values[""] == dropped + 2
+        await writer.close()
+
+    asyncio.run(test())
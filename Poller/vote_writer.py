@@ -0,0 +1,194 @@
+# vote_writer.py
+# VoteWriter class, which adds votes to a poll's vote log
+# Votes are gathered up and written in batches,
+# rather than writing once for every vote
+# Other Poller workers can be adding to the same poll,
+# so every write also picks up their votes, see poll_store.py
+import asyncio
+import os
+import time
+from typing import Callable
+
+from poll_store import VoteLog, MAX_VOTE_SIZE
+from metrics import Counter, Histogram
+
+# How long to wait for more votes before writing a batch, in milliseconds
+VOTE_BATCH_DELAY_MS = float(os.getenv("VOTE_BATCH_DELAY_MS", "5"))
+# Write straight away once this many votes are waiting
+VOTE_BATCH_MAX = int(os.getenv("VOTE_BATCH_MAX", "1000"))
+# When to fsync the vote log, making sure votes survive a crash
+# "batch" syncs after every batch, "interval" at most every VOTE_FSYNC_INTERVAL_MS,
+# and "never" leaves it up to the operating system
+VOTE_FSYNC = os.getenv("VOTE_FSYNC", "interval")
+VOTE_FSYNC_INTERVAL_MS = float(os.getenv("VOTE_FSYNC_INTERVAL_MS", "1000"))
+FSYNC_POLICIES = ["batch", "interval", "never"]
+if VOTE_FSYNC not in FSYNC_POLICIES:
+    raise ValueError(f"VOTE_FSYNC must be one of {FSYNC_POLICIES}")
+# How long to wait before trying again when writing a batch fails, in seconds
+VOTE_RETRY_DELAY = 1.0
+
+WRITE_SECONDS = Histogram(
+    "poller_vote_write_seconds",
+    "How long each batch of votes takes to append to a vote log.",
+)
+WRITE_BYTES = Counter(
+    "poller_vote_write_bytes_total", "Bytes of votes appended to vote logs."
+)
+VOTES_DROPPED = Counter(
+    "poller_votes_dropped_total",
+    "Votes thrown away because their poll was past the max vote log size,"
+    " or because they still couldn't be written when the poll was closed.",
+)
+WRITE_ERRORS = Counter(
+    "poller_vote_write_errors_total",
+    "Batches of votes that failed to write and were put back to try again.",
+)
+SYNC_SECONDS = Histogram(
+    "poller_vote_sync_seconds", "How long each sync of a vote log to disk takes."
+)
+
+
+class VoteWriter:
+    # Where the votes go, which knows how far it's read up to
+    _log: VoteLog
+    # Called with each batch of votes once they've been written,
+    # including ones other workers wrote
+    _on_written: Callable[[list[list[int]]], None]
+    # Votes waiting to be written
+    _pending: list[list[int]]
+    # Only one batch gets written at a time
+    _lock: asyncio.Lock
+    _flush_task: "asyncio.Task[None] | None"
+    _sync_task: "asyncio.Task[None] | None"
+    # If there's been a write since the last fsync
+    _dirty: bool
+    _last_sync: float
+
+    def __init__(
+        self, log: VoteLog, on_written: Callable[[list[list[int]]], None]
+    ) -> None:
+        self._log = log
+        self._on_written = on_written
+        self._pending = []
+        self._lock = asyncio.Lock()
+        self._flush_task = None
+        self._sync_task = None
+        self._dirty = False
+        self._last_sync = time.monotonic()
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    @property
+    def idle(self) -> bool:
+        # If there's nothing waiting to be written or synced
+        return (
+            len(self._pending) == 0
+            and self._flush_task is None
+            and self._sync_task is None
+            and not self._lock.locked()
+        )
+
+    @property
+    def position(self) -> int:
+        # How far into the vote log has been handed to _on_written
+        return self._log.position
+
+    def behind(self) -> bool:
+        # If another worker has added to the vote log since it was last read
+        return self._log.behind()
+
+    def add(self, votes: list[list[int]]) -> None:
+        # Queue votes to be written in the next batch
+        self._pending.extend(votes)
+        if self._flush_task is None:
+            delay = 0.0
+            if len(self._pending) < VOTE_BATCH_MAX:
+                delay = VOTE_BATCH_DELAY_MS / 1000
+            self._flush_task = asyncio.create_task(self._delayed_flush(delay))
+
+    async def flush(self) -> None:
+        # Write everything that's waiting, straight away,
+        # and read in anything other workers have written
+        async with self._lock:
+            votes = self._pending
+            self._pending = []
+            if len(votes) == 0 and not self.behind():
+                return
+
+            start = time.perf_counter()
+            try:
+                others, written = await asyncio.to_thread(self._log.append, votes)
+            except Exception as error:
+                # Like a full disk, or the database being locked for too long
+                # The votes go back to the front, to be tried again after a while
+                WRITE_ERRORS.inc()
+                print(
+                    f"Warning! Failed to write {len(votes)} votes to {self._log}, trying again: {error!r}"
+                )
+                self._pending = votes + self._pending
+                if self._flush_task is None:
+                    self._flush_task = asyncio.create_task(
+                        self._delayed_flush(VOTE_RETRY_DELAY)
+                    )
+                return
+            WRITE_SECONDS.observe(time.perf_counter() - start)
+            if written > 0:
+                WRITE_BYTES.inc(written)
+                self._dirty = True
+                if VOTE_FSYNC == "batch":
+                    await self._sync()
+                elif VOTE_FSYNC == "interval" and self._sync_task is None:
+                    self._sync_task = asyncio.create_task(self._delayed_sync())
+                # Only count the votes that actually made it into the file
+                others.extend(votes)
+            elif len(votes) > 0:
+                VOTES_DROPPED.inc(len(votes))
+                print(
+                    f"{self._log} is bigger than the max size of {MAX_VOTE_SIZE} bytes! Dropping votes to prevent abuse"
+                )
+
+            if len(others) > 0:
+                self._on_written(others)
+
+    async def close(self) -> None:
+        await self.flush()
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+        if self._sync_task is not None:
+            self._sync_task.cancel()
+        if len(self._pending) > 0:
+            # The last try at writing them failed, and there won't be another
+            VOTES_DROPPED.inc(len(self._pending))
+            print(
+                f"Warning! Dropping {len(self._pending)} votes that couldn't be written to {self._log}"
+            )
+            self._pending = []
+        async with self._lock:
+            if VOTE_FSYNC != "never":
+                await self._sync()
+            self._log.close()
+
+    async def _delayed_flush(self, delay: float) -> None:
+        # Gives other votes a chance to join the batch
+        await asyncio.sleep(delay)
+        self._flush_task = None
+        await self.flush()
+
+    async def _delayed_sync(self) -> None:
+        await asyncio.sleep(
+            max(0.0, self._last_sync + VOTE_FSYNC_INTERVAL_MS / 1000 - time.monotonic())
+        )
+        self._sync_task = None
+        async with self._lock:
+            await self._sync()
+
+    async def _sync(self) -> None:
+        # Must be called while holding self._lock
+        if self._dirty:
+            start = time.perf_counter()
+            await asyncio.to_thread(self._log.sync)
+            SYNC_SECONDS.observe(time.perf_counter() - start)
+            self._dirty = False
+        self._last_sync = time.monotonic()
@@ -0,0 +1,394 @@
+# ballot_trie.py
+# BallotTrie class, a prefix tree of ballots, and TrieTally, a tally that uses one
+# Lots of ballots share the same first few preferences (everyone who puts
+# the same top two, say), and a trie stores each shared start only once
+# It can also be built up one vote at a time, which is how Poller uses it
+from array import array
+from typing import Any
+from vote_reader import (
+    vote,
+    vote_count,
+    PackedVotes,
+    add_vote,
+    fits_packed,
+    MAX_PACKED_PREFERENCE,
+)
+from tally import FIXED_POINT_SCALE
+
+
+class BallotTrie:
+    # Each node stands for every ballot that starts with the preferences
+    # on the path to it, node 0 being the root which every ballot starts from
+    # Nodes are kept in flat arrays rather than as objects, so a big trie stays
+    # small and is quick to send to another process
+    # The candidate each node adds to the path, the root's is never used
+    candidates: "array[int]"
+    parents: "array[int]"
+    # Number of votes whose ballot starts with the node's path
+    counts: "array[int]"
+    # Number of votes whose ballot is exactly the node's path
+    ends: "array[int]"
+    # The node at the end of each distinct ballot, in the order they were first added
+    # This is the order they'd be in as a PackedVotes, which float totals add up in
+    ballots: "array[int]"
+    # Votes with preferences that can't fit in the candidates array,
+    # kept for the counter to report the same as PackedVotes.out_of_range
+    out_of_range: vote_count
+    # Finds a node's child for a candidate, keyed by
+    # parent * (MAX_PACKED_PREFERENCE + 1) + candidate
+    # Only needed while adding votes, so copies leave it out and rebuild it if needed
+    _children: dict[int, int] | None
+
+    def __init__(self) -> None:
+        self.candidates = array("H", [0])
+        self.parents = array("I", [0])
+        self.counts = array("Q", [0])
+        self.ends = array("Q", [0])
+        self.ballots = array("I")
+        self.out_of_range = dict()
+        self._children = dict()
+
+    def __len__(self) -> int:
+        # Number of nodes, including the root
+        return len(self.counts)
+
+    def __repr__(self) -> str:
+        return f"BallotTrie({self.to_packed().to_vote_count()})"
+
+    def add(self, preferences: vote, amount: int = 1) -> None:
+        if not fits_packed(preferences):
+            add_vote(self.out_of_range, preferences, amount)
+            return
+        children = self._children
+        if children is None:
+            children = self._index_children()
+        stride = MAX_PACKED_PREFERENCE + 1
+        node = 0
+        self.counts[0] += amount
+        for candidate in preferences:
+            key = node * stride + candidate
+            child = children.get(key)
+            if child is None:
+                child = len(self.counts)
+                children[key] = child
+                self.candidates.append(candidate)
+                self.parents.append(node)
+                self.counts.append(0)
+                self.ends.append(0)
+            node = child
+            self.counts[node] += amount
+        if self.ends[node] == 0 and amount > 0:
+            self.ballots.append(node)
+        self.ends[node] += amount
+
+    def _index_children(self) -> dict[int, int]:
+        stride = MAX_PACKED_PREFERENCE + 1
+        self._children = {
+            self.parents[node] * stride + self.candidates[node]: node
+            for node in range(1, len(self.counts))
+        }
+        return self._children
+
+    def copy(self) -> "BallotTrie":
+        # Just the arrays, so it's cheap to make and to pickle
+        result = BallotTrie()
+        result.candidates = array("H", self.candidates)
+        result.parents = array("I", self.parents)
+        result.counts = array("Q", self.counts)
+        result.ends = array("Q", self.ends)
+        result.ballots = array("I", self.ballots)
+        result.out_of_range = {
+            preferences: list(amounts)
+            for preferences, amounts in self.out_of_range.items()
+        }
+        result._children = None
+        return result
+
+    def total_votes(self) -> int:
+        # Just the votes in the trie, not including out_of_range
+        return self.counts[0]
+
+    def is_valid(self, candidate_count: int, minimum_preferences: int) -> bool:
+        # If every vote would pass the counter's checks, without looking at each one
+        # A node's parent always comes before it, so this only needs one pass
+        if len(self.out_of_range) > 0 or self.ends[0] > 0:
+            return False
+        candidates = self.candidates
+        parents = self.parents
+        ends = self.ends
+        # Which candidates are on the path to each node, as bits
+        seen = [0] * len(self)
+        for node in range(1, len(self)):
+            candidate = candidates[node]
+            parent_seen = seen[parents[node]]
+            if candidate >= candidate_count or parent_seen >> candidate & 1:
+                return False
+            path = parent_seen | 1 << candidate
+            seen[node] = path
+            # The number of bits set is how many preferences the path has
+            if (
+                ends[node] > 0
+                and minimum_preferences > 0
+                and path.bit_count() < minimum_preferences
+            ):
+                return False
+        return True
+
+    def first_preferences(self, candidate_count: int) -> list[int]:
+        result = [0] * candidate_count
+        for node in range(1, len(self)):
+            if self.parents[node] == 0:
+                result[self.candidates[node]] += self.counts[node]
+        return result
+
+    def ballot(self, node: int) -> vote:
+        preferences: list[int] = []
+        while node != 0:
+            preferences.append(self.candidates[node])
+            node = self.parents[node]
+        return tuple(reversed(preferences))
+
+    def to_packed(self) -> PackedVotes:
+        # Every distinct ballot, in the order they were first added
+        result = PackedVotes()
+        for node in self.ballots:
+            result.append(self.ballot(node), self.ends[node], 1.0)
+        result.out_of_range = {
+            preferences: list(amounts)
+            for preferences, amounts in self.out_of_range.items()
+        }
+        return result
+
+    @classmethod
+    def from_packed(cls, votes: PackedVotes) -> "BallotTrie":
+        # Vote multipliers aren't kept, but they're always 1 before counting starts
+        assert all([weight == 1.0 for weight in votes.weights])
+        result = cls()
+        for index in range(len(votes)):
+            result.add(votes.vote(index), votes.counts[index])
+        result.out_of_range = {
+            preferences: list(amounts)
+            for preferences, amounts in votes.out_of_range.items()
+        }
+        return result
+
+    @classmethod
+    def from_vote_count(cls, counted_votes: vote_count) -> "BallotTrie":
+        result = cls()
+        for preferences, amounts in counted_votes.items():
+            assert type(amounts[0]) == int
+            result.add(preferences, amounts[0])
+        return result
+
+
+class TrieTally:
+    # Rather than keeping track of every vote, this keeps track of which nodes
+    # of a BallotTrie are with which candidate
+    # A node is with a candidate when it's for that candidate and every candidate
+    # before it on the path has been excluded or elected, and then every vote
+    # under it is with that candidate too and has the same value
+    # So excluding or electing a candidate only touches their nodes,
+    # and each node moves all of its votes at once
+    trie: BallotTrie
+    candidate_count: int
+    fixed_point: bool
+    excluded: set[int]
+    # A linked list of each node's children, -1 for none
+    first_child: "array[int]"
+    next_sibling: "array[int]"
+    # The value of each vote under each node that's with a candidate,
+    # floats or ints depending on fixed_point
+    weights: "array[Any]"
+    # Float totals are added up ballot by ballot, with each ballot numbered by
+    # where it is in trie.ballots
+    # The numbers of the ballots under each node, laid out so that the ballots
+    # under a node are ballot_order[first_ballot[node]:][: ballots_below[node]]
+    ballot_order: "array[int]"
+    first_ballot: "array[int]"
+    ballots_below: "array[int]"
+    # Number of votes for each ballot
+    ballot_counts: "array[int]"
+    # The nodes with each candidate
+    piles: list[list[int]]
+    # The value of each ballot's votes, set when a candidate's ballots get listed
+    # A ballot's value can't change while it stays with a continuing candidate
+    _values: "array[float]"
+    # Each candidate's ballot numbers in order, once their total has had to be
+    # added up ballot by ballot, along with the nodes that have joined their pile
+    # since then. None until then, and again once their pile is moved or transferred
+    _ballots: list[list[int] | None]
+    _joined: list[list[int]]
+    # Each candidate's total as of the last time their pile changed
+    _totals: list[float]
+    # Candidates whose piles have changed since their totals were last added up
+    _changed: set[int]
+    # Value of the votes that have dropped out of the count
+    _exhausted: float
+
+    def __init__(
+        self, trie: BallotTrie, candidate_count: int, fixed_point: bool = False
+    ) -> None:
+        self.trie = trie
+        self.candidate_count = candidate_count
+        self.fixed_point = fixed_point
+        self.excluded = set()
+        node_count = len(trie)
+        self.first_child = array("i", [-1]) * node_count
+        self.next_sibling = array("i", [-1]) * node_count
+        # Going backwards so each node's children end up in the order they were added
+        parents = trie.parents
+        for node in range(node_count - 1, 0, -1):
+            parent = parents[node]
+            self.next_sibling[node] = self.first_child[parent]
+            self.first_child[parent] = node
+        self._lay_out_ballots()
+        one = FIXED_POINT_SCALE if fixed_point else 1.0
+        self.weights = array("q" if fixed_point else "d", [one]) * node_count
+        self.piles = [[] for _ in range(candidate_count)]
+        child = self.first_child[0]
+        while child != -1:
+            self.piles[trie.candidates[child]].append(child)
+            child = self.next_sibling[child]
+        self._totals = [0.0] * candidate_count
+        self._changed = set(range(candidate_count))
+        self._ballots = [None] * candidate_count
+        self._joined = [[] for _ in range(candidate_count)]
+        # Empty votes don't have anyone to start with
+        self._exhausted = trie.ends[0] * one
+
+    def __repr__(self) -> str:
+        return repr(self.trie)
+
+    def _lay_out_ballots(self) -> None:
+        trie = self.trie
+        ends = trie.ends
+        parents = trie.parents
+        node_count = len(trie)
+        # A node's parent always comes before it, so going backwards
+        # adds up the ballots under each node before they're added to its parent
+        self.ballots_below = array("i", [0]) * node_count
+        for node in range(node_count - 1, -1, -1):
+            if ends[node] > 0:
+                self.ballots_below[node] += 1
+            if node != 0:
+                self.ballots_below[parents[node]] += self.ballots_below[node]
+        # Then going forwards, each node's ballot comes first,
+        # followed by the ballots under each of its children in turn
+        self.first_ballot = array("i", [0]) * node_count
+        self.ballot_order = array("i", [0]) * len(trie.ballots)
+        numbers = array("i", [-1]) * node_count
+        for number, node in enumerate(trie.ballots):
+            numbers[node] = number
+        for node in range(node_count):
+            start = self.first_ballot[node]
+            if ends[node] > 0:
+                self.ballot_order[start] = numbers[node]
+                start += 1
+            child = self.first_child[node]
+            while child != -1:
+                self.first_ballot[child] = start
+                start += self.ballots_below[child]
+                child = self.next_sibling[child]
+        self.ballot_counts = array("Q", [ends[node] for node in trie.ballots])
+        self._values = array("d", [0.0]) * len(trie.ballots)
+
+    def totals(self) -> list[float]:
+        counts = self.trie.counts
+        weights = self.weights
+        ballot_order = self.ballot_order
+        first_ballot = self.first_ballot
+        ballots_below = self.ballots_below
+        ballot_counts = self.ballot_counts
+        values = self._values
+        for candidate in self._changed:
+            if self.fixed_point:
+                self._totals[candidate] = sum(
+                    [counts[node] * weights[node] for node in self.piles[candidate]]
+                )
+                continue
+            pile = self.piles[candidate]
+            if all([weights[node] == 1.0 for node in pile]):
+                # Whole numbers of votes add up exactly in any order
+                self._totals[candidate] = float(sum([counts[node] for node in pile]))
+                continue
+            # Otherwise float totals depend on the order things get added in,
+            # so this goes ballot by ballot in the same order as PackedTally,
+            # so that totals, and so ties, come out exactly the same as the other backends
+            ballots = self._ballots[candidate]
+            if ballots is None:
+                ballots = []
+                joined = pile
+            else:
+                joined = self._joined[candidate]
+            for node in joined:
+                weight = weights[node]
+                start = first_ballot[node]
+                below = ballot_order[start : start + ballots_below[node]]
+                for number in below:
+                    values[number] = ballot_counts[number] * weight
+                ballots.extend(below)
+            # Mostly already in order, which sort is quick at
+            ballots.sort()
+            self._ballots[candidate] = ballots
+            self._joined[candidate] = []
+            total = 0.0
+            for number in ballots:
+                total += values[number]
+            self._totals[candidate] = total
+        self._changed.clear()
+        return list(self._totals)
+
+    def transfer(self, candidates: list[int], transfer_value: float) -> None:
+        # Every vote under a node has the same value,
+        # so this rounds exactly the same as doing it vote by vote
+        weights = self.weights
+        for candidate in candidates:
+            if self.fixed_point:
+                assert isinstance(transfer_value, int)
+                for node in self.piles[candidate]:
+                    weights[node] = weights[node] * transfer_value // FIXED_POINT_SCALE
+            else:
+                for node in self.piles[candidate]:
+                    weights[node] *= transfer_value
+            self._ballots[candidate] = None
+            self._joined[candidate] = []
+            self._changed.add(candidate)
+
+    def exclude(self, candidates: list[int]) -> None:
+        trie = self.trie
+        weights = self.weights
+        ends = trie.ends
+        trie_candidates = trie.candidates
+        first_child = self.first_child
+        next_sibling = self.next_sibling
+        excluded = self.excluded
+        self.excluded.update(candidates)
+        for candidate in candidates:
+            moving = self.piles[candidate]
+            self.piles[candidate] = []
+            self._ballots[candidate] = None
+            self._joined[candidate] = []
+            self._changed.add(candidate)
+            while len(moving) > 0:
+                node = moving.pop()
+                weight = weights[node]
+                # Votes that stop here have run out of preferences
+                if ends[node] > 0:
+                    self._exhausted += ends[node] * weight
+                # Everything else moves down to the next preference,
+                # skipping past any more excluded candidates
+                child = first_child[node]
+                while child != -1:
+                    weights[child] = weight
+                    next_candidate = trie_candidates[child]
+                    if next_candidate in excluded:
+                        moving.append(child)
+                    else:
+                        self.piles[next_candidate].append(child)
+                        if self._ballots[next_candidate] is not None:
+                            self._joined[next_candidate].append(child)
+                        self._changed.add(next_candidate)
+                    child = next_sibling[child]
+
+    def exhausted(self) -> float:
+        return self._exhausted
@@ -0,0 +1,207 @@
+# batch.py
+# Counts lots of polls in one go, for recounting or auditing every poll at once
+# Results get printed as newline delimited json, one line per poll as each finishes
+import argparse
+import json
+import sys
+import time
+from multiprocessing import Pool
+from pathlib import Path
+from typing import Iterator
+from poll_config import read_config
+from vote_reader import parse_packed_vote_path
+from vote_log import VoteLogError
+from counter import count_votes
+from count_trace import CountTrace
+from errors import VoteError
+from tally import TALLY_BACKENDS, COUNT_MODES
+
+# Votes files to look for in each poll folder, in order of preference
+VOTE_FILE_NAMES = ["votes.bin", "votes.csv"]
+CONFIG_FILE_NAME = "config.json"
+
+
+class BatchOptions:
+    raise_vote_error: bool
+    backend: str
+    count_mode: str | None
+    trace: bool
+    # Turned on for every poll if set, otherwise left to each poll's config
+    bulk_exclusion: bool
+    early_termination: bool
+
+    def __init__(
+        self,
+        raise_vote_error: bool,
+        backend: str,
+        count_mode: str | None,
+        trace: bool,
+        bulk_exclusion: bool = False,
+        early_termination: bool = False,
+    ) -> None:
+        self.raise_vote_error = raise_vote_error
+        self.backend = backend
+        self.count_mode = count_mode
+        self.trace = trace
+        self.bulk_exclusion = bulk_exclusion
+        self.early_termination = early_termination
+
+
+def find_polls(path: Path) -> Iterator[Path]:
+    # Yields every poll folder in a folder of polls,
+    # or every poll folder listed in a manifest file, one per line
+    if path.is_dir():
+        for child in sorted(path.iterdir()):
+            if (child / CONFIG_FILE_NAME).is_file():
+                yield child
+    else:
+        with open(path, "rt") as fp:
+            for line in fp:
+                line = line.strip()
+                if len(line) != 0 and not line.startswith("#"):
+                    # Relative paths are relative to the manifest
+                    yield path.parent / line
+
+
+def count_poll(job: tuple[Path, BatchOptions]) -> dict[str, object]:
+    # Count a single poll folder, returning the line of output for it
+    # Runs in a worker process when using a pool, so has to be top level
+    folder, options = job
+    output: dict[str, object] = {"poll": str(folder)}
+    start = time.perf_counter()
+    try:
+        vote_file = None
+        for name in VOTE_FILE_NAMES:
+            if (folder / name).is_file():
+                vote_file = folder / name
+                break
+        if vote_file is None:
+            raise FileNotFoundError(f"No votes file found in {folder}")
+
+        with open(folder / CONFIG_FILE_NAME) as fp:
+            config = read_config(fp)
+        if options.count_mode is not None:
+            config["count_mode"] = options.count_mode
+        if options.bulk_exclusion:
+            config["bulk_exclusion"] = True
+        if options.early_termination:
+            config["early_termination"] = True
+
+        votes = parse_packed_vote_path(vote_file)
+        trace = CountTrace() if options.trace else None
+        results: dict[str, object] = dict(
+            count_votes(
+                votes, config, options.raise_vote_error, False, options.backend, trace
+            )
+        )
+        # Inside results, the same as for a single poll
+        if trace is not None:
+            results["trace"] = trace.as_dict()
+        output["results"] = results
+    except (
+        VoteError,
+        VoteLogError,
+        AssertionError,
+        OSError,
+        ValueError,
+        KeyError,
+    ) as error:
+        # One broken poll shouldn't stop the rest from being counted
+        output["error"] = f"{type(error).__name__}: {error}"
+    output["seconds"] = round(time.perf_counter() - start, 6)
+    return output
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(
+        "Teller batch",
+        description="Count every poll in a folder of polls, or listed in a manifest, printing results as newline delimited json.",
+    )
+    parser.add_argument(
+        "polls",
+        type=Path,
+        help="Folder containing poll folders, or a manifest file listing one poll folder per line.",
+    )
+    parser.add_argument(
+        "--workers",
+        "-w",
+        type=int,
+        default=1,
+        help="Number of processes to count polls in. Results come out in the order polls finish.",
+    )
+    parser.add_argument(
+        "--ignore-invalid-votes",
+        "-i",
+        action="store_true",
+        help="If invalid votes should raise an error, or if they should be simply discarded.",
+    )
+    parser.add_argument(
+        "--backend",
+        "-b",
+        choices=TALLY_BACKENDS,
+        default="python",
+        help="How to tally votes each round.",
+    )
+    parser.add_argument(
+        "--count-mode",
+        "-m",
+        choices=COUNT_MODES,
+        help="Overrides the count mode in every poll's config file.",
+    )
+    parser.add_argument(
+        "--bulk-exclusion",
+        action="store_true",
+        help="Turns on bulk exclusion for every poll.",
+    )
+    parser.add_argument(
+        "--early-termination",
+        action="store_true",
+        help="Turns on early termination for every poll.",
+    )
+    parser.add_argument(
+        "--trace",
+        "-t",
+        action="store_true",
+        help="Include what happened in each round of each count.",
+    )
+    args = parser.parse_args(argv)
+
+    polls_path: Path = args.polls
+    assert polls_path.exists(), f"No folder or manifest found at {polls_path}"
+    assert args.workers >= 1, "Need at least 1 worker"
+
+    options = BatchOptions(
+        not args.ignore_invalid_votes,
+        args.backend,
+        args.count_mode,
+        args.trace,
+        args.bulk_exclusion,
+        args.early_termination,
+    )
+    jobs = ((folder, options) for folder in find_polls(polls_path))
+
+    failed = False
+    if args.workers == 1:
+        # Not worth starting any processes, just count them here
+        outputs: Iterator[dict[str, object]] = map(count_poll, jobs)
+        failed = _print_outputs(outputs)
+    else:
+        with Pool(args.workers) as pool:
+            failed = _print_outputs(pool.imap_unordered(count_poll, jobs))
+
+    if failed:
+        sys.exit(1)
+
+
+def _print_outputs(outputs: Iterator[dict[str, object]]) -> bool:
+    # Print each line as soon as it's ready, returning if any polls failed
+    failed = False
+    for output in outputs:
+        if "error" in output:
+            failed = True
+        print(json.dumps(output), flush=True)
+    return failed
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+# count_trace.py
+# CountTrace class, an optional record of what happened each round of a count
+# Used for showing how the count went, rather than just who won
+from typing import TypedDict
+
+# What can happen at the end of a round
+ROUND_ACTIONS = ["elected", "excluded", "tied"]
+
+
+class TraceData(TypedDict):
+    quota: int
+    total_votes: int
+    tallies: list[list[float]]
+    exhausted: list[float]
+    actions: list[str]
+    candidates: list[list[int]]
+    transfer_values: list[float | None]
+
+
+class CountTrace:
+    # Each list has one entry per round, rather than there being a dict per round,
+    # which keeps it compact and quick to turn into json
+    quota: int
+    total_votes: int
+    # Every candidate's votes at the start of the round
+    tallies: list[list[float]]
+    # Votes that had run out of preferences by the start of the round
+    exhausted: list[float]
+    # What happened at the end of the round, one of ROUND_ACTIONS
+    actions: list[str]
+    # The candidates that were elected, excluded or tied
+    candidates: list[list[int]]
+    # What the winners' votes were multiplied by when passed on,
+    # or None if nothing was passed on
+    transfer_values: list[float | None]
+    # What vote values given to add_round are scaled up by,
+    # they get scaled back down so traces look the same in every count mode
+    scale: int
+
+    def __init__(self) -> None:
+        self.scale = 1
+        self.quota = 0
+        self.total_votes = 0
+        self.tallies = []
+        self.exhausted = []
+        self.actions = []
+        self.candidates = []
+        self.transfer_values = []
+
+    def __len__(self) -> int:
+        return len(self.actions)
+
+    def add_round(
+        self,
+        tallies: list[float],
+        exhausted: float,
+        action: str,
+        candidates: list[int],
+        transfer_value: float | None = None,
+    ) -> None:
+        assert action in ROUND_ACTIONS
+        if self.scale != 1:
+            tallies = [tally / self.scale for tally in tallies]
+            exhausted /= self.scale
+            if transfer_value is not None:
+                transfer_value /= self.scale
+        self.tallies.append(tallies)
+        self.exhausted.append(exhausted)
+        self.actions.append(action)
+        self.candidates.append(candidates)
+        self.transfer_values.append(transfer_value)
+
+    def as_dict(self) -> TraceData:
+        return {
+            "quota": self.quota,
+            "total_votes": self.total_votes,
+            "tallies": self.tallies,
+            "exhausted": self.exhausted,
+            "actions": self.actions,
+            "candidates": self.candidates,
+            "transfer_values": self.transfer_values,
+        }
@@ -0,0 +1,361 @@
+# counter.py
+# The actual vote counting logic, kept separate from main.py
+# so that it can be imported and used as a library by Poller
+from typing import Optional
+from poll_config import ConfigData
+from vote_reader import vote_count, PackedVotes
+from ballot_trie import BallotTrie
+from tally import make_tally, COUNT_MODES, FIXED_POINT_SCALE
+from count_trace import CountTrace
+from errors import VoteError
+
+# Couldn't find an STD for this
+small_additive: float = 0.000000001
+
+
+def count_votes(
+    votes: vote_count | PackedVotes | BallotTrie,
+    config: ConfigData,
+    raise_vote_error: bool,
+    verbose: bool,
+    backend: str = "python",
+    trace: CountTrace | None = None,
+) -> dict[str, list[int]]:
+    # See ALGORITHM.md to see the logic + algo here
+    # Votes can be given as a vote_count, a PackedVotes or a BallotTrie
+    # backend picks how votes get tallied each round, see tally.py
+    # If trace is given, what happens each round gets recorded in it
+    # The config's count_mode picks between float and fixed point vote values,
+    # see tally.py
+    # bulk_exclusion and early_termination in the config turn on shortcuts
+    # that cut down on rounds, see ALGORITHM.md. Both are off if not given
+    winners: set[int] = set()
+    tied_winners: list[int] = list()
+    excluded: set[int] = set()
+
+    count_mode = config.get("count_mode", "float")
+    if count_mode not in COUNT_MODES:
+        raise ValueError(f"Unknown count mode {count_mode}")
+    fixed_point = count_mode == "fixed"
+    bulk_exclusion = config.get("bulk_exclusion", False)
+    early_termination = config.get("early_termination", False)
+
+    # A trie that's handed in can be counted as is by the trie backend,
+    # so long as every vote in it turns out to be valid
+    trie: BallotTrie | None = None
+    if isinstance(votes, dict):
+        votes = PackedVotes.from_vote_count(votes)
+    elif isinstance(votes, BallotTrie):
+        if backend == "trie":
+            trie = votes
+        else:
+            votes = votes.to_packed()
+
+    assert votes.total_votes() + len(votes.out_of_range) > 0, "No votes!"
+
+    # Count total votes
+    total_votes: int = votes.total_votes()
+    for vote_amounts in votes.out_of_range.values():
+        assert type(vote_amounts[0]) == int
+        total_votes += vote_amounts[0]
+
+    # Do integer division because while this rounds down,
+    # I then add 1 to the result anyway
+    # So the quota will always be slightly greater than the fraction
+    # Even if it divides cleanly
+    quota: int = (total_votes // (config["winner_amount"] + 1)) + 1
+    candidate_count: int = len(config["candidate_names"])
+    if trie is not None and trie.is_valid(
+        candidate_count, config["minimum_preferences"]
+    ):
+        # Every vote's fine, so there's no need to check each one,
+        # and the trie can be counted as it is
+        first_preferences = trie.first_preferences(candidate_count)
+        tally = make_tally(trie, candidate_count, backend, fixed_point)
+    else:
+        if isinstance(votes, BallotTrie):
+            votes = votes.to_packed()
+        votes, first_preferences = check_votes(votes, config, raise_vote_error)
+        tally = make_tally(votes, candidate_count, backend, fixed_point)
+    # In fixed point mode vote values are ints scaled up by FIXED_POINT_SCALE,
+    # so they can be compared exactly against a scaled up quota
+    scale = FIXED_POINT_SCALE if fixed_point else 1
+
+    if verbose:
+        print(f"{votes=}")
+        print(f"{quota=}")
+    if trace is not None:
+        trace.quota = quota
+        trace.total_votes = total_votes
+        trace.scale = scale
+
+    # Done counting first preferences, now to go through and select a winner!
+    # Keep going until we have enough winners, or a tie is found
+    while len(winners) < config["winner_amount"] and len(tied_winners) == 0:
+        current_votes = tally.totals()
+        seats_left = config["winner_amount"] - len(winners)
+
+        if early_termination and candidate_count - len(excluded) <= seats_left:
+            # Everyone left gets a seat no matter how the rest of the count goes,
+            # so just elect them all now
+            remaining = [
+                candidate
+                for candidate in range(candidate_count)
+                if candidate not in excluded
+            ]
+            winners.update(remaining)
+            if trace is not None:
+                trace.add_round(current_votes, tally.exhausted(), "elected", remaining)
+            if verbose:
+                print(f"{remaining} won for being the only candidates left!")
+            break
+
+        # Next, find the most voted for candidate
+        max_votes, max_vote_indexes = max_voted_candidates(current_votes, excluded)
+
+        # Seeing if they win
+        if fixed_point:
+            reached_quota = max_votes >= quota * scale
+        else:
+            reached_quota = max_votes + small_additive >= quota
+        if reached_quota:
+            # Ding ding ding! We have a winner!
+            # See how many winners
+            if len(max_vote_indexes) <= config["winner_amount"] - len(winners):
+                # A good number of winners!
+                winners.update(max_vote_indexes)
+                # If there are more winners needed, lets exclude the candidate
+                # And add transfer multipliers
+                transfer_value: float | None = None
+                if len(winners) < config["winner_amount"]:
+                    if fixed_point:
+                        # The transfer value is also scaled up and rounded down,
+                        # the same as how a lot of STV rules do it by hand
+                        transfer_value = int(
+                            (max_votes - quota * scale) * scale // max_votes
+                        )
+                    else:
+                        transfer_value = (max_votes - quota) / max_votes
+                    tally.transfer(max_vote_indexes, transfer_value)
+                if trace is not None:
+                    trace.add_round(
+                        current_votes,
+                        tally.exhausted(),
+                        "elected",
+                        max_vote_indexes,
+                        transfer_value,
+                    )
+
+                # Now add the winner to the excluded list for future votes
+                excluded.update(max_vote_indexes)
+                tally.exclude(max_vote_indexes)
+                if verbose:
+                    print(f"{max_vote_indexes} won with {max_votes} votes!")
+            else:
+                # Uh oh! Too many winners! This results in a tie
+                if verbose:
+                    print(f"Too many winners! Declaring a tie with {max_vote_indexes}")
+                tied_winners.extend(max_vote_indexes)
+                if trace is not None:
+                    trace.add_round(
+                        current_votes, tally.exhausted(), "tied", max_vote_indexes
+                    )
+        else:
+            # Nobody won, removing the least voted candidate
+            min_votes, min_vote_indexes = min_voted_candidates(current_votes, excluded)
+            if bulk_exclusion:
+                # Or every candidate who can't possibly catch up, if that's more
+                # The least votes anyone would need to be elected, the same
+                # as the quota check above
+                if fixed_point:
+                    quota_votes: float = quota * scale
+                else:
+                    quota_votes = quota - small_additive
+                hopeless = hopeless_candidates(
+                    current_votes, excluded, seats_left, quota_votes
+                )
+                if len(hopeless) > len(min_vote_indexes):
+                    min_vote_indexes = hopeless
+                    if verbose:
+                        print(f"{hopeless} can't catch up with anyone else")
+            if len(min_vote_indexes) + len(excluded) == candidate_count:
+                # The excluding these candidates would cause there to be no more candidates
+                # This means that we have a tie where no candidate has enough votes to meet quota
+                # Declare these candidates as tied and end
+                if verbose:
+                    print(
+                        f"Couldn't find any winners! Declaring a tie with {min_vote_indexes}"
+                    )
+                tied_winners.extend(min_vote_indexes)
+                if trace is not None:
+                    trace.add_round(
+                        current_votes, tally.exhausted(), "tied", min_vote_indexes
+                    )
+            else:
+                if trace is not None:
+                    trace.add_round(
+                        current_votes, tally.exhausted(), "excluded", min_vote_indexes
+                    )
+                excluded.update(min_vote_indexes)
+                tally.exclude(min_vote_indexes)
+                if verbose:
+                    print(
+                        f"{min_vote_indexes} have been excluded for only having {min_votes} votes"
+                    )
+
+        if verbose:
+            print(f"{tally=}")
+            print(f"{winners=}")
+            print(f"{excluded=}")
+
+    # By this point we have a list of winners
+    return {
+        "winners": list(winners),
+        "tied_winners": tied_winners,
+        "first_preferences": first_preferences,
+    }
+
+
+def check_votes(
+    votes: PackedVotes, config: ConfigData, raise_vote_error: bool
+) -> tuple[PackedVotes, list[int]]:
+    # Throws out (or raises a VoteError for) any invalid votes,
+    # giving back the valid ones along with everyone's first preferences
+    candidate_count: int = len(config["candidate_names"])
+    first_preferences: list[int] = [0] * candidate_count
+    # Counting first preferences
+
+    # Votes that can't fit in a PackedVotes have preferences way out of bounds
+    for vote_preferences in votes.out_of_range:
+        if raise_vote_error:
+            raise VoteError(f"Vote contains invalid preferences: {vote_preferences}")
+
+    # Prepare a list of valid votes to keep
+    valid_votes: list[int] = list()
+
+    # Prepare a list of first preferences,
+    # while also filtering out invalid votes
+    for vote_index in range(len(votes)):
+        vote_preferences = votes.vote(vote_index)
+        skip_vote: bool = False
+        pref_num = len(vote_preferences)
+        if pref_num == 0:
+            # Invalid vote
+            if raise_vote_error:
+                raise VoteError(f"Empty vote: {vote_preferences}")
+            skip_vote = True
+        if pref_num > candidate_count:
+            if raise_vote_error:
+                raise VoteError(
+                    f"Vote contains too many preferences: {vote_preferences}"
+                )
+            skip_vote = True
+        if (
+            pref_num < config["minimum_preferences"]
+            and config["minimum_preferences"] > 0
+        ):
+            if raise_vote_error:
+                raise VoteError(
+                    f"Vote doesn't contain enough preferences: {vote_preferences}"
+                )
+            skip_vote = True
+
+        votes_seen = set()
+        for candidate in vote_preferences:
+            if candidate >= candidate_count:
+                if raise_vote_error:
+                    raise VoteError(
+                        f"Vote contains invalid preferences: {vote_preferences}"
+                    )
+                skip_vote = True
+            if candidate in votes_seen:
+                if raise_vote_error:
+                    raise VoteError(
+                        f"Vote contains multiple of the same preference: {vote_preferences}"
+                    )
+                skip_vote = True
+            votes_seen.add(candidate)
+
+        if not skip_vote:
+            # Get the first vote in the preference list
+            first: int = vote_preferences[0]
+            # Increase the first preferences for that party by the number of votes
+            # No need to use the multiplier because we aren't at that stage of counting
+            first_preferences[first] += votes.counts[vote_index]
+            valid_votes.append(vote_index)
+
+    # Filtering out votes marked invalid
+    # This also gives a fresh copy of the vote multipliers,
+    # as they get modified while counting and the caller may want to keep using votes
+    return votes.select(valid_votes), first_preferences
+
+
+def max_voted_candidates(
+    vote_list: list[float], excluded: set[int]
+) -> tuple[float, list[int]]:
+    max_votes: Optional[float] = None
+    max_vote_indexes: list[int] = []
+    for index, vote_count in enumerate(vote_list):
+        if index not in excluded:
+            if max_votes is None or vote_count > max_votes:
+                max_votes = vote_count
+                max_vote_indexes = [index]
+            elif vote_count == max_votes:
+                max_vote_indexes.append(index)
+
+    # Keeping type checker happy
+    assert max_votes is not None
+    return max_votes, max_vote_indexes
+
+
+def hopeless_candidates(
+    vote_list: list[float], excluded: set[int], seats_left: int, quota_votes: float
+) -> list[int]:
+    # The biggest group of the lowest candidates whose votes put together
+    # are still fewer than the next lowest candidate's
+    # Votes never gain value as they move, so even if every vote in the group
+    # went to one of them they'd still be behind, and excluding one at a time
+    # would get rid of all of them before anyone else
+    # The group also has to be small enough that nobody else could reach
+    # quota_votes even if they got every vote in it. Otherwise someone could be
+    # elected partway through excluding them one at a time, which passes their
+    # surplus on at a different point and can change who else wins
+    # At least seats_left candidates are always left over
+    continuing = sorted(
+        [
+            (votes, index)
+            for index, votes in enumerate(vote_list)
+            if index not in excluded
+        ]
+    )
+    if len(continuing) == 0:
+        return []
+    highest = continuing[-1][0]
+    group_size = 0
+    group_votes: float = 0
+    for position in range(len(continuing) - seats_left):
+        group_votes += continuing[position][0]
+        if highest + group_votes >= quota_votes:
+            # Only gets worse as the group gets bigger
+            break
+        if group_votes < continuing[position + 1][0]:
+            group_size = position + 1
+    return sorted([index for _, index in continuing[:group_size]])
+
+
+def min_voted_candidates(
+    vote_list: list[float], excluded: set[int]
+) -> tuple[float, list[int]]:
+    min_votes: Optional[float] = None
+    min_vote_indexes: list[int] = []
+    for index, vote_count in enumerate(vote_list):
+        if index not in excluded:
+            if min_votes is None or vote_count < min_votes:
+                min_votes = vote_count
+                min_vote_indexes = [index]
+            elif vote_count == min_votes:
+                min_vote_indexes.append(index)
+
+    # Keeping type checker happy
+    assert min_votes is not None
+    return min_votes, min_vote_indexes
@@ -0,0 +1,125 @@
+# numpy_tally.py
+# NumpyTally class, a tally which uses numpy to avoid looping over votes in python
+# numpy is optional, and this is only imported if the numpy backend is chosen
+import numpy as np
+import numpy.typing as npt
+from typing import Any
+from vote_reader import PackedVotes
+from tally import FIXED_POINT_SCALE
+
+# Floats hold every whole number up to this exactly
+MAX_EXACT_FLOAT = 2**53
+
+
+class NumpyTally:
+    # Every vote has a pointer to the position in preferences of the candidate
+    # it currently counts towards
+    # When a candidate is excluded only the votes pointing at them get moved along,
+    # instead of finding every vote's first continuing preference from scratch
+    candidate_count: int
+    fixed_point: bool
+    preferences: npt.NDArray[np.int64]
+    # Where each vote's preferences end
+    ends: npt.NDArray[np.int64]
+    # float64 normally, or int64 in fixed point mode
+    counts: npt.NDArray[Any]
+    weights: npt.NDArray[Any]
+    pointers: npt.NDArray[np.int64]
+    # The candidate each vote currently counts towards,
+    # or candidate_count once a vote has run out of preferences
+    current: npt.NDArray[np.int64]
+    # Indexed by candidate, with an extra entry for exhausted votes
+    is_excluded: npt.NDArray[np.bool_]
+    # In fixed point mode, if every total is small enough for bincount to add up
+    # exactly as floats. No vote is ever worth more than FIXED_POINT_SCALE,
+    # so this holds for polls with fewer than about 9 million votes
+    _exact_floats: bool
+
+    def __init__(
+        self, votes: PackedVotes, candidate_count: int, fixed_point: bool = False
+    ) -> None:
+        self.candidate_count = candidate_count
+        self.fixed_point = fixed_point
+        offsets = np.frombuffer(votes.offsets, dtype=np.uint32).astype(np.int64)
+        # An extra preference on the end for votes to point to once exhausted
+        self.preferences = np.append(
+            np.frombuffer(votes.preferences, dtype=np.uint16).astype(np.int64),
+            candidate_count,
+        )
+        self.ends = offsets[1:]
+        counts = np.frombuffer(votes.counts, dtype=np.uint64)
+        if fixed_point:
+            self.counts = counts.astype(np.int64)
+            self.weights = np.round(
+                np.array(votes.weights, dtype=np.float64) * FIXED_POINT_SCALE
+            ).astype(np.int64)
+        else:
+            self.counts = counts.astype(np.float64)
+            self.weights = np.array(votes.weights, dtype=np.float64)
+        self.pointers = offsets[:-1].copy()
+        # Empty votes are already exhausted
+        self.pointers[self.pointers == self.ends] = len(self.preferences) - 1
+        self.current = self.preferences[self.pointers]
+        self.is_excluded = np.zeros(candidate_count + 1, dtype=np.bool_)
+        self._exact_floats = int(counts.sum()) * FIXED_POINT_SCALE < MAX_EXACT_FLOAT
+
+    def __repr__(self) -> str:
+        return f"NumpyTally(current={self.current}, weights={self.weights})"
+
+    def totals(self) -> list[float]:
+        if self.fixed_point:
+            fixed_totals: npt.NDArray[np.int64]
+            if self._exact_floats:
+                fixed_totals = np.bincount(
+                    self.current,
+                    weights=self.counts * self.weights,
+                    minlength=self.candidate_count + 1,
+                ).astype(np.int64)
+            else:
+                # bincount only adds up floats, which could lose votes in big polls
+                # add.at is exact, but slower on older versions of numpy
+                fixed_totals = np.zeros(self.candidate_count + 1, dtype=np.int64)
+                np.add.at(fixed_totals, self.current, self.counts * self.weights)
+            fixed_result: list[float] = fixed_totals[: self.candidate_count].tolist()
+            return fixed_result
+        # bincount adds up the weights in vote order,
+        # so this gives exactly the same floats as PackedTally
+        totals = np.bincount(
+            self.current,
+            weights=self.counts * self.weights,
+            minlength=self.candidate_count + 1,
+        )
+        result: list[float] = totals[: self.candidate_count].tolist()
+        return result
+
+    def transfer(self, candidates: list[int], transfer_value: float) -> None:
+        moving = np.isin(self.current, candidates)
+        if self.fixed_point:
+            # Weights are at most FIXED_POINT_SCALE, and so is the transfer value,
+            # so this can't overflow
+            self.weights[moving] = (
+                self.weights[moving] * int(transfer_value) // FIXED_POINT_SCALE
+            )
+        else:
+            self.weights[moving] *= transfer_value
+
+    def exclude(self, candidates: list[int]) -> None:
+        self.is_excluded[candidates] = True
+        # Only the votes sitting with the newly excluded candidates need to move
+        moving = np.flatnonzero(np.isin(self.current, candidates))
+        exhausted_position = len(self.preferences) - 1
+        while len(moving) > 0:
+            self.pointers[moving] += 1
+            # Votes which have run past their last preference are exhausted
+            ran_out = self.pointers[moving] >= self.ends[moving]
+            self.pointers[moving[ran_out]] = exhausted_position
+            self.current[moving] = self.preferences[self.pointers[moving]]
+            # Keep going for any votes that landed on another excluded candidate
+            # (Exhausted votes point to candidate_count, which is never excluded)
+            moving = moving[self.is_excluded[self.current[moving]]]
+
+    def exhausted(self) -> float:
+        # Exhausted votes all point at candidate_count
+        is_exhausted = self.current == self.candidate_count
+        exhausted = np.sum(self.counts[is_exhausted] * self.weights[is_exhausted])
+        return int(exhausted) if self.fixed_point else float(exhausted)
@@ -1,4 +1,4 @@
-from typing import TypedDict, TextIO
+from typing import NotRequired, TypedDict, TextIO
 import json
 
 
@@ -13,6 +13,11 @@ class ConfigData(TypedDict):
     candidate_names: list[str]
     candidate_descriptions: list[str]
     randomise_order: bool
+    # "float" or "fixed", see tally.py. Counts use floats if not given
+    count_mode: NotRequired[str]
+    # Shortcuts that cut down on rounds, see ALGORITHM.md. Off if not given
+    bulk_exclusion: NotRequired[bool]
+    early_termination: NotRequired[bool]
 
 
 def read_config(fp: TextIO) -> ConfigData:
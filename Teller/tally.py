@@ -0,0 +1,179 @@
+# tally.py
+# Tallies keep track of which candidate each vote currently counts towards,
+# and let count_votes ask for each candidate's current total
+# count_votes decides who wins or gets excluded, and tells the tally about it
+from array import array
+from typing import Any, Protocol, TYPE_CHECKING
+from vote_reader import PackedVotes
+
+if TYPE_CHECKING:
+    from ballot_trie import BallotTrie
+
+# The different ways of keeping a tally that count_votes can use
+TALLY_BACKENDS = ["python", "numpy", "trie"]
+# How vote values are stored, "float" uses floats,
+# and "fixed" uses ints where FIXED_POINT_SCALE is one whole vote
+COUNT_MODES = ["float", "fixed"]
+FIXED_POINT_SCALE = 10**9
+
+
+class Tally(Protocol):
+    def totals(self) -> list[float]:
+        # Current votes for each candidate
+        # Excluded candidates should have 0
+        # In fixed point mode these are ints, scaled by FIXED_POINT_SCALE
+        ...
+
+    def transfer(self, candidates: list[int], transfer_value: float) -> None:
+        # Multiply the value of every vote currently counting towards
+        # one of the candidates by the transfer value
+        # In fixed point mode the transfer value is an int scaled by FIXED_POINT_SCALE,
+        # and the new values get rounded down
+        ...
+
+    def exclude(self, candidates: list[int]) -> None:
+        # Remove the candidates from the count,
+        # so their votes move on to the next preference
+        ...
+
+    def exhausted(self) -> float:
+        # Value of the votes that have run out of preferences
+        # Only used for count traces, so doesn't need to be quick
+        ...
+
+
+class PackedTally:
+    # The plain python tally
+    # Votes are kept in piles, one for each candidate, of the votes currently with them
+    # The piles are made once from first preferences, and after that
+    # only the pile of a candidate who was just excluded or elected gets touched
+    votes: PackedVotes
+    candidate_count: int
+    fixed_point: bool
+    excluded: set[int]
+    # The value of each vote, floats or ints depending on fixed_point
+    weights: "array[Any]"
+    # Position in votes.preferences of the candidate each vote is currently with
+    positions: "array[int]"
+    # Indexes of the votes with each candidate
+    piles: list[list[int]]
+    # Each candidate's total as of the last time their pile changed
+    _totals: list[float]
+    # Candidates whose piles have changed since their totals were last added up
+    _changed: set[int]
+    # Value of the votes that have dropped out of the count
+    _exhausted: float
+
+    def __init__(
+        self, votes: PackedVotes, candidate_count: int, fixed_point: bool = False
+    ) -> None:
+        self.votes = votes
+        self.candidate_count = candidate_count
+        self.fixed_point = fixed_point
+        if fixed_point:
+            self.weights = array(
+                "q", [round(weight * FIXED_POINT_SCALE) for weight in votes.weights]
+            )
+        else:
+            self.weights = votes.weights
+        self.excluded = set()
+        self.positions = array("I", votes.offsets[:-1])
+        self.piles = [[] for _ in range(candidate_count)]
+        for vote_index in range(len(votes)):
+            if votes.offsets[vote_index] != votes.offsets[vote_index + 1]:
+                first = votes.preferences[votes.offsets[vote_index]]
+                self.piles[first].append(vote_index)
+        self._totals = [0.0] * candidate_count
+        self._changed = set(range(candidate_count))
+        self._exhausted = 0 if fixed_point else 0.0
+
+    def __repr__(self) -> str:
+        return repr(self.votes)
+
+    def totals(self) -> list[float]:
+        counts = self.votes.counts
+        weights = self.weights
+        zero = 0 if self.fixed_point else 0.0
+        for candidate in self._changed:
+            pile = self.piles[candidate]
+            # Adding votes up in the same order every time,
+            # so that ties come out exactly the same no matter how votes got here
+            pile.sort()
+            total = zero
+            for vote_index in pile:
+                total += counts[vote_index] * weights[vote_index]
+            self._totals[candidate] = total
+        self._changed.clear()
+        return list(self._totals)
+
+    def transfer(self, candidates: list[int], transfer_value: float) -> None:
+        # Multiplying the vote multiplier by the transfer value,
+        # for only the votes currently sitting with the candidates
+        weights = self.weights
+        for candidate in candidates:
+            if self.fixed_point:
+                assert isinstance(transfer_value, int)
+                for vote_index in self.piles[candidate]:
+                    weights[vote_index] = (
+                        weights[vote_index] * transfer_value // FIXED_POINT_SCALE
+                    )
+            else:
+                for vote_index in self.piles[candidate]:
+                    weights[vote_index] *= transfer_value
+            self._changed.add(candidate)
+
+    def exclude(self, candidates: list[int]) -> None:
+        votes = self.votes
+        self.excluded.update(candidates)
+        for candidate in candidates:
+            pile = self.piles[candidate]
+            self.piles[candidate] = []
+            self._changed.add(candidate)
+            for vote_index in pile:
+                # Find next un-eliminated preference
+                end = votes.offsets[vote_index + 1]
+                position = self.positions[vote_index] + 1
+                while position < end and votes.preferences[position] in self.excluded:
+                    position += 1
+                self.positions[vote_index] = position
+                if position < end:
+                    # Found one!
+                    next_candidate = votes.preferences[position]
+                    self.piles[next_candidate].append(vote_index)
+                    self._changed.add(next_candidate)
+                else:
+                    # The vote is exhausted, and drops out of the count
+                    self._exhausted += (
+                        votes.counts[vote_index] * self.weights[vote_index]
+                    )
+
+    def exhausted(self) -> float:
+        return self._exhausted
+
+
+def make_tally(
+    votes: "PackedVotes | BallotTrie",
+    candidate_count: int,
+    backend: str,
+    fixed_point: bool = False,
+) -> Tally:
+    # The trie backend can be given a BallotTrie that's already been built,
+    # the others need the votes as a PackedVotes
+    if backend == "trie":
+        # Imported here as ballot_trie imports this module
+        from ballot_trie import BallotTrie, TrieTally
+
+        if isinstance(votes, PackedVotes):
+            votes = BallotTrie.from_packed(votes)
+        return TrieTally(votes, candidate_count, fixed_point)
+    if not isinstance(votes, PackedVotes):
+        votes = votes.to_packed()
+    if backend == "python":
+        return PackedTally(votes, candidate_count, fixed_point)
+    elif backend == "numpy":
+        # Only importing this when asked for, as numpy is optional
+        from numpy_tally import NumpyTally
+
+        return NumpyTally(votes, candidate_count, fixed_point)
+    else:
+        raise ValueError(f"Unknown tally backend {backend}")
@@ -0,0 +1,7 @@
+# conftest.py
+# Teller's modules import each other by name, like main.py does,
+# so the Teller folder needs to be importable when running pytest from anywhere
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).absolute().parent.parent))
@@ -0,0 +1,60 @@
+# elections.py
+# Made up polls for tests that need more than the sample files
+import random
+
+from poll_config import ConfigData
+from tally import TALLY_BACKENDS
+from vote_reader import add_vote, vote_count
+
+
+def backends() -> list[str]:
+    # numpy is optional, so its backend is only tested when it's installed
+    result = []
+    for backend in TALLY_BACKENDS:
+        if backend == "numpy":
+            try:
+                import numpy  # noqa: F401
+            except ImportError:
+                continue
+        result.append(backend)
+    return result
+
+
+def make_config(candidates: int, winners: int) -> ConfigData:
+    return {
+        "election_name": "Made up poll",
+        "minimum_preferences": 1,
+        "winner_amount": winners,
+        "candidate_names": [str(candidate) for candidate in range(candidates)],
+        "candidate_descriptions": ["" for _ in range(candidates)],
+        "randomise_order": False,
+    }
+
+
+def random_election(seed: int) -> tuple[vote_count, ConfigData]:
+    # A few popular candidates and some short ballots,
+    # so counts go through transfers, exclusions and exhausted votes
+    rng = random.Random(seed)
+    candidates = 8
+    weights = [1 / (candidate + 1) for candidate in range(candidates)]
+    votes: vote_count = dict()
+    for _ in range(300):
+        preferences: list[int] = []
+        while len(preferences) < rng.randint(1, candidates):
+            candidate = rng.choices(range(candidates), weights)[0]
+            if candidate not in preferences:
+                preferences.append(candidate)
+        add_vote(votes, tuple(preferences))
+    return votes, make_config(candidates, 3)
+
+
+def small_election(seed: int) -> tuple[vote_count, ConfigData]:
+    # Only a few dozen votes spread over random ballots, so candidates
+    # often end up on exactly the same totals and ties have to be broken
+    rng = random.Random(seed)
+    candidates = rng.randint(4, 8)
+    votes: vote_count = dict()
+    for _ in range(rng.randint(5, 40)):
+        length = rng.randint(1, candidates)
+        add_vote(votes, tuple(rng.sample(range(candidates), length)), rng.randint(1, 3))
+    return votes, make_config(candidates, rng.randint(1, 3))
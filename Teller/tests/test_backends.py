@@ -0,0 +1,70 @@
+# test_backends.py
+# Every tally backend should give the same results, see tally.py
+from pathlib import Path
+
+import pytest
+
+from ballot_trie import BallotTrie
+from count_trace import CountTrace
+from counter import count_votes
+from elections import backends, random_election, small_election
+from poll_config import read_config
+from vote_reader import PackedVotes, parse_packed_vote_path
+
+TELLER_FOLDER = Path(__file__).absolute().parent.parent
+
+
+@pytest.mark.parametrize("votes_name", ["test_2.csv", "test_3.csv", "test_4.csv"])
+@pytest.mark.parametrize("config_name", ["test_1.json", "test_2.json"])
+def test_sample_files_agree(votes_name: str, config_name: str) -> None:
+    votes = parse_packed_vote_path(TELLER_FOLDER / votes_name)
+    with open(TELLER_FOLDER / config_name) as fp:
+        config = read_config(fp)
+    expected = count_votes(votes, config, True, False)
+    for backend in backends():
+        assert count_votes(votes, config, True, False, backend) == expected, backend
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_random_elections_agree(seed: int) -> None:
+    votes, config = random_election(seed)
+    packed = PackedVotes.from_vote_count(votes)
+    expected_trace = CountTrace()
+    expected = count_votes(packed, config, True, False, "python", expected_trace)
+    for backend in backends():
+        trace = CountTrace()
+        assert count_votes(packed, config, True, False, backend, trace) == expected
+        # Each round should go the same way too
+        assert trace.actions == expected_trace.actions, backend
+        assert trace.candidates == expected_trace.candidates, backend
+
+
+def test_ties_break_the_same() -> None:
+    # Ties are broken by comparing float totals exactly,
+    # so every backend has to add them up to exactly the same floats
+    for seed in range(500):
+        votes, config = small_election(seed)
+        packed = PackedVotes.from_vote_count(votes)
+        expected = CountTrace()
+        try:
+            results = count_votes(packed, config, True, False, "python", expected)
+        except AssertionError:
+            # Some of these run out of continuing candidates before filling every
+            # seat, which the counter doesn't handle
+            continue
+        counted: list[tuple[str, PackedVotes | BallotTrie]] = [
+            (backend, packed) for backend in backends()
+        ]
+        counted.append(("trie", BallotTrie.from_vote_count(votes)))
+        for backend, backend_votes in counted:
+            trace = CountTrace()
+            assert (
+                count_votes(backend_votes, config, True, False, backend, trace)
+                == results
+            ), (seed, backend)
+            # Exhausted votes are only kept for the trace, and aren't added up
+            # in the same order, so they're left out
+            assert trace.actions == expected.actions, (seed, backend)
+            assert trace.candidates == expected.candidates, (seed, backend)
+            assert trace.tallies == expected.tallies, (seed, backend)
+            assert trace.transfer_values == expected.transfer_values, (seed, backend)
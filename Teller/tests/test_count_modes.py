@@ -0,0 +1,55 @@
+# test_count_modes.py
+# Fixed point counting should elect the same candidates as floats,
+# and be exactly the same round by round on every backend
+from pathlib import Path
+
+import pytest
+
+from count_trace import CountTrace
+from counter import count_votes
+from elections import backends, random_election
+from poll_config import read_config
+from vote_reader import PackedVotes, parse_packed_vote_path
+
+TELLER_FOLDER = Path(__file__).absolute().parent.parent
+
+
+@pytest.mark.parametrize("votes_name", ["test_2.csv", "test_3.csv", "test_4.csv"])
+@pytest.mark.parametrize("config_name", ["test_1.json", "test_2.json"])
+def test_fixed_matches_float_on_samples(votes_name: str, config_name: str) -> None:
+    votes = parse_packed_vote_path(TELLER_FOLDER / votes_name)
+    with open(TELLER_FOLDER / config_name) as fp:
+        config = read_config(fp)
+    expected = count_votes(votes, config, True, False)
+    config["count_mode"] = "fixed"
+    for backend in backends():
+        assert count_votes(votes, config, True, False, backend) == expected, backend
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_fixed_matches_float(seed: int) -> None:
+    votes, config = random_election(seed)
+    expected = count_votes(votes, config, True, False)
+    config["count_mode"] = "fixed"
+    assert count_votes(votes, config, True, False) == expected
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_fixed_is_exact_on_every_backend(seed: int) -> None:
+    votes, config = random_election(seed)
+    config["count_mode"] = "fixed"
+    packed = PackedVotes.from_vote_count(votes)
+    expected = CountTrace()
+    count_votes(packed, config, True, False, "python", expected)
+    for backend in backends():
+        trace = CountTrace()
+        count_votes(packed, config, True, False, backend, trace)
+        # Fixed point values are whole numbers, so totals should be exactly equal
+        assert trace.as_dict() == expected.as_dict(), backend
+
+
+def test_unknown_mode() -> None:
+    votes, config = random_election(0)
+    config["count_mode"] = "rational"
+    with pytest.raises(ValueError):
+        count_votes(votes, config, True, False)
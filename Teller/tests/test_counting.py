@@ -0,0 +1,62 @@
+# test_counting.py
+# Counting the sample polls should give the same results the original
+# command line Teller did, however the votes are handed in
+# Run from anywhere with: python -m pytest Teller
+import copy
+from pathlib import Path
+
+import pytest
+
+from counter import count_votes
+from errors import VoteError
+from poll_config import ConfigData, read_config
+from vote_reader import PackedVotes, parse_packed_vote_path, parse_vote_path, vote_count
+
+TELLER_FOLDER = Path(__file__).absolute().parent.parent
+# Both configs have the same candidates, so any votes file works with either
+# test_1.csv has invalid votes in it, which get skipped
+EXPECTED = {
+    ("test_1.csv", "test_1.json"): ([0], []),
+    ("test_1.csv", "test_2.json"): ([0], [2]),
+    ("test_2.csv", "test_1.json"): ([0], []),
+    ("test_2.csv", "test_2.json"): ([0, 4], []),
+    ("test_3.csv", "test_1.json"): ([1], []),
+    ("test_3.csv", "test_2.json"): ([0, 1], []),
+    ("test_4.csv", "test_1.json"): ([0], []),
+    ("test_4.csv", "test_2.json"): ([0], [3, 4]),
+}
+
+
+def sample_config(name: str) -> ConfigData:
+    with open(TELLER_FOLDER / name) as fp:
+        return read_config(fp)
+
+
+@pytest.mark.parametrize("votes_name, config_name", EXPECTED.keys())
+def test_sample_results(votes_name: str, config_name: str) -> None:
+    winners, tied_winners = EXPECTED[(votes_name, config_name)]
+    config = sample_config(config_name)
+    # As a vote_count, and packed like the command line reads them
+    all_votes: list[vote_count | PackedVotes] = [
+        parse_vote_path(TELLER_FOLDER / votes_name),
+        parse_packed_vote_path(TELLER_FOLDER / votes_name),
+    ]
+    for votes in all_votes:
+        results = count_votes(votes, config, False, False)
+        assert sorted(results["winners"]) == winners
+        assert sorted(results["tied_winners"]) == tied_winners
+
+
+def test_votes_left_alone() -> None:
+    # Poller keeps counting the same votes as more come in,
+    # so counting mustn't change them
+    votes = parse_vote_path(TELLER_FOLDER / "test_2.csv")
+    before = copy.deepcopy(votes)
+    count_votes(votes, sample_config("test_2.json"), True, False)
+    assert votes == before
+
+
+def test_invalid_votes_raise() -> None:
+    votes = parse_packed_vote_path(TELLER_FOLDER / "test_1.csv")
+    with pytest.raises(VoteError):
+        count_votes(votes, sample_config("test_1.json"), True, False)
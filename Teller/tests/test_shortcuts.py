@@ -0,0 +1,74 @@
+# test_shortcuts.py
+# The optional shortcuts from ALGORITHM.md
+import pytest
+
+from count_trace import CountTrace
+from counter import count_votes
+from elections import make_config, random_election, small_election
+from vote_reader import add_vote, vote_count
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_off_by_default(seed: int) -> None:
+    votes, config = random_election(seed)
+    expected = CountTrace()
+    results = count_votes(votes, config, True, False, trace=expected)
+    config["bulk_exclusion"] = False
+    config["early_termination"] = False
+    trace = CountTrace()
+    assert count_votes(votes, config, True, False, trace=trace) == results
+    assert trace.as_dict() == expected.as_dict()
+
+
+def test_bulk_exclusion_same_winners() -> None:
+    bulk_rounds = 0
+    for seed in range(500):
+        votes, config = small_election(seed)
+        try:
+            expected = count_votes(votes, config, True, False)
+        except AssertionError:
+            # Runs out of continuing candidates, see test_backends.py
+            continue
+        config["bulk_exclusion"] = True
+        trace = CountTrace()
+        assert count_votes(votes, config, True, False, trace=trace) == expected, seed
+        for action, candidates in zip(trace.actions, trace.candidates):
+            if action == "excluded" and len(candidates) > 1:
+                bulk_rounds += 1
+    # Making sure these actually exclude some groups
+    assert bulk_rounds > 100
+
+
+def test_bulk_exclusion_stops_short_of_quota() -> None:
+    # The quota is 14. 2 and 4 have 7 votes between them, fewer than anyone else,
+    # but 3 has 11, so 3 could be elected partway through excluding them one
+    # at a time. That changes when 3's surplus gets passed on, and so who
+    # else wins, so they have to be excluded one at a time
+    ballots = {
+        (1, 2, 4, 0): 1,
+        (1, 4, 2, 3): 2,
+        (2, 3, 0, 1, 4): 2,
+        (2, 4, 0): 2,
+        (0, 4): 2,
+        (3, 4, 1, 2): 1,
+        (0, 3, 1, 4, 2): 3,
+        (3, 2, 0): 3,
+        (1, 0, 4): 3,
+        (3, 2, 1): 3,
+        (3, 4): 2,
+        (3,): 2,
+        (0, 3, 4, 2): 2,
+        (1, 0): 3,
+        (1, 3, 4, 2, 0): 1,
+        (4, 3, 1): 3,
+        (0,): 1,
+    }
+    votes: vote_count = dict()
+    for ballot, amount in ballots.items():
+        add_vote(votes, ballot, amount)
+    config = make_config(5, 2)
+    config["bulk_exclusion"] = True
+    trace = CountTrace()
+    assert count_votes(votes, config, True, False, trace=trace)["winners"] == [0, 3]
+    assert trace.actions[:2] == ["excluded", "elected"]
+    assert trace.candidates[:2] == [[4], [3]]
@@ -0,0 +1,58 @@
+# test_vote_log.py
+# Votes should come back out of a vote log exactly as they went in
+from pathlib import Path
+
+import pytest
+
+from vote_log import (
+    HEADER,
+    csv_to_log,
+    decode_header,
+    decode_votes,
+    encode_header,
+    encode_votes,
+    iter_log_csv,
+    read_vote_log,
+    width_for,
+)
+from vote_reader import parse_vote_path
+
+TELLER_FOLDER = Path(__file__).absolute().parent.parent
+SAMPLE_VOTES = ["test_1.csv", "test_2.csv", "test_3.csv", "test_4.csv"]
+
+
+@pytest.mark.parametrize("candidate_count", [6, 255, 256, 1000])
+def test_records_round_trip(candidate_count: int) -> None:
+    width = width_for(candidate_count)
+    votes = [
+        [0],
+        [candidate_count - 1],
+        list(range(min(candidate_count, 255))),
+        [candidate_count - 1, 0, 1],
+    ]
+    assert decode_votes(encode_votes(votes, width), width) == votes
+    assert decode_header(encode_header(candidate_count)) == (width, candidate_count)
+
+
+@pytest.mark.parametrize("votes_name", SAMPLE_VOTES)
+def test_csv_round_trip(votes_name: str, tmp_path: Path) -> None:
+    csv_path = TELLER_FOLDER / votes_name
+    log_path = tmp_path / "votes.bin"
+    csv_to_log(csv_path, log_path, 6)
+
+    # Same votes in the same order, just without any blank lines
+    with open(csv_path) as fp:
+        lines = [line.strip() + "\n" for line in fp if line.strip() != ""]
+    assert "".join(iter_log_csv(log_path)) == "".join(lines)
+    # And the same tally, whichever way it's read
+    assert parse_vote_path(log_path) == parse_vote_path(csv_path)
+
+
+def test_partial_read(tmp_path: Path) -> None:
+    # Only reading up to a size leaves out anything written after
+    log_path = tmp_path / "votes.bin"
+    first = encode_votes([[0, 1], [1, 0]], 1)
+    with open(log_path, "wb") as fp:
+        fp.write(encode_header(2) + first + encode_votes([[0, 1]], 1))
+    tally = dict(read_vote_log(log_path, HEADER.size + len(first)))
+    assert tally == {(0, 1): 1, (1, 0): 1}
@@ -0,0 +1,96 @@
+# vote_db.py
+# Reading polls out of the SQLite database Poller can keep polls in,
+# rather than a folder for each poll
+#
+# Each poll is a row in polls, holding its config as json,
+# and each vote is a row in ballots, holding a single vote log record (see vote_log.py)
+# Ballots are only ever added, so a ballot's id also says when it was added
+import json
+import sqlite3
+from pathlib import Path
+from typing import Iterator
+from poll_config import ConfigData
+from vote_log import decode_votes, width_for
+
+# Every SQLite database starts with this
+MAGIC = b"SQLite format 3\x00"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS polls (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    config BLOB NOT NULL,
+    results BLOB,
+    log_bytes INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS ballots (
+    id INTEGER PRIMARY KEY,
+    poll_id INTEGER NOT NULL REFERENCES polls (id),
+    ballot BLOB NOT NULL
+);
+-- For counting how many of each ballot a poll has
+CREATE INDEX IF NOT EXISTS ballots_by_poll ON ballots (poll_id, ballot);
+-- For finding a poll's newest ballots
+CREATE INDEX IF NOT EXISTS ballots_by_poll_order ON ballots (poll_id, id);
+"""
+
+
+def connect(path: Path) -> sqlite3.Connection:
+    # Opens a poll database, making it if needed
+    # WAL mode lets reading carry on while something else is writing
+    # Transactions are left to the caller, with BEGIN and COMMIT
+    connection = sqlite3.connect(
+        path, timeout=30.0, isolation_level=None, check_same_thread=False
+    )
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def is_vote_db(path: Path) -> bool:
+    with open(path, "rb") as fp:
+        return fp.read(len(MAGIC)) == MAGIC
+
+
+def query_votes(
+    connection: sqlite3.Connection,
+    poll_id: int,
+    width: int,
+    up_to: int | None = None,
+) -> Iterator[tuple[tuple[int, ...], int]]:
+    # Yields each distinct vote in a poll along with how many times it appeared,
+    # like read_vote_log. The counting happens in SQLite, using ballots_by_poll
+    # If up_to is given then only ballots with an id up to it are included
+    cursor = connection.execute(
+        "SELECT ballot, COUNT(*) FROM ballots"
+        " WHERE poll_id = ? AND id <= ? GROUP BY ballot",
+        (poll_id, up_to if up_to is not None else 2**63 - 1),
+    )
+    for ballot, amount in cursor:
+        yield tuple(decode_votes(ballot, width)[0]), amount
+
+
+def read_db_config(path: Path, poll_id: int) -> ConfigData:
+    connection = sqlite3.connect(path)
+    try:
+        row = connection.execute(
+            "SELECT config FROM polls WHERE id = ?", (poll_id,)
+        ).fetchone()
+    finally:
+        connection.close()
+    if row is None:
+        raise KeyError(f"No poll with ID {poll_id} in {path}")
+    config: ConfigData = json.loads(row[0])
+    return config
+
+
+def read_db_votes(path: Path, poll_id: int) -> Iterator[tuple[tuple[int, ...], int]]:
+    # Same as query_votes, but opening the database and finding the width itself
+    config = read_db_config(path, poll_id)
+    width = width_for(len(config["candidate_names"]))
+    connection = sqlite3.connect(path)
+    try:
+        yield from query_votes(connection, poll_id, width)
+    finally:
+        connection.close()
@@ -0,0 +1,233 @@
+# vote_log.py
+# A compact binary alternative to votes.csv
+#
+# The file starts with a header:
+#   4 bytes: the magic bytes b"PPVL"
+#   1 byte: the format version, currently 1
+#   1 byte: how many bytes each number in a record takes up, 1 or 2
+#   4 bytes: the number of candidates in the poll
+# After the header, each vote is a record made of the number of preferences,
+# then each preference, all as little endian unsigned ints of the header's width
+#
+# Polls with 255 or fewer candidates use 1 byte numbers, so a full vote
+# for 6 candidates takes 7 bytes rather than the 12 it takes in a csv
+import argparse
+import mmap
+import struct
+from pathlib import Path
+from typing import Iterable, Iterator
+
+MAGIC = b"PPVL"
+VERSION = 1
+HEADER = struct.Struct("<4sBBI")
+# Largest number that fits in each width
+WIDTH_LIMITS = {1: 255, 2: 65535}
+
+
+class VoteLogError(Exception):
+    pass
+
+
+def width_for(candidate_count: int) -> int:
+    # Number of bytes needed to store each preference (and the length)
+    if candidate_count <= WIDTH_LIMITS[1]:
+        return 1
+    elif candidate_count <= WIDTH_LIMITS[2]:
+        return 2
+    else:
+        raise VoteLogError(f"Too many candidates for a vote log: {candidate_count}")
+
+
+def encode_header(candidate_count: int) -> bytes:
+    return HEADER.pack(MAGIC, VERSION, width_for(candidate_count), candidate_count)
+
+
+def decode_header(data: bytes | mmap.mmap) -> tuple[int, int]:
+    # Returns the width and candidate count from the header
+    if len(data) < HEADER.size:
+        raise VoteLogError("File too short to be a vote log")
+    magic, version, width, candidate_count = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise VoteLogError("Not a vote log")
+    if version != VERSION:
+        raise VoteLogError(f"Unsupported vote log version {version}")
+    if width not in WIDTH_LIMITS:
+        raise VoteLogError(f"Invalid vote log number width {width}")
+    return width, candidate_count
+
+
+def is_vote_log(path: Path) -> bool:
+    with open(path, "rb") as fp:
+        return fp.read(len(MAGIC)) == MAGIC
+
+
+def encode_votes(votes: Iterable[Iterable[int]], width: int) -> bytes:
+    # Turn votes into records to be appended to a vote log
+    # Votes must have already been checked to fit in the width
+    result = bytearray()
+    if width == 1:
+        for vote in votes:
+            preferences = bytes(vote)
+            result.append(len(preferences))
+            result += preferences
+    else:
+        for vote in votes:
+            numbers = list(vote)
+            result += struct.pack(f"<{len(numbers) + 1}H", len(numbers), *numbers)
+    return bytes(result)
+
+
+def decode_votes(data: bytes, width: int) -> list[list[int]]:
+    # Turn records back into votes, the opposite of encode_votes
+    # data must only contain whole records
+    votes: list[list[int]] = []
+    position = 0
+    if width == 1:
+        while position < len(data):
+            end = position + data[position] + 1
+            votes.append(list(data[position + 1 : end]))
+            position = end
+    else:
+        while position < len(data):
+            length = int.from_bytes(data[position : position + 2], "little")
+            votes.append(list(struct.unpack_from(f"<{length}H", data, position + 2)))
+            position += 2 * (length + 1)
+    return votes
+
+
+def read_vote_log(
+    path: Path, size: int | None = None
+) -> Iterator[tuple[tuple[int, ...], int]]:
+    # Yields each distinct vote in a vote log along with how many times it appeared
+    # The file is memory mapped, and identical records are counted as raw bytes
+    # so each distinct vote only gets decoded once
+    # If size is given then only that many bytes from the start of the file are read,
+    # for when the file could be getting added to while it's read
+    with open(path, "rb") as fp, mmap.mmap(
+        fp.fileno(), size or 0, access=mmap.ACCESS_READ
+    ) as mapped:
+        width, _ = decode_header(mapped)
+        record_counts: dict[bytes, int] = dict()
+        if width == 1:
+            # The same as using _records, but this is the hot loop for most polls
+            # so it's worth skipping the generator
+            position = HEADER.size
+            size = len(mapped)
+            while position < size:
+                end = position + mapped[position] + 1
+                if end > size:
+                    break
+                record = mapped[position:end]
+                record_counts[record] = record_counts.get(record, 0) + 1
+                position = end
+        else:
+            for start, end in _records(mapped, width):
+                record = mapped[start:end]
+                record_counts[record] = record_counts.get(record, 0) + 1
+
+    for record, amount in record_counts.items():
+        if width == 1:
+            # Indexing bytes already gives ints
+            yield tuple(record[1:]), amount
+        else:
+            yield struct.unpack_from(f"<{len(record) // 2 - 1}H", record, 2), amount
+
+
+def _records(mapped: mmap.mmap, width: int) -> Iterator[tuple[int, int]]:
+    # Yields where each record in a mapped vote log starts and ends
+    position = HEADER.size
+    size = len(mapped)
+    while position < size:
+        if width == 1:
+            length = mapped[position]
+        else:
+            length = int.from_bytes(mapped[position : position + 2], "little")
+        end = position + width * (length + 1)
+        if end > size:
+            # A record that's still being written, ignore it
+            break
+        yield position, end
+        position = end
+
+
+def iter_log_records(path: Path) -> Iterator[bytes]:
+    # Yields every record in a vote log as raw bytes, in the order they were written
+    with open(path, "rb") as fp, mmap.mmap(
+        fp.fileno(), 0, access=mmap.ACCESS_READ
+    ) as mapped:
+        width, _ = decode_header(mapped)
+        for start, end in _records(mapped, width):
+            yield mapped[start:end]
+
+
+def iter_log_csv(path: Path, batch_size: int = 10000) -> Iterator[str]:
+    # Yields the contents of a vote log as csv text, a batch of lines at a time,
+    # in the same order the votes were written
+    with open(path, "rb") as fp, mmap.mmap(
+        fp.fileno(), 0, access=mmap.ACCESS_READ
+    ) as mapped:
+        width, _ = decode_header(mapped)
+        lines: list[str] = []
+        for start, end in _records(mapped, width):
+            if width == 1:
+                preferences: Iterable[int] = mapped[start + 1 : end]
+            else:
+                preferences = struct.unpack_from(
+                    f"<{(end - start) // 2 - 1}H", mapped, start + 2
+                )
+            lines.append(",".join([str(x) for x in preferences]) + "\n")
+            if len(lines) >= batch_size:
+                yield "".join(lines)
+                lines = []
+        if len(lines) > 0:
+            yield "".join(lines)
+
+
+def csv_to_log(csv_path: Path, log_path: Path, candidate_count: int) -> None:
+    # Convert a votes csv into a vote log, keeping the order of votes
+    width = width_for(candidate_count)
+    with open(csv_path, "rt") as csv_fp, open(log_path, "wb") as log_fp:
+        log_fp.write(encode_header(candidate_count))
+        for line in csv_fp:
+            line = line.strip()
+            if len(line) != 0:
+                vote = [int(x) for x in line.split(",")]
+                if len(vote) > WIDTH_LIMITS[width] or not all(
+                    0 <= pref <= WIDTH_LIMITS[width] for pref in vote
+                ):
+                    raise VoteLogError(f"Vote can't be stored in a vote log: {line}")
+                log_fp.write(encode_votes([vote], width))
+
+
+def log_to_csv(log_path: Path, csv_path: Path) -> None:
+    with open(csv_path, "wt") as fp:
+        for lines in iter_log_csv(log_path):
+            fp.write(lines)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        "vote_log", description="Convert votes between csv and binary vote logs."
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    to_csv = subparsers.add_parser("to-csv", help="Convert a vote log to csv.")
+    to_csv.add_argument("log_file", type=Path)
+    to_csv.add_argument("csv_file", type=Path)
+
+    from_csv = subparsers.add_parser("from-csv", help="Convert a csv to a vote log.")
+    from_csv.add_argument("csv_file", type=Path)
+    from_csv.add_argument("log_file", type=Path)
+    from_csv.add_argument(
+        "candidate_count", type=int, help="Number of candidates in the poll."
+    )
+
+    args = parser.parse_args()
+    if args.command == "to-csv":
+        log_to_csv(args.log_file, args.csv_file)
+    else:
+        csv_to_log(args.csv_file, args.log_file, args.candidate_count)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,121 @@
-from typing import TextIO
+import mmap
+from array import array
+from collections import Counter
+from pathlib import Path
+from typing import Iterable, Iterator, TextIO
+from vote_log import is_vote_log, read_vote_log
+from vote_db import read_db_votes
 
 vote = tuple[int, ...]
 vote_count = dict[vote, list[int | float]]
 
+# Preferences are stored as unsigned shorts in PackedVotes,
+# which is way more candidates than anyone should need
+MAX_PACKED_PREFERENCE = 65535
+# How much of a votes file to read at once when streaming it, in bytes
+CHUNK_SIZE = 4 * 1024 * 1024
+
+
+def fits_packed(votes: vote) -> bool:
+    # If every preference in a vote can be stored in a PackedVotes
+    # min and max are a lot quicker than checking each preference in python
+    return len(votes) == 0 or (min(votes) >= 0 and max(votes) <= MAX_PACKED_PREFERENCE)
+
+
+class PackedVotes:
+    # A compact alternative to vote_count
+    # Rather than a tuple and a list for every distinct vote,
+    # every distinct vote's preferences are laid end to end in one flat array,
+    # with other arrays giving where each vote starts, and its count and multiplier
+    # Vote i is preferences[offsets[i]:offsets[i + 1]]
+    preferences: "array[int]"
+    offsets: "array[int]"
+    counts: "array[int]"
+    weights: "array[float]"
+    # Votes with preferences that can't fit in the preferences array
+    # These are always invalid, but are kept so that the counter can report them
+    out_of_range: vote_count
+
+    def __init__(self) -> None:
+        self.preferences = array("H")
+        self.offsets = array("I", [0])
+        self.counts = array("Q")
+        self.weights = array("d")
+        self.out_of_range = dict()
+
+    def __len__(self) -> int:
+        return len(self.counts)
+
+    def __repr__(self) -> str:
+        # Mostly for verbose mode, so show it the same way vote_count looks
+        return f"PackedVotes({self.to_vote_count()})"
+
+    def vote(self, index: int) -> vote:
+        return tuple(self.preferences[self.offsets[index] : self.offsets[index + 1]])
+
+    def append(self, preferences: Iterable[int], count: int, weight: float) -> None:
+        # Add a new distinct vote, without checking if it's already present
+        self.preferences.extend(preferences)
+        self.offsets.append(len(self.preferences))
+        self.counts.append(count)
+        self.weights.append(weight)
+
+    def total_votes(self) -> int:
+        return sum(self.counts)
+
+    def select(self, indexes: Iterable[int]) -> "PackedVotes":
+        # Make a new PackedVotes containing only the given votes
+        result = PackedVotes()
+        for index in indexes:
+            result.append(
+                self.preferences[self.offsets[index] : self.offsets[index + 1]],
+                self.counts[index],
+                self.weights[index],
+            )
+        return result
+
+    def to_vote_count(self) -> vote_count:
+        result: vote_count = {
+            self.vote(index): [self.counts[index], self.weights[index]]
+            for index in range(len(self))
+        }
+        result.update(self.out_of_range)
+        return result
+
+    @classmethod
+    def from_vote_count(cls, counted_votes: vote_count) -> "PackedVotes":
+        # Votes in a vote_count are already distinct
+        result = cls()
+        for preferences, amounts in counted_votes.items():
+            assert type(amounts[0]) == int
+            if fits_packed(preferences):
+                result.append(preferences, amounts[0], amounts[1])
+            else:
+                result.out_of_range[preferences] = list(amounts)
+        return result
+
+
+class PackedVoteBuilder:
+    # Builds up a PackedVotes one vote at a time, merging identical votes
+    # The index of votes seen so far is only needed while building,
+    # and gets thrown away with the builder afterwards
+    packed: PackedVotes
+    _index: dict[vote, int]
+
+    def __init__(self) -> None:
+        self.packed = PackedVotes()
+        self._index = dict()
+
+    def add(self, votes: vote, amount: int = 1) -> None:
+        index = self._index.get(votes)
+        if index is not None:
+            self.packed.counts[index] += amount
+        elif fits_packed(votes):
+            self._index[votes] = len(self.packed)
+            self.packed.append(votes, amount, 1.0)
+        else:
+            add_vote(self.packed.out_of_range, votes, amount)
+
 
 def parse_vote_file(fp: TextIO) -> vote_count:
     # Create new count of votes
@@ -20,11 +133,105 @@ def parse_vote_file(fp: TextIO) -> vote_count:
 
             assert len(votes) > 0
 
-            # Get how many votes match this particular vote,
-            # Defaulting to 0 if this vote hasn't been seen before
-            # Then add 1 and add it to the vote register
-            cur_votes = counted_votes.get(votes, [0, 1.0])
-            cur_votes[0] += 1
-            counted_votes[votes] = cur_votes
+            add_vote(counted_votes, votes)
 
     return counted_votes
+
+
+def parse_packed_vote_file(fp: TextIO) -> PackedVotes:
+    # Same as parse_vote_file, but produces a PackedVotes
+    builder = PackedVoteBuilder()
+    for line in fp:
+        line = line.strip()
+        if len(line) != 0:
+            votes = tuple([int(x) for x in line.split(",")])
+
+            assert len(votes) > 0
+
+            builder.add(votes)
+
+    return builder.packed
+
+
+def read_vote_chunks(
+    path: Path, chunk_size: int = CHUNK_SIZE
+) -> Iterator[tuple[vote, int]]:
+    # A faster way of reading a votes file, which reads it in big chunks
+    # Yields each distinct vote in a chunk along with how many times it appeared,
+    # so the whole file never has to be in memory at once
+    with open(path, "rb") as fp:
+        if fp.seek(0, 2) == 0:
+            # mmap can't map empty files
+            return
+        with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            # Most votes files have lots of identical lines,
+            # so each distinct line only gets turned into ints once
+            parsed_lines: dict[bytes, vote] = dict()
+            start = 0
+            size = len(mapped)
+            while start < size:
+                # Cut the chunk off at the end of a line
+                end = mapped.rfind(b"\n", start, start + chunk_size) + 1
+                if end <= start:
+                    # Either the last line has no newline on the end,
+                    # or a line is bigger than the chunk size
+                    end = mapped.find(b"\n", start + chunk_size) + 1
+                    if end <= start:
+                        end = size
+
+                # Counter does the counting of identical lines in C,
+                # which is way faster than doing each line in python
+                for line, amount in Counter(mapped[start:end].split(b"\n")).items():
+                    votes = parsed_lines.get(line)
+                    if votes is None:
+                        stripped = line.strip()
+                        if len(stripped) == 0:
+                            continue
+                        # int() is happy to take bytes directly
+                        votes = tuple([int(x) for x in stripped.split(b",")])
+                        parsed_lines[line] = votes
+                    yield votes, amount
+                start = end
+
+
+def read_votes(path: Path) -> Iterator[tuple[vote, int]]:
+    # Votes can either be stored as a csv, or as a binary vote log (see vote_log.py)
+    if is_vote_log(path):
+        return read_vote_log(path)
+    else:
+        return read_vote_chunks(path)
+
+
+def parse_vote_path(path: Path) -> vote_count:
+    # Same as parse_vote_file, but works on both csv files and vote logs,
+    # and reads csv files in chunks with read_vote_chunks
+    counted_votes: vote_count = dict()
+    for votes, amount in read_votes(path):
+        add_vote(counted_votes, votes, amount)
+    return counted_votes
+
+
+def parse_packed_vote_path(path: Path) -> PackedVotes:
+    # Same as parse_vote_path, but produces a PackedVotes
+    builder = PackedVoteBuilder()
+    for votes, amount in read_votes(path):
+        builder.add(votes, amount)
+    return builder.packed
+
+
+def parse_packed_db_path(path: Path, poll_id: int) -> PackedVotes:
+    # Same as parse_packed_vote_path, but for a poll in a Poller database (see vote_db.py)
+    builder = PackedVoteBuilder()
+    for votes, amount in read_db_votes(path, poll_id):
+        builder.add(votes, amount)
+    return builder.packed
+
+
+def add_vote(counted_votes: vote_count, votes: vote, amount: int = 1) -> None:
+    # Get how many votes match this particular vote,
+    # Defaulting to 0 if this vote hasn't been seen before
+    # Then add the amount and add it to the vote register
+    # Used by both parse_vote_file, and by Poller to keep a running count
+    cur_votes = counted_votes.get(votes, [0, 1.0])
+    cur_votes[0] += amount
+    counted_votes[votes] = cur_votes
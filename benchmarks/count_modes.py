@@ -0,0 +1,58 @@
+# count_modes.py
+# Compares how long counts take with float and fixed point vote values,
+# on randomly generated votes, for each tally backend
+# Run from anywhere, for example: python benchmarks/count_modes.py --votes 1000000
+import argparse
+import json
+import time
+from generate import ElectionShape, make_votes
+
+import teller_path  # noqa: F401
+from counter import count_votes  # noqa: E402
+from poll_config import ConfigData  # noqa: E402
+from tally import TALLY_BACKENDS, COUNT_MODES  # noqa: E402
+from vote_reader import PackedVotes  # noqa: E402
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        "count_modes", description="Benchmark float and fixed point counting."
+    )
+    parser.add_argument("--candidates", type=int, default=20)
+    parser.add_argument("--votes", type=int, default=100000)
+    parser.add_argument("--distinct", type=int, default=20000)
+    parser.add_argument("--winners", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--backend", choices=TALLY_BACKENDS, action="append")
+    args = parser.parse_args()
+
+    shape = ElectionShape(
+        args.candidates, args.votes, args.distinct, args.winners, seed=args.seed
+    )
+    votes = PackedVotes.from_vote_count(make_votes(shape))
+    backends: list[str] = args.backend or TALLY_BACKENDS
+
+    results: dict[str, dict[str, object]] = dict()
+    for backend in backends:
+        for mode in COUNT_MODES:
+            config: ConfigData = shape.config()
+            config["count_mode"] = mode
+            # Best of a few runs, to cut out noise from whatever else is running
+            best = float("inf")
+            outcome: dict[str, list[int]] = dict()
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                outcome = count_votes(votes, config, True, False, backend)
+                best = min(best, time.perf_counter() - start)
+            results[f"{backend}/{mode}"] = {
+                "seconds": round(best, 4),
+                "winners": sorted(outcome["winners"]),
+                "tied_winners": sorted(outcome["tied_winners"]),
+            }
+
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+# count_rules.py
+# Checks that bulk exclusion and early termination give the same winners as
+# the plain rule on every benchmark election, and how much quicker they are
+# Run from anywhere, for example: python benchmarks/count_rules.py --seeds 5
+import argparse
+import copy
+import json
+import sys
+import time
+from generate import make_votes
+from run import SCENARIOS
+
+import teller_path  # noqa: F401
+from counter import count_votes  # noqa: E402
+from count_trace import CountTrace  # noqa: E402
+from poll_config import ConfigData  # noqa: E402
+from tally import TALLY_BACKENDS, COUNT_MODES  # noqa: E402
+from vote_reader import PackedVotes  # noqa: E402
+
+# Whether bulk exclusion and early termination are on for each rule,
+# "plain" being neither of them
+RULES: dict[str, tuple[bool, bool]] = {
+    "plain": (False, False),
+    "bulk": (True, False),
+    "early": (False, True),
+    "both": (True, True),
+}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        "count_rules",
+        description="Compare counting with and without bulk exclusion and early termination.",
+    )
+    parser.add_argument("--scenario", choices=SCENARIOS.keys(), action="append")
+    parser.add_argument(
+        "--seeds", type=int, default=1, help="How many elections to make of each shape."
+    )
+    parser.add_argument("--backend", choices=TALLY_BACKENDS, default="python")
+    parser.add_argument("--repeat", type=int, default=1)
+    args = parser.parse_args()
+
+    results: dict[str, dict[str, object]] = dict()
+    differences: list[str] = []
+    for name in args.scenario or SCENARIOS.keys():
+        for seed in range(args.seeds):
+            shape = copy.copy(SCENARIOS[name])
+            shape.seed += seed
+            votes = PackedVotes.from_vote_count(make_votes(shape))
+            for mode in COUNT_MODES:
+                plain: dict[str, list[int]] | None = None
+                for rule, (bulk_exclusion, early_termination) in RULES.items():
+                    config: ConfigData = shape.config()
+                    config["count_mode"] = mode
+                    config["bulk_exclusion"] = bulk_exclusion
+                    config["early_termination"] = early_termination
+
+                    # Best of a few runs, to cut out noise from whatever else is running
+                    best = float("inf")
+                    outcome: dict[str, list[int]] = dict()
+                    trace = CountTrace()
+                    for _ in range(args.repeat):
+                        trace = CountTrace()
+                        start = time.perf_counter()
+                        outcome = count_votes(
+                            votes, config, True, False, args.backend, trace
+                        )
+                        best = min(best, time.perf_counter() - start)
+
+                    outcome = {
+                        "winners": sorted(outcome["winners"]),
+                        "tied_winners": sorted(outcome["tied_winners"]),
+                    }
+                    if plain is None:
+                        plain = outcome
+                    key = f"{name}/{seed}/{mode}/{rule}"
+                    results[key] = {
+                        "seconds": round(best, 4),
+                        "rounds": len(trace.actions),
+                        "same_as_plain": outcome == plain,
+                        **outcome,
+                    }
+                    if outcome != plain:
+                        differences.append(key)
+
+    print(json.dumps(results, indent=4))
+    if len(differences) > 0:
+        print(f"Different winners to the plain rule: {differences}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+# generate.py
+# Makes up elections to benchmark with, as a config.json and votes.csv
+# Run from anywhere, for example:
+#   python benchmarks/generate.py out_folder --candidates 20 --votes 100000
+import argparse
+import json
+import random
+from pathlib import Path
+
+import teller_path  # noqa: F401
+from poll_config import ConfigData  # noqa: E402
+from vote_reader import vote_count, add_vote  # noqa: E402
+from vote_log import csv_to_log  # noqa: E402
+
+
+class ElectionShape:
+    # Everything about a made up election, other than the votes themselves
+    candidates: int
+    votes: int
+    # Votes are drawn from this many distinct votes,
+    # like a real poll where a lot of people vote the same way
+    distinct: int
+    winners: int
+    minimum_preferences: int
+    # Longest a vote can be, or None for up to every candidate
+    max_length: int | None
+    # How much more popular the most popular candidates are,
+    # 0 makes every candidate equally popular
+    skew: float
+    # Number of how to vote cards, 0 for none
+    # Each vote starts off following one of them for a random number of preferences,
+    # so lots of votes share the same first few preferences like in a real poll
+    tickets: int
+    seed: int
+
+    def __init__(
+        self,
+        candidates: int,
+        votes: int,
+        distinct: int,
+        winners: int = 1,
+        minimum_preferences: int = 1,
+        max_length: int | None = None,
+        skew: float = 1.0,
+        tickets: int = 0,
+        seed: int = 0,
+    ) -> None:
+        assert candidates >= 2, "Need at least 2 candidates"
+        assert 1 <= winners < candidates, "Need between 1 and candidates - 1 winners"
+        assert distinct >= 1, "Need at least 1 distinct vote"
+        self.candidates = candidates
+        self.votes = votes
+        self.distinct = distinct
+        self.winners = winners
+        self.minimum_preferences = minimum_preferences
+        self.max_length = max_length
+        self.skew = skew
+        self.tickets = tickets
+        self.seed = seed
+
+    def as_dict(self) -> dict[str, object]:
+        return dict(vars(self))
+
+    def config(self) -> ConfigData:
+        return {
+            "election_name": "Benchmark",
+            "minimum_preferences": self.minimum_preferences,
+            "winner_amount": self.winners,
+            "candidate_names": [f"Candidate {i}" for i in range(self.candidates)],
+            "candidate_descriptions": [""] * self.candidates,
+            "randomise_order": False,
+        }
+
+
+def make_votes(shape: ElectionShape) -> vote_count:
+    rng = random.Random(shape.seed)
+    # Candidate i is roughly 1 / (i + 1) ** skew times as popular as the first,
+    # then shuffled so the popular candidates aren't always the low numbers
+    popularity = [1 / (i + 1) ** shape.skew for i in range(shape.candidates)]
+    rng.shuffle(popularity)
+
+    # Votes have to be long enough to meet minimum_preferences,
+    # or include every candidate if it's 0 or less
+    if shape.minimum_preferences <= 0:
+        shortest = shape.candidates
+    else:
+        shortest = min(shape.minimum_preferences, shape.candidates)
+    longest = shape.candidates if shape.max_length is None else shape.max_length
+    longest = max(shortest, min(longest, shape.candidates))
+
+    def random_order() -> list[int]:
+        # Weighted random order without replacement
+        return sorted(
+            range(shape.candidates),
+            key=lambda c: rng.random() ** (1 / popularity[c]),
+            reverse=True,
+        )
+
+    tickets = [random_order() for _ in range(shape.tickets)]
+    distinct_votes: list[tuple[int, ...]] = []
+    for _ in range(shape.distinct):
+        length = rng.randint(shortest, longest)
+        order = random_order()
+        if len(tickets) > 0:
+            ticket = rng.choice(tickets)
+            followed = ticket[: rng.randint(0, length)]
+            order = followed + [c for c in order if c not in followed]
+        distinct_votes.append(tuple(order[:length]))
+
+    result: vote_count = dict()
+    for vote, amount in zip(
+        distinct_votes, _split(shape.votes, shape.distinct, rng), strict=True
+    ):
+        if amount > 0:
+            add_vote(result, vote, amount)
+    return result
+
+
+def _split(total: int, parts: int, rng: random.Random) -> list[int]:
+    # Split total into parts random sized amounts
+    cuts = sorted(rng.randint(0, total) for _ in range(parts - 1))
+    return [end - start for start, end in zip([0] + cuts, cuts + [total])]
+
+
+def write_election(
+    shape: ElectionShape, folder: Path, vote_log: bool = False
+) -> tuple[Path, Path]:
+    # Writes config.json and votes.csv into folder, shuffling the votes,
+    # and also votes.bin if vote_log is set
+    # Returns the paths to the config and votes csv
+    folder.mkdir(parents=True, exist_ok=True)
+    config_path = folder / "config.json"
+    votes_path = folder / "votes.csv"
+    with open(config_path, "wt") as fp:
+        json.dump(shape.config(), fp)
+
+    lines: list[str] = []
+    for vote, (amount, _) in make_votes(shape).items():
+        lines.extend([",".join(str(x) for x in vote) + "\n"] * int(amount))
+    random.Random(shape.seed).shuffle(lines)
+    with open(votes_path, "wt") as fp:
+        fp.writelines(lines)
+
+    if vote_log:
+        csv_to_log(votes_path, folder / "votes.bin", shape.candidates)
+    return config_path, votes_path
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        "generate", description="Make up an election to benchmark with."
+    )
+    parser.add_argument("folder", type=Path, help="Where to write the files.")
+    parser.add_argument("--candidates", type=int, default=10)
+    parser.add_argument("--votes", type=int, default=10000)
+    parser.add_argument("--distinct", type=int, default=1000)
+    parser.add_argument("--winners", type=int, default=1)
+    parser.add_argument("--minimum-preferences", type=int, default=1)
+    parser.add_argument("--max-length", type=int)
+    parser.add_argument("--skew", type=float, default=1.0)
+    parser.add_argument("--tickets", type=int, default=0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--vote-log", action="store_true", help="Also write a votes.bin vote log."
+    )
+    args = parser.parse_args()
+
+    shape = ElectionShape(
+        args.candidates,
+        args.votes,
+        args.distinct,
+        args.winners,
+        args.minimum_preferences,
+        args.max_length,
+        args.skew,
+        args.tickets,
+        args.seed,
+    )
+    write_election(shape, args.folder, args.vote_log)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,348 @@
+# run.py
+# Benchmarks Teller's parsing and counting, and Poller's vote to results latency,
+# on made up elections of a few different shapes
+# Results are saved as json, and can be compared against an earlier run:
+#   python benchmarks/run.py --output new.json --compare old.json
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Callable
+from generate import ElectionShape, make_votes, write_election
+
+import teller_path  # noqa: F401
+from counter import count_votes  # noqa: E402
+from tally import TALLY_BACKENDS  # noqa: E402
+from vote_reader import (  # noqa: E402
+    vote_count,
+    parse_vote_file,
+    parse_vote_path,
+    parse_packed_vote_path,
+)
+from ballot_trie import BallotTrie  # noqa: E402
+
+REPO_FOLDER = Path(__file__).absolute().parent.parent
+
+SCENARIOS: dict[str, ElectionShape] = {
+    "small": ElectionShape(candidates=6, votes=1000, distinct=200),
+    "medium": ElectionShape(candidates=20, votes=100000, distinct=20000, winners=3),
+    "large": ElectionShape(
+        candidates=40, votes=1000000, distinct=100000, winners=5, skew=1.5
+    ),
+    "partial": ElectionShape(
+        candidates=30,
+        votes=100000,
+        distinct=20000,
+        winners=2,
+        minimum_preferences=3,
+        max_length=6,
+    ),
+    "many_winners": ElectionShape(
+        candidates=50, votes=200000, distinct=50000, winners=20, skew=0.5
+    ),
+    "flat": ElectionShape(candidates=12, votes=100000, distinct=5000, skew=0.0),
+    # Lots of candidates and one winner, so most rounds just exclude someone
+    "many_candidates": ElectionShape(candidates=60, votes=100000, distinct=20000),
+    # Short votes that mostly follow a how to vote card for a few preferences
+    "clustered": ElectionShape(
+        candidates=40,
+        votes=200000,
+        distinct=50000,
+        winners=5,
+        max_length=8,
+        tickets=4,
+    ),
+}
+
+# Poller's vote to results latency is measured over the test client,
+# which is slow enough that these need to be much smaller
+POLLER_SCENARIOS: dict[str, ElectionShape] = {
+    "small": ElectionShape(candidates=6, votes=2000, distinct=200),
+    "medium": ElectionShape(candidates=20, votes=10000, distinct=2000, winners=3),
+}
+
+
+def best_time(func: Callable[[], Any], repeat: int) -> float:
+    # Best of a few runs, to cut out noise from whatever else is running
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return round(best, 6)
+
+
+def peak_memory(func: Callable[[], Any]) -> int:
+    # Most memory allocated at once while running func, in bytes
+    # tracemalloc slows things down a lot, so this is kept separate from timing
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def parse_csv_line_by_line(path: Path) -> vote_count:
+    # The old way of reading votes files, a line at a time,
+    # to compare against reading them in chunks
+    with open(path) as fp:
+        return parse_vote_file(fp)
+
+
+def available_backends() -> list[str]:
+    backends = ["python", "trie"]
+    try:
+        import numpy  # noqa: F401
+
+        backends.append("numpy")
+    except ImportError:
+        pass
+    return [backend for backend in TALLY_BACKENDS if backend in backends]
+
+
+def bench_teller(shape: ElectionShape, folder: Path, repeat: int) -> dict[str, Any]:
+    config_path, csv_path = write_election(shape, folder, vote_log=True)
+    log_path = folder / "votes.bin"
+    config = shape.config()
+    packed = parse_packed_vote_path(log_path)
+    # How Poller hands votes to the trie backend, already built up as they came in
+    trie = BallotTrie.from_packed(packed)
+
+    result: dict[str, Any] = {
+        "shape": shape.as_dict(),
+        "distinct_votes": len(packed),
+        "trie_nodes": len(trie),
+        "file_bytes": {
+            "csv": csv_path.stat().st_size,
+            "log": log_path.stat().st_size,
+        },
+        "parse_seconds": {
+            "csv_line_by_line": best_time(
+                lambda: parse_csv_line_by_line(csv_path), repeat
+            ),
+            "csv_dict": best_time(lambda: parse_vote_path(csv_path), repeat),
+            "csv_packed": best_time(lambda: parse_packed_vote_path(csv_path), repeat),
+            "log_packed": best_time(lambda: parse_packed_vote_path(log_path), repeat),
+        },
+        "count_seconds": {
+            backend: best_time(
+                lambda: count_votes(packed, config, True, False, backend), repeat
+            )
+            for backend in available_backends()
+        },
+        "peak_bytes": {
+            "parse_csv_line_by_line": peak_memory(
+                lambda: parse_csv_line_by_line(csv_path)
+            ),
+            "parse_csv": peak_memory(lambda: parse_packed_vote_path(csv_path)),
+            "parse_log": peak_memory(lambda: parse_packed_vote_path(log_path)),
+            "count": {
+                backend: peak_memory(
+                    lambda: count_votes(packed, config, True, False, backend)
+                )
+                for backend in available_backends()
+            },
+        },
+    }
+    result["count_seconds"]["trie_prebuilt"] = best_time(
+        lambda: count_votes(trie, config, True, False, "trie"), repeat
+    )
+    result["peak_bytes"]["count"]["trie_prebuilt"] = peak_memory(
+        lambda: count_votes(trie, config, True, False, "trie")
+    )
+    return result
+
+
+def bench_poller(shape: ElectionShape, folder: Path) -> dict[str, Any]:
+    # Send every vote through /submit_vote, then see how long until
+    # /get_poll_results includes all of them
+    # Poller makes its polls folder in the working directory when imported
+    os.chdir(folder)
+    os.environ.setdefault("TELLER_LOCATION", str(REPO_FOLDER / "Teller" / "main.py"))
+    sys.path.insert(0, str(REPO_FOLDER / "Poller"))
+    # Teller has a main.py too, so this makes sure it's Poller's
+    poller = importlib.import_module("main")
+
+    ballots: list[list[int]] = []
+    for vote, (amount, _) in make_votes(shape).items():
+        ballots.extend([list(vote)] * int(amount))
+
+    async def run() -> dict[str, Any]:
+        client = poller.app.test_client()
+        response = await client.post("/submit_poll", json=shape.config())
+        poll_id = (await response.get_json())["election_id"]
+
+        latencies: list[float] = []
+        start = time.perf_counter()
+        for ballot in ballots:
+            sent = time.perf_counter()
+            await client.post(
+                "/submit_vote", json={"election_id": poll_id, "preferences": ballot}
+            )
+            latencies.append(time.perf_counter() - sent)
+        submitted = time.perf_counter()
+
+        # Wait for a count covering every vote
+        while True:
+            response = await client.post(
+                "/get_poll_results", json={"election_id": poll_id}
+            )
+            results = await response.get_json()
+            if sum(results["first_preferences"]) >= len(ballots):
+                break
+            await asyncio.sleep(0.001)
+        counted = time.perf_counter()
+        await poller.poll_manager.close()
+
+        latencies.sort()
+        return {
+            "shape": shape.as_dict(),
+            "submit_seconds": round(submitted - start, 6),
+            "votes_per_second": round(len(ballots) / (submitted - start), 1),
+            "submit_latency_seconds": {
+                "mean": round(statistics.fmean(latencies), 6),
+                "p50": round(latencies[len(latencies) // 2], 6),
+                "p99": round(latencies[len(latencies) * 99 // 100], 6),
+            },
+            "last_vote_to_results_seconds": round(counted - submitted, 6),
+        }
+
+    return asyncio.run(run())
+
+
+def poller_subprocess(name: str, folder: Path) -> dict[str, Any]:
+    # Each Poller benchmark gets its own process, as Poller keeps global state
+    completed = subprocess.run(
+        [sys.executable, __file__, "--poller-scenario", name, "--folder", str(folder)],
+        capture_output=True,
+        text=True,
+    )
+    if completed.returncode != 0:
+        return {"error": completed.stderr.strip().splitlines()[-1:]}
+    output: dict[str, Any] = json.loads(completed.stdout.strip().splitlines()[-1])
+    return output
+
+
+def compare(old: dict[str, Any], new: dict[str, Any], threshold: float) -> list[str]:
+    # Lists every timing that's got more than threshold times slower
+    regressions: list[str] = []
+
+    def walk(old_value: Any, new_value: Any, path: str) -> None:
+        if isinstance(old_value, dict) and isinstance(new_value, dict):
+            for key in old_value.keys() & new_value.keys():
+                walk(old_value[key], new_value[key], f"{path}/{key}")
+        elif (
+            "seconds" in path
+            and isinstance(old_value, (int, float))
+            and isinstance(new_value, (int, float))
+            and old_value > 0
+        ):
+            ratio = new_value / old_value
+            if ratio > threshold:
+                regressions.append(
+                    f"{path}: {old_value} -> {new_value} ({ratio:.2f}x slower)"
+                )
+
+    walk(old["teller"], new["teller"], "teller")
+    walk(old.get("poller", {}), new.get("poller", {}), "poller")
+    return regressions
+
+
+def git_commit() -> str | None:
+    try:
+        completed = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=REPO_FOLDER,
+            capture_output=True,
+            text=True,
+        )
+    except OSError:
+        return None
+    return completed.stdout.strip() or None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        "run", description="Benchmark Teller and Poller on made up elections."
+    )
+    parser.add_argument(
+        "--scenario",
+        choices=list(SCENARIOS),
+        action="append",
+        help="Only run these scenarios. Can be given more than once.",
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--no-poller", action="store_true", help="Skip the Poller benchmarks."
+    )
+    parser.add_argument("--output", type=Path, help="Where to save the results json.")
+    parser.add_argument(
+        "--compare", type=Path, help="Earlier results json to check for regressions."
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=1.25,
+        help="How many times slower a timing needs to get to count as a regression.",
+    )
+    # Used to run the Poller benchmarks in their own process
+    parser.add_argument("--poller-scenario", help=argparse.SUPPRESS)
+    parser.add_argument("--folder", type=Path, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.poller_scenario is not None:
+        result = bench_poller(POLLER_SCENARIOS[args.poller_scenario], args.folder)
+        print(json.dumps(result))
+        return
+
+    scenarios: list[str] = args.scenario or list(SCENARIOS)
+    results: dict[str, Any] = {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "teller": dict(),
+        "poller": dict(),
+    }
+    with tempfile.TemporaryDirectory() as temp:
+        for name in scenarios:
+            print(f"Benchmarking Teller on {name}", file=sys.stderr)
+            results["teller"][name] = bench_teller(
+                SCENARIOS[name], Path(temp) / "teller" / name, args.repeat
+            )
+        if not args.no_poller:
+            for name in POLLER_SCENARIOS:
+                print(f"Benchmarking Poller on {name}", file=sys.stderr)
+                folder = Path(temp) / "poller" / name
+                folder.mkdir(parents=True)
+                results["poller"][name] = poller_subprocess(name, folder)
+
+    output = json.dumps(results, indent=4)
+    if args.output is not None:
+        with open(args.output, "wt") as fp:
+            fp.write(output + "\n")
+    else:
+        print(output)
+
+    if args.compare is not None:
+        with open(args.compare, "rt") as fp:
+            old = json.load(fp)
+        regressions = compare(old, results, args.threshold)
+        for regression in regressions:
+            print(f"Regression! {regression}", file=sys.stderr)
+        if len(regressions) > 0:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,8 @@
+# teller_path.py
+# The benchmarks import Teller as a library, so the Teller folder next to
+# this one needs to be importable, the same as Poller's teller_path.py
+# Import this before importing anything from Teller
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).absolute().parent.parent / "Teller"))